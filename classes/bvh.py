@@ -0,0 +1,458 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import math
+
+class BVHNode():
+    """
+    A node of the BVH. Leaves reference an item, inner nodes have
+    exactly two children.
+    
+    The box is a list [xmin, ymin, zmin, xmax, ymax, zmax]. For leaves
+    it is the "fat" box, i.e. the world bounds of the item enlarged by
+    a margin, so that small movements don't change the tree.
+    """
+    
+    __slots__ = ["box", "parent", "child1", "child2", "height", "item"]
+    
+    def __init__(self, box, item=None):
+        self.box = box
+        self.parent = None
+        self.child1 = None
+        self.child2 = None
+        self.height = 0
+        self.item = item
+        
+        
+    def is_leaf(self):
+        return self.child1 == None
+
+
+class BVH():
+    """
+    This class implements a dynamic bounding volume hierarchy over the
+    world-space bounds of items. It allows to find the items within the
+    view frustum, or hit by a ray, without touching every item.
+    
+    The tree is maintained incrementally. Leaves are inserted at the
+    place of least cost (surface area heuristic) and the tree is kept
+    balanced by rotations, following the dynamic tree of the Box2D
+    physics engine by Erin Catto.
+    
+    When an item moves, its leaf is only touched when the new bounds
+    leave the enlarged ("fat") box of the leaf. If the new bounds still
+    overlap the old box, the leaf and its ancestors are refitted in
+    place, otherwise the leaf is removed and inserted again.
+    
+    Items without bounds (no vertices yet) can not be placed into the
+    tree. They are remembered separately and always reported as
+    visible.
+    """
+    
+    def __init__(self, margin=0.1):
+        """
+        @param margin
+        Fraction of the largest extent by which leaf boxes are enlarged.
+        """
+        self.margin = margin
+        self.root = None
+        self.leaves = {} # item -> BVHNode
+        self.unbounded = set() # items without bounds
+        
+        
+    def __len__(self):
+        return len(self.leaves) + len(self.unbounded)
+        
+        
+    def update(self, item):
+        """
+        Insert `item`, or move it after its world bounds have changed.
+        Call this whenever vertices or transformation of the item change.
+        """
+        bounds = item.world_bounds()
+        leaf = self.leaves.get(item)
+        
+        if bounds == None:
+            if leaf != None:
+                self._remove_leaf(leaf)
+                del self.leaves[item]
+            self.unbounded.add(item)
+            return
+        
+        self.unbounded.discard(item)
+        box = list(bounds[0]) + list(bounds[1])
+        
+        if leaf == None:
+            leaf = BVHNode(self._fatten(box), item)
+            self.leaves[item] = leaf
+            self._insert_leaf(leaf)
+            
+        elif BVH.box_contains(leaf.box, box):
+            # small movement, nothing to do
+            pass
+        
+        elif BVH.box_overlaps(leaf.box, box):
+            # refit the leaf and its ancestors
+            leaf.box = self._fatten(box)
+            node = leaf.parent
+            while node != None:
+                new_box = BVH.box_union(node.child1.box, node.child2.box)
+                if new_box == node.box:
+                    break
+                node.box = new_box
+                node = node.parent
+                
+        else:
+            # moved far away, re-insert at the best place
+            self._remove_leaf(leaf)
+            leaf.box = self._fatten(box)
+            self._insert_leaf(leaf)
+            
+            
+    def remove(self, item):
+        """
+        Remove `item` from the tree. Unknown items are ignored.
+        """
+        self.unbounded.discard(item)
+        leaf = self.leaves.pop(item, None)
+        if leaf != None:
+            self._remove_leaf(leaf)
+            
+            
+    def query_frustum(self, frustum):
+        """
+        Returns a list of all items which are at least partially inside
+        of `frustum`, plus all items without bounds.
+        
+        Subtrees completely inside of the frustum are added without
+        further tests.
+        
+        @param frustum
+        An instance of Frustum
+        """
+        result = list(self.unbounded)
+        if self.root == None:
+            return result
+        
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            inside = frustum.classify_box(node.box)
+            if inside < 0:
+                continue
+            
+            if node.is_leaf():
+                if inside > 0 or node.item.is_visible(frustum):
+                    result.append(node.item)
+            elif inside > 0:
+                BVH._collect(node, result)
+            else:
+                stack.append(node.child1)
+                stack.append(node.child2)
+                
+        return result
+        
+        
+    def query_ray(self, origin, direction, t_max=math.inf, tan_tolerance=0):
+        """
+        Returns a list of tuples (t, item) for all items whose bounds
+        are hit by the ray, sorted by the ray parameter t at which the
+        bounds are entered. Items without bounds are not reported.
+        
+        With `tan_tolerance`, the ray is a cone. Bounds are hit when they
+        are closer to the ray than `tan_tolerance` times their distance
+        from the origin. This is tested conservatively, so that items
+        whose bounds have no thickness, e.g. straight lines, are found
+        when picking within a tolerance.
+        
+        @param origin
+        Start of the ray in world coordinates, 3-tuple
+        
+        @param direction
+        Direction of the ray in world coordinates, 3-tuple. Does not
+        need to be normalized; t is measured in multiples of it.
+        
+        @param t_max
+        Only report hits with t smaller than this.
+        
+        @param tan_tolerance
+        Tangent of the opening angle of the cone.
+        """
+        result = []
+        if self.root == None:
+            return result
+        
+        inv = [1 / d if d != 0 else math.inf for d in direction]
+        
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            t = BVH.ray_box(origin, inv, BVH.box_widen(node.box, origin, tan_tolerance), t_max)
+            if t == None:
+                continue
+            
+            if node.is_leaf():
+                box_min, box_max, center, radius = node.item.world_bounds()
+                box = BVH.box_widen(list(box_min) + list(box_max), origin, tan_tolerance)
+                t = BVH.ray_box(origin, inv, box, t_max)
+                if t != None:
+                    result.append((t, node.item))
+            else:
+                stack.append(node.child1)
+                stack.append(node.child2)
+                
+        result.sort(key=lambda hit: hit[0])
+        return result
+        
+        
+    def _fatten(self, box):
+        extent = max(box[3] - box[0], box[4] - box[1], box[5] - box[2])
+        m = extent * self.margin
+        return [box[0] - m, box[1] - m, box[2] - m, box[3] + m, box[4] + m, box[5] + m]
+        
+        
+    def _insert_leaf(self, leaf):
+        if self.root == None:
+            self.root = leaf
+            leaf.parent = None
+            return
+        
+        # find the best sibling
+        box = leaf.box
+        node = self.root
+        while not node.is_leaf():
+            area = BVH.box_cost(node.box)
+            combined_area = BVH.box_cost(BVH.box_union(node.box, box))
+            
+            # cost of creating a new parent for this node and the new leaf
+            cost = 2 * combined_area
+            
+            # minimum cost of pushing the leaf further down the tree
+            inheritance_cost = 2 * (combined_area - area)
+            
+            costs = []
+            for child in (node.child1, node.child2):
+                child_cost = BVH.box_cost(BVH.box_union(child.box, box))
+                if not child.is_leaf():
+                    child_cost -= BVH.box_cost(child.box)
+                costs.append(child_cost + inheritance_cost)
+                
+            if cost < costs[0] and cost < costs[1]:
+                break
+            
+            node = node.child1 if costs[0] < costs[1] else node.child2
+            
+        sibling = node
+        
+        # create a new parent
+        old_parent = sibling.parent
+        new_parent = BVHNode(BVH.box_union(box, sibling.box))
+        new_parent.parent = old_parent
+        new_parent.height = sibling.height + 1
+        new_parent.child1 = sibling
+        new_parent.child2 = leaf
+        sibling.parent = new_parent
+        leaf.parent = new_parent
+        
+        if old_parent == None:
+            self.root = new_parent
+        elif old_parent.child1 is sibling:
+            old_parent.child1 = new_parent
+        else:
+            old_parent.child2 = new_parent
+            
+        self._fix_upwards(leaf.parent)
+        
+        
+    def _remove_leaf(self, leaf):
+        if leaf is self.root:
+            self.root = None
+            return
+        
+        parent = leaf.parent
+        grand_parent = parent.parent
+        sibling = parent.child2 if parent.child1 is leaf else parent.child1
+        leaf.parent = None
+        
+        if grand_parent == None:
+            self.root = sibling
+            sibling.parent = None
+            return
+        
+        # destroy parent and connect sibling to grand_parent
+        if grand_parent.child1 is parent:
+            grand_parent.child1 = sibling
+        else:
+            grand_parent.child2 = sibling
+        sibling.parent = grand_parent
+        
+        self._fix_upwards(grand_parent)
+        
+        
+    def _fix_upwards(self, node):
+        """
+        Re-balance, re-fit and update heights from `node` up to the root.
+        """
+        while node != None:
+            node = self._balance(node)
+            node.height = 1 + max(node.child1.height, node.child2.height)
+            node.box = BVH.box_union(node.child1.box, node.child2.box)
+            node = node.parent
+            
+            
+    def _balance(self, a):
+        """
+        Perform a left or right rotation if node `a` is imbalanced.
+        Returns the new root of the subtree.
+        """
+        if a.is_leaf() or a.height < 2:
+            return a
+        
+        b = a.child1
+        c = a.child2
+        balance = c.height - b.height
+        
+        if balance > 1:
+            return self._rotate(a, c, b, False)
+        if balance < -1:
+            return self._rotate(a, b, c, True)
+        return a
+    
+    
+    def _rotate(self, a, up, other, up_is_child1):
+        """
+        Rotate child `up` of `a` one level up. `other` is the other child of `a`.
+        """
+        f = up.child1
+        g = up.child2
+        
+        # swap a and up
+        up.child1 = a
+        up.parent = a.parent
+        a.parent = up
+        
+        if up.parent == None:
+            self.root = up
+        elif up.parent.child1 is a:
+            up.parent.child1 = up
+        else:
+            up.parent.child2 = up
+            
+        # the higher grandchild stays with up, the other one goes to a
+        if f.height > g.height:
+            keep, give = f, g
+        else:
+            keep, give = g, f
+            
+        up.child2 = keep
+        if up_is_child1:
+            a.child1 = give
+        else:
+            a.child2 = give
+        give.parent = a
+        
+        a.box = BVH.box_union(other.box, give.box)
+        up.box = BVH.box_union(a.box, keep.box)
+        a.height = 1 + max(other.height, give.height)
+        up.height = 1 + max(a.height, keep.height)
+        return up
+    
+    
+    @staticmethod
+    def _collect(node, result):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.is_leaf():
+                result.append(node.item)
+            else:
+                stack.append(node.child1)
+                stack.append(node.child2)
+                
+                
+    @staticmethod
+    def box_union(a, b):
+        return [min(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]),
+                max(a[3], b[3]), max(a[4], b[4]), max(a[5], b[5])]
+    
+    
+    @staticmethod
+    def box_cost(a):
+        """
+        Sum of the extents of box `a`. Like the surface area, this grows
+        with the size of the box, but stays meaningful for flat boxes.
+        """
+        return (a[3] - a[0]) + (a[4] - a[1]) + (a[5] - a[2])
+    
+    
+    @staticmethod
+    def box_contains(a, b):
+        return (a[0] <= b[0] and a[1] <= b[1] and a[2] <= b[2] and
+                a[3] >= b[3] and a[4] >= b[4] and a[5] >= b[5])
+    
+    
+    @staticmethod
+    def box_overlaps(a, b):
+        return (a[0] <= b[3] and a[1] <= b[4] and a[2] <= b[5] and
+                a[3] >= b[0] and a[4] >= b[1] and a[5] >= b[2])
+    
+    
+    @staticmethod
+    def box_widen(box, origin, tan_tolerance):
+        """
+        Returns `box` enlarged by `tan_tolerance` times the distance of
+        its farthest corner from `origin`. A ray hitting the result is
+        closer to all points of the box than `tan_tolerance` times their
+        distance from `origin`.
+        """
+        if tan_tolerance == 0:
+            return box
+        far = 0
+        for i in range(3):
+            far += max((origin[i] - box[i]) ** 2, (origin[i] - box[i + 3]) ** 2)
+        m = math.sqrt(far) * tan_tolerance
+        return [box[0] - m, box[1] - m, box[2] - m, box[3] + m, box[4] + m, box[5] + m]
+    
+    
+    @staticmethod
+    def ray_box(origin, inv_direction, box, t_max):
+        """
+        Slab test. Returns the ray parameter t >= 0 at which the ray
+        enters `box`, or None if the box is missed.
+        """
+        t_near = 0
+        t_far = t_max
+        for i in range(3):
+            if inv_direction[i] == math.inf:
+                # ray parallel to slab
+                if origin[i] < box[i] or origin[i] > box[i + 3]:
+                    return None
+                continue
+            t1 = (box[i] - origin[i]) * inv_direction[i]
+            t2 = (box[i + 3] - origin[i]) * inv_direction[i]
+            if t1 > t2:
+                t1, t2 = t2, t1
+            if t1 > t_near: t_near = t1
+            if t2 < t_far: t_far = t2
+            if t_near > t_far:
+                return None
+        return t_near
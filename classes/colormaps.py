@@ -0,0 +1,158 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import numpy as np
+
+import OpenGL
+from OpenGL.GL import *
+
+class Colormaps():
+    """
+    Registry of color palettes, and their 1D textures for shaders which
+    map a scalar like height to a color, e.g. the heightmap shader.
+    
+    A palette is a list of stops (position, (r, g, b)) with positions
+    increasing from 0 to 1. Colors are linearly interpolated between
+    stops. Two stops at the same position make a sharp edge.
+    
+    Each palette is uploaded once as a texture and shared by all items.
+    Switching the palette of an item only selects another texture, the
+    shader and the vertex data stay untouched.
+    """
+    
+    palettes = {
+        # the 7-step spectrum formerly computed in the heightmap shader
+        "spectrum": [
+            (0, (0.2, 0.2, 0)),
+            (1/6, (0.2, 0.2, 1)),
+            (1/6, (0, 0, 1)),
+            (2/6, (0, 1, 1)),
+            (3/6, (0, 1, 0)),
+            (4/6, (1, 0, 0)),
+            (5/6, (1, 1, 0)),
+            (1, (1, 1, 1)),
+            ],
+        "gray": [
+            (0, (0, 0, 0)),
+            (1, (1, 1, 1)),
+            ],
+        "jet": [
+            (0, (0, 0, 0.5)),
+            (1/8, (0, 0, 1)),
+            (3/8, (0, 1, 1)),
+            (5/8, (1, 1, 0)),
+            (7/8, (1, 0, 0)),
+            (1, (0.5, 0, 0)),
+            ],
+        "viridis": [
+            (0, (0.267, 0.005, 0.329)),
+            (0.25, (0.230, 0.322, 0.546)),
+            (0.5, (0.128, 0.567, 0.551)),
+            (0.75, (0.369, 0.789, 0.383)),
+            (1, (0.993, 0.906, 0.144)),
+            ],
+        # for deviations from a reference, e.g. probed warpage
+        "diverging": [
+            (0, (0.23, 0.30, 0.75)),
+            (0.5, (0.87, 0.87, 0.87)),
+            (1, (0.71, 0.02, 0.15)),
+            ],
+        }
+    
+    size = 256 # number of texels
+    
+    _textures = {} # name -> texture ID
+    
+    
+    @staticmethod
+    def register(name, stops):
+        """
+        Adds or replaces a palette. A texture already created for `name`
+        is updated in place, so that all items using it change.
+        
+        @param stops
+        List of tuples (position, (r, g, b)), see class documentation.
+        """
+        Colormaps.palettes[name] = list(stops)
+        if name in Colormaps._textures:
+            Colormaps._upload(name, Colormaps._textures[name])
+            
+            
+    @staticmethod
+    def table(name, size=None):
+        """
+        Returns the palette `name` sampled at the texel centers as numpy
+        array of shape (size, 4), RGBA, float32.
+        """
+        if size == None:
+            size = Colormaps.size
+        stops = Colormaps.palettes[name]
+        positions = [stop[0] for stop in stops]
+        colors = np.array([stop[1] for stop in stops], dtype=np.float64)
+        
+        u = (np.arange(size) + 0.5) / size
+        result = np.ones((size, 4), dtype=np.float32)
+        for channel in range(3):
+            result[:, channel] = np.interp(u, positions, colors[:, channel])
+        return result
+    
+    
+    @staticmethod
+    def texture(name):
+        """
+        Returns the ID of the GL_TEXTURE_1D of palette `name`. It is
+        created on first use and left bound.
+        """
+        if not name in Colormaps._textures:
+            if not name in Colormaps.palettes:
+                raise KeyError("Unknown colormap {}".format(name))
+            texture_id = glGenTextures(1)
+            Colormaps._upload(name, texture_id)
+            Colormaps._textures[name] = texture_id
+        return Colormaps._textures[name]
+    
+    
+    @staticmethod
+    def _upload(name, texture_id):
+        data = Colormaps.table(name)
+        glBindTexture(GL_TEXTURE_1D, texture_id)
+        glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexImage1D(GL_TEXTURE_1D, 0, GL_RGBA, len(data), 0, GL_RGBA, GL_FLOAT, data)
+        
+        
+    @staticmethod
+    def bind(program, name, state):
+        """
+        Binds the texture of palette `name` to texture unit 0 for the
+        "colormap" uniform of `program`. Does nothing if the program has
+        no such uniform.
+        
+        @param state
+        The GlState of the current frame.
+        """
+        if not "colormap" in program.locations["uniforms"]:
+            return
+        texture_id = Colormaps.texture(name)
+        state.bind_texture(GL_TEXTURE_1D, texture_id)
+        program.set_uniform("colormap", [0])
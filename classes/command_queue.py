@@ -0,0 +1,210 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import collections
+
+class CommandQueue():
+    """
+    Mutations of the scene, queued by any thread and applied by the GUI
+    thread at the beginning of the next frame, see
+    `PainterWidget.commands`. Threads never make OpenGL calls, and
+    never wait for the GUI thread or for each other.
+    
+    Commands are appended to a deque, which is thread-safe without
+    locking. When applied, commands superseded by later ones are dropped:
+      * `set_transform()` of an item: the fields given last win
+      * `set_uniform()` of an item and uniform: the last value wins
+      * `update_vertices()` of the same range and attributes of an
+        item: the last vertices win
+    A superseding command takes the place of the superseded one at the
+    end of the queue. `item_create()` and `item_remove()` are barriers:
+    commands queued before them are never coalesced with commands queued
+    after them, so that e.g. the transform of a removed item isn't
+    merged into the transform of a re-created one. All other commands
+    are applied in order.
+    
+    Commands for items which don't exist (anymore) are ignored.
+    """
+    
+    def __init__(self, notify=None):
+        """
+        @param notify
+        Optional function called by the queueing thread after each
+        command, e.g. to request a new frame.
+        """
+        self._commands = collections.deque()
+        self.notify = notify
+        
+        
+    def __len__(self):
+        return len(self._commands)
+        
+        
+    def item_create(self, class_name, item_label, program_label, *args):
+        """
+        Queues `PainterWidget.item_create()`.
+        """
+        self._push(None, ("create", class_name, item_label, program_label) + args)
+        
+        
+    def item_remove(self, label_regexp):
+        """
+        Queues `PainterWidget.item_remove()`.
+        """
+        self._push(None, ("remove", label_regexp))
+        
+        
+    def update_vertices(self, item_label, start, vertices):
+        """
+        Queues overwriting consecutive vertices of an item, see
+        `Item.mark_dirty()`. The queue takes ownership of `vertices`,
+        don't modify them afterwards.
+        
+        @param start
+        Number of the first vertex.
+        
+        @param vertices
+        A numpy structured array or a dict of attribute name to values,
+        see `Item.update_vertices()`.
+        """
+        if hasattr(vertices, "dtype") and vertices.dtype.names != None:
+            count = len(vertices)
+            names = vertices.dtype.names
+        else:
+            count = len(next(iter(vertices.values())))
+            names = vertices.keys()
+        key = ("vertices", item_label, start, count, tuple(sorted(names)))
+        self._push(key, ("vertices", item_label, start, count, vertices))
+        
+        
+    def set_transform(self, item_label, origin=None, scale=None, rotation=None):
+        """
+        Queues setting the transformation of an item. Only the given
+        arguments are changed.
+        
+        @param origin
+        3-tuple, see `Item.set_origin()`
+        
+        @param scale
+        See `Item.set_scale()`
+        
+        @param rotation
+        Tuple (angle, vector), see `Item.set_rotation()`. vector may be
+        None.
+        """
+        fields = {}
+        if origin != None:
+            fields["origin"] = origin
+        if scale != None:
+            fields["scale"] = scale
+        if rotation != None:
+            fields["rotation"] = rotation
+        self._push(("transform", item_label), ("transform", item_label, fields))
+        
+        
+    def set_uniform(self, item_label, name, value):
+        """
+        Queues setting an uniform of an item, see `Item.uniforms`.
+        """
+        self._push(("uniform", item_label, name), ("uniform", item_label, name, value))
+        
+        
+    def _push(self, key, command):
+        self._commands.append((key, command))
+        if self.notify != None:
+            self.notify()
+            
+            
+    def take(self):
+        """
+        Removes all queued commands and returns them coalesced, as list
+        of tuples whose first element is the kind of command.
+        """
+        batch = []
+        positions = {} # position in batch by key, since the last barrier
+        while True:
+            try:
+                key, command = self._commands.popleft()
+            except IndexError:
+                break
+            
+            if key == None:
+                positions.clear() # barrier, see class documentation
+            elif key in positions:
+                position = positions[key]
+                superseded = batch[position]
+                batch[position] = None
+                if command[0] == "transform":
+                    fields = dict(superseded[2])
+                    fields.update(command[2])
+                    command = ("transform", command[1], fields)
+            if key != None:
+                positions[key] = len(batch)
+            batch.append(command)
+        return [command for command in batch if command != None]
+    
+    
+    def apply(self, painter):
+        """
+        Applies all queued commands to the scene of `painter`, a
+        PainterWidget. Must be called by the GUI thread, with a current
+        OpenGL context. Returns the number of commands applied.
+        
+        A failing command is reported and skipped, since the thread which
+        queued it can't handle the error.
+        """
+        commands = self.take()
+        for command in commands:
+            try:
+                self._apply(painter, command)
+            except Exception as e:
+                print("CommandQueue: {} failed: {}".format(command[0:2], e))
+        return len(commands)
+    
+    
+    def _apply(self, painter, command):
+        kind = command[0]
+        if kind == "create":
+            painter.item_create(*command[1:])
+            return
+        if kind == "remove":
+            painter.item_remove(command[1])
+            return
+        
+        item = painter.item_get(command[1])
+        if item == None:
+            return
+        
+        if kind == "vertices":
+            item.update_vertices(command[2], command[4])
+            
+        elif kind == "transform":
+            fields = command[2]
+            if "origin" in fields:
+                item.set_origin(fields["origin"])
+            if "scale" in fields:
+                item.set_scale(fields["scale"])
+            if "rotation" in fields:
+                item.set_rotation(*fields["rotation"])
+                
+        elif kind == "uniform":
+            item.uniforms[command[2]] = command[3]
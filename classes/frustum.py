@@ -0,0 +1,126 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import numpy as np
+
+class Frustum():
+    """
+    This class represents the view frustum of the camera as six planes
+    in world space. It is used to skip items which are not on screen.
+    
+    The planes are extracted from the combined Projection * View matrix
+    with the method of Gribb and Hartmann, see
+    http://www.cs.otago.ca/postgrads/alexis/planeExtraction.pdf
+    
+    Each plane is stored as (a, b, c, d) with a normalized normal vector
+    (a, b, c) pointing into the frustum, so that a point p is inside
+    when a*p.x + b*p.y + c*p.z + d >= 0 for all planes.
+    """
+    
+    def __init__(self, mat_pv):
+        """
+        @param mat_pv
+        The matrix Projection * View as a row-major list of 16 floats.
+        """
+        m = np.array(mat_pv, dtype=np.float64).reshape(4, 4)
+        
+        planes = np.array([
+            m[3] + m[0], # left
+            m[3] - m[0], # right
+            m[3] + m[1], # bottom
+            m[3] - m[1], # top
+            m[3] + m[2], # near
+            m[3] - m[2], # far
+            ])
+        
+        lengths = np.linalg.norm(planes[:, 0:3], axis=1)
+        self.planes = planes / lengths[:, np.newaxis]
+        self.normals = self.planes[:, 0:3]
+        self.distances = self.planes[:, 3]
+        self.normals_abs = np.abs(self.normals)
+        
+        # plain Python copy for fast tests of single boxes
+        self._planes_list = self.planes.tolist()
+        
+        
+    def intersects_sphere(self, center, radius):
+        """
+        Returns False if the sphere is completely outside of the frustum.
+        
+        @param center
+        Center of the sphere in world coordinates, numpy array of 3 floats
+        
+        @param radius
+        Radius of the sphere
+        """
+        return bool(np.all(self.normals.dot(center) + self.distances >= -radius))
+        
+        
+    def intersects_aabb(self, box_min, box_max):
+        """
+        Returns False if the axis-aligned box is completely outside of
+        the frustum.
+        
+        The test is conservative: Some boxes near the corners of the
+        frustum are reported as intersecting although they are not.
+        
+        @param box_min
+        Lower corner of the box in world coordinates, numpy array of 3 floats
+        
+        @param box_max
+        Upper corner of the box in world coordinates, numpy array of 3 floats
+        """
+        center = (box_min + box_max) * 0.5
+        half = (box_max - box_min) * 0.5
+        return bool(np.all(self.normals.dot(center) + self.distances >= -self.normals_abs.dot(half)))
+
+        
+        
+    def classify_box(self, box):
+        """
+        Classifies an axis-aligned box against the frustum. Returns -1 if
+        it is completely outside, 1 if it is completely inside, and 0 if
+        it intersects the boundary (conservatively, like `intersects_aabb`).
+        
+        This is the test used while traversing a BVH. It is written in
+        plain Python because numpy has too much overhead for a single box.
+        
+        @param box
+        List [xmin, ymin, zmin, xmax, ymax, zmax] in world coordinates
+        """
+        result = 1
+        for a, b, c, d in self._planes_list:
+            # the box corner furthest along the plane normal
+            px = box[3] if a >= 0 else box[0]
+            py = box[4] if b >= 0 else box[1]
+            pz = box[5] if c >= 0 else box[2]
+            if a * px + b * py + c * pz + d < 0:
+                return -1
+            
+            # the box corner furthest against the plane normal
+            nx = box[0] if a >= 0 else box[3]
+            ny = box[1] if b >= 0 else box[4]
+            nz = box[2] if c >= 0 else box[5]
+            if a * nx + b * ny + c * nz + d < 0:
+                result = 0
+                
+        return result
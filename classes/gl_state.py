@@ -0,0 +1,139 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import OpenGL
+from OpenGL.GL import *
+
+class GlState():
+    """
+    This class keeps a shadow copy of those parts of the OpenGL state
+    which are changed for every drawn item.
+    
+    Each state change through PyOpenGL costs a few microseconds of
+    Python overhead. Items call the methods of this class instead of
+    the raw OpenGL functions, and calls which would set a value that
+    is already current are skipped.
+    
+    The shadow copy is only valid as long as nobody changes the OpenGL
+    state behind its back. `PainterWidget` calls `invalidate()` at the
+    beginning of each frame. Call it also after having made raw OpenGL
+    calls during drawing.
+    """
+    
+    def __init__(self):
+        self.calls_skipped = 0 # statistics, reset by the owner
+        self.invalidate()
+        
+        
+    def invalidate(self):
+        """
+        Forget all remembered state. The next call of each method will
+        reach OpenGL.
+        """
+        self._program = None
+        self._polygon_mode = None
+        self._linewidth = None
+        self._vao = None
+        self._buffers = {}
+        self._textures = {}
+        
+        
+    def use_program(self, program_id):
+        """
+        glUseProgram() if `program_id` is not already in use.
+        
+        Returns True if the program actually has been switched.
+        """
+        if program_id == self._program:
+            self.calls_skipped += 1
+            return False
+        
+        glUseProgram(program_id)
+        self._program = program_id
+        return True
+        
+        
+    def polygon_mode(self, mode):
+        """
+        glPolygonMode() for GL_FRONT_AND_BACK.
+        
+        @param mode
+        GL_FILL or GL_LINE
+        """
+        if mode == self._polygon_mode:
+            self.calls_skipped += 1
+            return
+        
+        glPolygonMode(GL_FRONT_AND_BACK, mode)
+        self._polygon_mode = mode
+        
+        
+    def line_width(self, width):
+        """
+        glLineWidth()
+        """
+        if width == self._linewidth:
+            self.calls_skipped += 1
+            return
+        
+        glLineWidth(width)
+        self._linewidth = width
+        
+        
+    def bind_vertex_array(self, vao):
+        """
+        glBindVertexArray()
+        
+        Binding a VAO also changes the GL_ELEMENT_ARRAY_BUFFER binding,
+        which is part of the VAO state. It is therefore forgotten here.
+        """
+        if vao == self._vao:
+            self.calls_skipped += 1
+            return
+        
+        glBindVertexArray(vao)
+        self._vao = vao
+        self._buffers.pop(GL_ELEMENT_ARRAY_BUFFER, None)
+        
+        
+    def bind_buffer(self, target, buffer_id):
+        """
+        glBindBuffer()
+        """
+        if self._buffers.get(target) == buffer_id:
+            self.calls_skipped += 1
+            return
+        
+        glBindBuffer(target, buffer_id)
+        self._buffers[target] = buffer_id
+        
+        
+    def bind_texture(self, target, texture_id):
+        """
+        glBindTexture() on texture unit 0, the only one used.
+        """
+        if self._textures.get(target) == texture_id:
+            self.calls_skipped += 1
+            return
+        
+        glBindTexture(target, texture_id)
+        self._textures[target] = texture_id
@@ -78,7 +78,7 @@ class CoordSystem(Item):
             else:
                 newcol = (0, 0, 0, 1)
                 
-            self.vdata_pos_col["color"][x * 2] = newcol
+            self.vdata_pos_col["color"][x * 2] = self.vertex_format.encode("color", newcol)
 
         self.upload()
         self.dirty = True
\ No newline at end of file
@@ -27,6 +27,9 @@ from OpenGL.GL import *
 
 from gcode_machine.gcode_machine import GcodeMachine
 from .item import Item
+from ..vertex_format import VertexFormat
+from ..gl_state import GlState
+from ..colormaps import Colormaps
 
 class GcodePath(Item):
     """
@@ -36,9 +39,47 @@ class GcodePath(Item):
     
     G2 and G3 arcs are approximated by line segments. Different motion
     modes are drawn with different colors for better visualization.
+    
+    With a program having the attribute "category", like the "gcode"
+    shaders, vertices don't store colors. They store the motion mode,
+    tool number, feed and spindle speed instead, and colors are looked up
+    in the shader. The color scheme can then be switched at any time with
+    `set_color_scheme()`, without rendering or uploading vertices again.
+    With other programs, like "simple3d", colors are stored per vertex.
     """
+    
+    # vertex format for programs with the attributes "category" and "scalar",
+    # 24 bytes. Feeds and spindle speeds need more than the 11 significant
+    # bits of half floats.
+    palette_format = VertexFormat([
+        ("position", np.float32, 3),
+        ("category", np.uint8, 4), # motion mode, flags, tool, alpha * 255
+        ("scalar", np.float32, 2), # feed, spindle speed
+        ])
+    
+    # value of the uniform "color_mode"
+    color_schemes = {
+        "motion": 0,
+        "tool": 1,
+        "feed": 2,
+        "spindle": 3,
+        }
+    
+    # colors of motion modes G0..G3, and of unknown motion mode
+    motion_palette = [(.5, .5, .5), (.7, .7, 1), (.8, .7, 1), (.7, .8, 1), (0, 0, 0)]
+    
+    # colors of tools, repeating after 16 tools
+    tool_palette = [
+        (.9, .9, .9), (.12, .47, .71), (1, .5, .05), (.17, .63, .17),
+        (.84, .15, .16), (.58, .4, .74), (.55, .34, .29), (.89, .47, .76),
+        (.5, .5, .5), (.74, .74, .13), (.09, .75, .81), (.68, .78, .91),
+        (1, .73, .47), (.6, .87, .54), (1, .6, .59), (.77, .69, .84),
+        ]
+    
+    _re_feed = re.compile(r"F\s*([0-9.]+)", re.IGNORECASE)
+    _re_tool = re.compile(r"T\s*([0-9]+)", re.IGNORECASE)
 
-    def __init__(self, label, prog_id, gcode_list, cmpos, ccs, cs_offsets, do_fractionize_arcs=True):
+    def __init__(self, label, prog_id, gcode_list, cmpos, ccs, cs_offsets, do_fractionize_arcs=True, vertex_format=None, indexed=False):
         """
         param label
         A string containing a unique name for this item.
@@ -71,9 +112,33 @@ class GcodePath(Item):
         @param do_fractionize_arcs
         If True, break circular arcs into tiny lines.
         False gives speed improvement.
+        
+        @param vertex_format
+        Layout of vertex data. Defaults to `palette_format` if the program
+        has the attribute "category", otherwise to VertexFormat.compact,
+        with colors packed into 4 bytes. Pass e.g.
+        `VertexFormat.compact.separate()` to store colors separately from
+        positions, so that highlighting uploads only colors.
+        
+        @param indexed
+        If True, each line gets one color, and its start vertex is
+        welded with the target vertex of the previous line where they
+        match, see `Item.weld()`. This about halves the vertices of long
+        toolpaths. The order of drawn vertices, and thus `vertex_lines`,
+        are the same as when False.
         """
+        if vertex_format == None:
+            if "category" in prog_id.locations["attributes"]:
+                vertex_format = GcodePath.palette_format
+            else:
+                vertex_format = VertexFormat.compact
 
-        super(GcodePath, self).__init__(label, prog_id, GL_LINE_STRIP, 2)
+        super(GcodePath, self).__init__(label, prog_id, GL_LINE_STRIP, 2, vertex_format=vertex_format)
+        
+        # colors are looked up in the shader, see set_color_scheme()
+        self.palette_mode = "category" in vertex_format.names
+        self.indexed = indexed
+        self.colormap = None
         
         self.machine = GcodeMachine(cmpos, ccs, cs_offsets)
         
@@ -86,16 +151,22 @@ class GcodePath(Item):
 
         self.gcode = []
         
+        # for each line in self.gcode, the number of the line in gcode_list
+        # it has been generated from
+        self.gcode_line_numbers = []
+        
         if do_fractionize_arcs == True:
-            for line in gcode_list:
+            for line_number, line in enumerate(gcode_list):
                 self.machine.set_line(line)
                 self.machine.parse_state()
                 lines = self.machine.fractionize()
                 
                 self.gcode += lines
+                self.gcode_line_numbers += [line_number] * len(lines)
                 self.machine.done()
         else:
             self.gcode = gcode_list
+            self.gcode_line_numbers = list(range(len(gcode_list)))
         
         # reset, we re-run in render()
         self.machine.reset()
@@ -103,8 +174,19 @@ class GcodePath(Item):
         self.machine.current_cs = ccs
 
         self.set_vertexcount_max(2 * len(self.gcode) + 1)
+        
+        # for each vertex, the number of the line in self.gcode it belongs to
+        self.vertex_lines = np.zeros(self.vertexcount_max, dtype=np.int32)
+        
+        # for each line in self.gcode, the motion mode 0..3 after it, -1 if none
+        self.line_motion_modes = np.full(len(self.gcode), -1, dtype=np.int8)
 
         self.render()
+        if self.indexed:
+            self.weld()
+            self._welded_count = self.vertexcount
+        if self.palette_mode:
+            self.set_color_scheme("motion")
         self.upload()
         
         
@@ -115,32 +197,138 @@ class GcodePath(Item):
         The color of a highlighted line will be substituted directly on
         the GPU. Substitution will happen during the next `draw()`
         call which is why this function is very efficient, and can be
-        called from threads.
+        called from threads. For all other changes from threads, use
+        `PainterWidget.commands`, see CommandQueue.
         """
         self._lines_to_highlight.append(line_number)
         pass
         
         
-    def draw(self, mat_v_inverted):
+    def set_color_scheme(self, scheme, palette=None, colormap=None, scalar_range=None):
+        """
+        Selects how the path is colored. Only uniforms change, vertices
+        are neither rendered nor uploaded again. Requires a program with
+        the attribute "category", see class documentation.
+        
+        @param scheme
+        "motion" or "tool" to color by category from a palette, "feed"
+        or "spindle" to color by value from a colormap.
+        
+        @param palette
+        For category schemes: list of up to 16 RGB 3-tuples. Defaults to
+        `motion_palette` or `tool_palette`.
+        
+        @param colormap
+        For value schemes: name of a palette in Colormaps. Defaults to
+        "viridis" for feed and "gray" for spindle speed.
+        
+        @param scalar_range
+        For value schemes: 2-tuple of the values mapped to both ends
+        of the colormap. Defaults to the range occurring in the path.
+        """
+        if not self.palette_mode:
+            raise ValueError("Item '{}': color schemes require a program with attribute category".format(self.label))
+        if not scheme in GcodePath.color_schemes:
+            raise KeyError("Unknown color scheme {}".format(scheme))
+        mode = GcodePath.color_schemes[scheme]
+        
+        if palette == None:
+            palette = GcodePath.motion_palette if scheme == "motion" else GcodePath.tool_palette
+        palette = list(palette)[0:16]
+        palette += [(0, 0, 0)] * (16 - len(palette))
+        
+        if colormap == None:
+            colormap = "viridis" if scheme == "feed" else "gray"
+        self.colormap = colormap
+        
+        if scalar_range == None:
+            scalars = self.vdata_pos_col["scalar"][:self.vertexcount, mode - 2 if mode >= 2 else 0]
+            scalar_range = (float(scalars.min()), float(scalars.max())) if self.vertexcount else (0, 1)
+            
+        self.uniforms = {
+            "color_mode": [mode],
+            "palette": [c for color in palette for c in (color[0], color[1], color[2], 1)],
+            "scalar_min": [scalar_range[0]],
+            "scalar_max": [scalar_range[1]],
+            }
+        self.dirty = True
+        
+        
+    def pick(self, origin, direction, tan_tolerance, mat_v_inverted=None):
+        """
+        Like `Item.pick()`, but additionally returns the G-code line of
+        the picked segment under the keys
+          * "line": number of the line in self.gcode
+          * "source_line": number of the line in the `gcode_list` passed
+            to the constructor. Differs from "line" when arcs have been
+            fractionized.
+        """
+        hit = super(GcodePath, self).pick(origin, direction, tan_tolerance, mat_v_inverted)
+        if hit == None:
+            return None
+        
+        # a segment belongs to the line of its end vertex
+        line = int(self.vertex_lines[hit["segment_number"] + 1])
+        hit["line"] = line
+        hit["source_line"] = self.gcode_line_numbers[line]
+        return hit
+        
+        
+    def draw(self, mat_v_inverted, state=None):
+        if state == None:
+            state = GlState()
+        self.realize(state)
+            
         for line_number in self._lines_to_highlight:
-            if 2 * line_number > self.vertexcount: continue
+            drawn = self.vertexcount if self.vdata_indices is None else len(self.vdata_indices)
+            if 2 * line_number >= drawn: continue
         
             # Substitute color of highlighted lines directly in the GPU.
-            stride = self.vdata_pos_col.strides[0]
-            position_size = self.vdata_pos_col.dtype["position"].itemsize
-            color_size = self.vdata_pos_col.dtype["color"].itemsize
-            
             # 2 opengl segments for each logical line, see below
-            offset = 2 * line_number * stride + position_size
-            
-            col = np.array([1, 0.5, 1, 1], dtype=np.float32)
-            
-            glBindBuffer(GL_ARRAY_BUFFER, self.vbo_array)
-            glBufferSubData(GL_ARRAY_BUFFER, offset, color_size, col)
+            vertex = self._unshared_vertex(2 * line_number, state)
+            if self.palette_mode:
+                self.vdata_pos_col["category"][vertex, 1] = 1 # highlighted flag
+                self.upload_vertices(vertex, 1, ["category"], state)
+            else:
+                self.vdata_pos_col["color"][vertex] = self.vertex_format.encode("color", [1, 0.5, 1, 1])
+                self.upload_vertices(vertex, 1, ["color"], state)
             
         del self._lines_to_highlight[:]
+        
+        if self.palette_mode:
+            Colormaps.bind(self.program, self.colormap, state)
 
-        super(GcodePath, self).draw(mat_v_inverted)
+        super(GcodePath, self).draw(mat_v_inverted, state)
+        
+        
+    def _unshared_vertex(self, position, state):
+        """
+        Returns the number of the vertex drawn at `position` in drawing
+        order. When indexed, a welded vertex is first copied into the
+        spare vertices, so that changing it doesn't affect other lines.
+        If there are no spare vertices left, the welded vertex is
+        returned.
+        """
+        if not self.indexed:
+            return position
+        
+        vertex = int(self.vdata_indices[position])
+        if vertex >= self._welded_count or self.vertexcount == self.vertexcount_max:
+            return vertex
+        
+        copy = self.vertexcount
+        for name in self.vertex_format.names:
+            self.vdata_pos_col[name][copy] = self.vdata_pos_col[name][vertex]
+        self.vertexcount += 1
+        self.upload_vertices(copy, 1, None, state)
+        
+        self.vdata_indices[position] = copy
+        size = self.vdata_indices.itemsize
+        state.bind_vertex_array(self.vao) # the element array is part of the VAO state
+        glBufferSubData(GL_ELEMENT_ARRAY_BUFFER, position * size, size, self.vdata_indices[position:position + 1])
+        self._segment_index = None
+        self._kdtree = None
+        return copy
         
         
     def render(self):
@@ -165,13 +353,25 @@ class GcodePath(Item):
             }
         col = colors[0] # initial color
         
+        # Vertex data is collected in lists and written in bulk. In
+        # palette mode, categories and scalars replace colors.
+        positions = []
+        vcolors = []
+        categories = []
+        scalars = []
+        feed = 0
+        tool = 0
+        
         # create vertex at start of path
-        self.append_vertices([[self.machine.position_m, (col[0], col[1], col[2], 1)]])
+        positions.append(self.machine.position_m)
+        vcolors.append((col[0], col[1], col[2], 1))
+        categories.append((0, 0, 0, 255))
+        scalars.append((0, 0))
         
         arc_mode = False
         arc_by_sim = False
         arc_count = 0
-        for line in self.gcode:
+        for line_number, line in enumerate(self.gcode):
             self.machine.set_line(line)
             self.machine.parse_state()
 
@@ -193,6 +393,8 @@ class GcodePath(Item):
                 motion_mode = arc_mode
                 
             col = colors[motion_mode]
+            if motion_mode != None:
+                self.line_motion_modes[line_number] = motion_mode
             
             ss = self.machine.current_spindle_speed
             
@@ -218,12 +420,47 @@ class GcodePath(Item):
             if ss != None:
                 color2 = (ss/255, ss/255, ss/255, 1)
                 
+            # feed and tool are modal
+            if not line.lstrip().startswith(("(", ";")):
+                match = GcodePath._re_feed.search(line)
+                if match:
+                    feed = float(match.group(1))
+                match = GcodePath._re_tool.search(line)
+                if match:
+                    tool = int(match.group(1)) % 256
                 
             # draw two gl line segments per gcode line for better visualization of commands
             target = np.array(self.machine.target_m)
             diff = np.subtract(self.machine.target_m, self.machine.position_m)
             
-            self.append_vertices([[self.machine.position_m + diff * 0.001, color1]])
-            self.append_vertices([[self.machine.target_m, color2]])
+            if self.indexed:
+                # uniformly colored lines, to be welded with their neighbors
+                color2 = color1
+            
+            self.vertex_lines[len(positions):len(positions) + 2] = line_number
+            positions.append(self.machine.position_m if self.indexed else self.machine.position_m + diff * 0.001)
+            positions.append(self.machine.target_m)
+            vcolors.append(color1)
+            vcolors.append(color2)
+            
+            category = 4 if motion_mode == None else motion_mode
+            categories.append((category, 0, tool, int(color1[3] * 255)))
+            categories.append((category, 0, tool, int(color2[3] * 255)))
+            spindle = 0 if ss == None else ss
+            scalars.append((feed, spindle))
+            scalars.append((feed, spindle))
             
-            self.machine.done()
\ No newline at end of file
+            self.machine.done()
+            
+        count = len(positions)
+        if self.vertexcount + count > self.vertexcount_max:
+            raise IndexError("Item '{}': You are trying to append more vertices for item than the maximum of {}. Use set_vertexcount_max to increase the maximum possible vertices.".format(self.label, self.vertexcount_max))
+        
+        start = self.vertexcount
+        self.set_vertex_attribute("position", positions, start)
+        if self.palette_mode:
+            self.set_vertex_attribute("category", categories, start)
+            self.set_vertex_attribute("scalar", scalars, start)
+        else:
+            self.set_vertex_attribute("color", vcolors, start)
+        self.vertexcount = start + count
@@ -20,21 +20,36 @@ ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import ctypes
+
 import OpenGL
 from OpenGL.GL import *
 
 import numpy as np
 
 from .item import Item
+from ..vertex_format import VertexFormat
+from ..gl_state import GlState
+from ..colormaps import Colormaps
 
 class HeightMap(Item):
     """
-    xxx
+    Draws a surface from a regular grid of `nodes_x` * `nodes_y` nodes,
+    e.g. the result of probing a workpiece. The surface is drawn as one
+    indexed GL_TRIANGLE_STRIP, colored by height in the shader.
+    
+    The index buffer depends only on the grid dimensions. It is
+    calculated once per (nodes_x, nodes_y) and shared on the CPU and
+    GPU by all HeightMap instances of the same dimensions.
     """
     
+    # (nodes_x, nodes_y, primitive_restart) -> {"indices": array, "vbo": id}
+    _index_buffers = {}
+    
     def __init__(self, label, prog,
                  nodes_x, nodes_y, pos_col, fill,
-                 origin=(0,0,0), scale=1, linewidth=1, color=(1,1,1,0.2)):
+                 origin=(0,0,0), scale=1, linewidth=1, color=(1,1,1,0.2),
+                 primitive_restart=False):
         """
         @param label
         A string containing a unique name for this item.
@@ -56,72 +71,388 @@ class HeightMap(Item):
         
         @param color
         Color of this item.
+        
+        @param primitive_restart
+        If True, draw each row of the grid as a separate strip separated
+        by a primitive restart index, rather than one serpentine strip
+        joined by degenerate triangles. Requires OpenGL 3.1.
         """
 
         self.nodes_x = nodes_x
         self.nodes_y = nodes_y
+        self.primitive_restart = primitive_restart
+        
+        self.vdata_indices = HeightMap.indices(nodes_x, nodes_y, primitive_restart)
+        if primitive_restart:
+            self.restart_index = int(np.iinfo(self.vdata_indices.dtype).max)
+        
+        super(HeightMap, self).__init__(label, prog, GL_TRIANGLE_STRIP, linewidth, origin, scale, fill, vertex_format=VertexFormat.from_dtype(pos_col.dtype))
+        
+        self.vbo_element_array_shared = True
         
-        self.vdata_indices = self.calculate_indices()
+        # Heights are also kept in a separate attribute stream, so that
+        # they can be updated without touching the static XY lattice.
+        # The buffer is only created if the shader has a "z" attribute.
+        self.vbo_z = None
         
-        super(HeightMap, self).__init__(label, prog, GL_TRIANGLE_STRIP, linewidth, origin, scale, fill)
+        # incremented whenever heights change, so that dependent
+        # data like a LeveledGcodePath can be updated lazily
+        self.version = 0
+        
+        self.colormap = "spectrum" # see set_colormap()
         
         self.set_data(pos_col)
         
         
     def set_data(self, pos_col):
-        height_max_idx = pos_col["position"].argmax(axis=0)[2]
-        height_min_idx = pos_col["position"].argmin(axis=0)[2]
-        height_max = pos_col["position"][height_max_idx][2]
-        height_min = pos_col["position"][height_min_idx][2]
-        self.uniforms = {
-            "height_max": [height_max],
-            "height_min": [height_min],
-            }
-
+        """
+        Replaces all vertex data. The positions and colors are
+        re-uploaded on the next draw. To change only heights, use
+        `update_z()` instead.
+        
+        @param pos_col
+        Numpy array of `nodes_x` * `nodes_y` vertices in row-major order,
+        i.e. the node at column x and row y is at index y * nodes_x + x.
+        """
         self.vdata_pos_col = pos_col
         self.vertexcount = pos_col.size
+        self.vertexcount_max = pos_col.size
         
+        self.vdata_z = np.ascontiguousarray(pos_col["position"][:, 2], dtype=np.float32)
         
-    def draw(self, mat_v_inverted):
-        super(HeightMap, self).draw(mat_v_inverted)
+        z = self.vdata_z.reshape(self.nodes_y, self.nodes_x)
+        self._row_min = z.min(axis=1)
+        self._row_max = z.max(axis=1)
+        self._update_height_limits()
         
-
-    def calculate_indices(self):
+        self._pos_dirty = True
+        self._z_dirty = None
+        self.version += 1
+        self.calculate_bounds()
+        
+        
+    def update_z(self, z, row0=0, col0=0):
+        """
+        Updates the heights of a rectangular block of nodes, e.g. after
+        new probe points arrived. Only the changed heights, 4 bytes per
+        node, are uploaded to the GPU on the next draw. The height limits
+        passed to the shader are maintained incrementally.
+        
+        @param z
+        2D array of heights with shape (rows, columns). May also be a
+        scalar to update a single node.
+        
+        @param row0
+        Row (y) of the first node to update.
+        
+        @param col0
+        Column (x) of the first node to update.
+        """
+        z = np.array(z, dtype=np.float32, ndmin=2)
+        rows, cols = z.shape
+        nx = self.nodes_x
+        
+        if row0 < 0 or col0 < 0 or row0 + rows > self.nodes_y or col0 + cols > nx:
+            raise ValueError("Block of {}x{} nodes at row {} column {} is outside of grid".format(rows, cols, row0, col0))
+        
+        grid = self.vdata_z.reshape(self.nodes_y, nx)
+        grid[row0:row0 + rows, col0:col0 + cols] = z
+        
+        # keep the CPU positions in sync for bounds and picking
+        idx = (np.arange(row0, row0 + rows)[:, np.newaxis] * nx + np.arange(col0, col0 + cols)).ravel()
+        self.vdata_pos_col["position"][idx, 2] = z.ravel()
+        
+        # only the rows touched need to be rescanned
+        self._row_min[row0:row0 + rows] = grid[row0:row0 + rows].min(axis=1)
+        self._row_max[row0:row0 + rows] = grid[row0:row0 + rows].max(axis=1)
+        self._update_height_limits()
+        
+        # grow the range of nodes to upload
+        start = row0 * nx + col0
+        end = (row0 + rows - 1) * nx + col0 + cols
+        if self._z_dirty != None:
+            start = min(start, self._z_dirty[0])
+            end = max(end, self._z_dirty[1])
+        self._z_dirty = (start, end)
+        
+        self._z_bounds_changed()
+        self.version += 1
+        self.dirty = True
+        
+        
+    def update_vertices(self, start, vertices):
+        """
+        Like `Item.update_vertices()`, but heights are set through
+        `update_z()`, so that the height stream and limits follow.
+        """
+        fields = Item.vertex_fields(vertices)
+        positions = fields.pop("position", None)
+        if fields:
+            super(HeightMap, self).update_vertices(start, fields)
+        if positions is None:
+            return
+        
+        positions = np.asarray(positions, dtype=np.float32)
+        end = start + len(positions)
+        if start < 0 or end > self.vertexcount:
+            raise IndexError("Item '{}': Vertices {} to {} are out of range of {} vertices".format(self.label, start, end, self.vertexcount))
+        
+        # the XY lattice is static, it is uploaded again only if it changed
+        if not np.array_equal(positions[:, 0:2], self.vdata_pos_col["position"][start:end, 0:2]):
+            self.vdata_pos_col["position"][start:end, 0:2] = positions[:, 0:2]
+            self._pos_dirty = True
+            self.calculate_bounds()
+            
+        # one block per row of nodes
+        nx = self.nodes_x
+        i = start
+        while i < end:
+            row, col = divmod(i, nx)
+            n = min(nx - col, end - i)
+            self.update_z(positions[i - start:i - start + n, 2][np.newaxis], row, col)
+            i += n
+            
+            
+    def z_at(self, xy):
+        """
+        Bilinearly interpolates the heights at arbitrary points.
+        
+        The nodes are assumed to form a regular lattice, as in the
+        examples: node (x, y) at the position of node (0, 0) plus
+        x times the X spacing and y times the Y spacing. Points outside
+        of the grid get the height of the closest border.
+        
+        @param xy
+        Numpy array of shape (n, 2) of points in local coordinates.
+        
+        @return
+        Numpy array of n heights.
+        """
         nx = self.nodes_x
         ny = self.nodes_y
+        positions = self.vdata_pos_col["position"]
+        x0, y0 = float(positions[0][0]), float(positions[0][1])
+        dx = float(positions[1][0]) - x0
+        dy = float(positions[nx][1]) - y0
         
-        size = 1 + 2 * (nx - 1) * (ny - 1) + 2 * (ny - 1)
-        vdata_indices = np.zeros(size, dtype=OpenGL.constants.GLuint)
-
-        j = 1 # start with one, first index always zero
-        d = 1 # right direction
+        fx = np.clip((xy[:, 0] - x0) / dx, 0, nx - 1)
+        fy = np.clip((xy[:, 1] - y0) / dy, 0, ny - 1)
+        ix = np.minimum(fx.astype(np.int64), nx - 2)
+        iy = np.minimum(fy.astype(np.int64), ny - 2)
+        tx = fx - ix
+        ty = fy - iy
+        
+        z = self.vdata_z
+        i = iy * nx + ix
+        return ((z[i] * (1 - tx) + z[i + 1] * tx) * (1 - ty) +
+                (z[i + nx] * (1 - tx) + z[i + nx + 1] * tx) * ty)
+    
+    
+    def set_colormap(self, name):
+        """
+        Selects the palette used to color heights, by name of a palette
+        in `Colormaps`. Takes effect with the next draw, without any
+        upload of vertex data.
+        """
+        if not name in Colormaps.palettes:
+            raise KeyError("Unknown colormap {}".format(name))
+        self.colormap = name
+        self.dirty = True
         
-        for y in range(0, ny - 1):
+        
+    def _update_height_limits(self):
+        self.height_min = float(self._row_min.min())
+        self.height_max = float(self._row_max.max())
+        self.uniforms = {
+            "height_max": [self.height_max],
+            "height_min": [self.height_min],
+            }
+        
+        
+    def _z_bounds_changed(self):
+        # XY extents are static, so the box follows the height limits
+        if self.bbox_local is None:
+            return
+        box_min, box_max = self.bbox_local
+        box_min = np.array([box_min[0], box_min[1], self.height_min])
+        box_max = np.array([box_max[0], box_max[1], self.height_max])
+        self.bbox_local = (box_min, box_max)
+        
+        # sphere around the box, not as tight as calculate_bounds()
+        center = (box_min + box_max) * 0.5
+        self.bsphere_local = (center, float(np.linalg.norm(box_max - center)))
+        
+        self._bounds_world = None
+        self._segment_index = None
+        self._kdtree = None
+        self._bounds_changed()
+        
+        
+    def setup_vao(self, locations):
+        # use the index buffer shared with other instances of the same size
+        self.vbo_element_array = HeightMap.index_buffer(self.nodes_x, self.nodes_y, self.primitive_restart)
+        super(HeightMap, self).setup_vao(locations)
+        
+        # A shader reading the attribute "z" gets the height stream, even if
+        # the program options don't declare it, since it ignores position.z.
+        # Otherwise heights are uploaded into "position", see draw().
+        loc_z = locations["attributes"].get("z")
+        if loc_z == None:
+            loc_z = glGetAttribLocation(self.program.id, "z")
+        if loc_z >= 0:
+            if self.vbo_z == None:
+                self.vbo_z = glGenBuffers(1)
+            glBindVertexArray(self.vao)
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo_z)
+            glEnableVertexAttribArray(loc_z)
+            glVertexAttribPointer(loc_z, 1, GL_FLOAT, GL_FALSE, 4, ctypes.c_void_p(0))
+            glBindVertexArray(0)
             
-            if d == 1:
-                r = range(0, nx - 1)
-            else:
-                r = range(nx - 1, 0, -1)
-
-            for x in r:
-                vdata_indices[j] = (y + 1) * nx + x
-                j += 1
-                vdata_indices[j] = y * nx + x + d
-                j += 1
             
-            if d == 1:
-                # make a degenerate triangle to finish this row
-                vdata_indices[j] = (y + 2) * nx - 1
-                j += 1
-                vdata_indices[j] = (y + 2) * nx - 1
-                j += 1
+    def upload_steps(self, slice_bytes=None):
+        for uploaded in super(HeightMap, self).upload_steps(slice_bytes):
+            yield uploaded
+        if self.vbo_z != None:
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo_z)
+            glBufferData(GL_ARRAY_BUFFER, self.vdata_z.nbytes, self.vdata_z, GL_DYNAMIC_DRAW)
+            yield self.vdata_z.nbytes
+        self._pos_dirty = False
+        self._z_dirty = None
+        
+        
+    def upload_size(self):
+        size = super(HeightMap, self).upload_size()
+        if self.vbo_z != None or "z" in self.program.locations["attributes"]:
+            size += self.vdata_z.nbytes
+        return size
+        
+        
+    def remove(self):
+        if self.vbo_z != None:
+            glDeleteBuffers(1, [self.vbo_z])
+            self.vbo_z = None
+        super(HeightMap, self).remove()
+        
+        
+    def draw(self, mat_v_inverted, state=None):
+        if state == None:
+            state = GlState()
+        self.realize(state)
+            
+        if self._pos_dirty:
+            self.upload()
+            state.invalidate() # upload() made raw OpenGL calls
+            
+        elif self._z_dirty != None:
+            start, end = self._z_dirty
+            if self.vbo_z != None:
+                state.bind_buffer(GL_ARRAY_BUFFER, self.vbo_z)
+                glBufferSubData(GL_ARRAY_BUFFER, start * 4, (end - start) * 4, self.vdata_z[start:end])
             else:
-                # make a degenerate triangle to finish this row
-                vdata_indices[j] = (y + 1) * nx
-                j += 1
-                vdata_indices[j] = (y + 1) * nx
-                j += 1
+                # program without "z" attribute: heights are in "position"
+                self.upload_vertices(start, end - start, ["position"], state)
+            self._z_dirty = None
+            
+        Colormaps.bind(self.program, self.colormap, state)
+        
+        if self.primitive_restart:
+            glEnable(GL_PRIMITIVE_RESTART)
+            glPrimitiveRestartIndex(self.restart_index)
+            
+        super(HeightMap, self).draw(mat_v_inverted, state)
+        
+        if self.primitive_restart:
+            glDisable(GL_PRIMITIVE_RESTART)
+            
+            
+    @staticmethod
+    def index_buffer(nx, ny, primitive_restart=False):
+        """
+        Returns the ID of the GPU buffer holding the indices for a grid
+        of `nx` * `ny` nodes. The buffer is created and uploaded on first
+        use, and then shared by all HeightMaps of the same dimensions.
+        """
+        HeightMap.indices(nx, ny, primitive_restart)
+        entry = HeightMap._index_buffers[(nx, ny, primitive_restart)]
+        
+        if entry["vbo"] == None:
+            indices = entry["indices"]
+            entry["vbo"] = glGenBuffers(1)
+            # Buffers are untyped. Binding as GL_ARRAY_BUFFER for the
+            # upload leaves the element array binding of the current VAO alone.
+            glBindBuffer(GL_ARRAY_BUFFER, entry["vbo"])
+            glBufferData(GL_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+            
+        return entry["vbo"]
+    
 
-            d *= -1
-                
-        return vdata_indices
+    @staticmethod
+    def indices(nx, ny, primitive_restart=False):
+        """
+        Returns the triangle strip indices for a grid of `nx` * `ny`
+        nodes, as a read-only numpy array. Results are memoized.
+        
+        16 bit indices are used whenever the number of nodes allows it,
+        32 bit indices otherwise.
+        
+        The default is one serpentine strip: Rows are traversed
+        alternately left-to-right and right-to-left, joined by
+        degenerate triangles. With `primitive_restart`, each row is a
+        separate left-to-right strip, and rows are separated by the
+        maximum value of the index type.
+        """
+        key = (nx, ny, primitive_restart)
+        if key in HeightMap._index_buffers:
+            return HeightMap._index_buffers[key]["indices"]
+        
+        # the restart index must not be a valid vertex index
+        vertex_max = nx * ny - 1 + (1 if primitive_restart else 0)
+        dtype = np.uint16 if vertex_max <= np.iinfo(np.uint16).max else np.uint32
+        
+        if primitive_restart:
+            indices = HeightMap._indices_restart(nx, ny, np.iinfo(dtype).max)
+        else:
+            indices = HeightMap._indices_serpentine(nx, ny)
+            
+        indices = indices.astype(dtype)
+        indices.flags.writeable = False
+        
+        HeightMap._index_buffers[key] = {"indices": indices, "vbo": None}
+        return indices
+    
+    
+    @staticmethod
+    def _indices_serpentine(nx, ny):
+        y = np.arange(ny - 1)[:, np.newaxis]
+        even = (y % 2 == 0)
+        
+        # even rows go right, odd rows go left
+        x = np.where(even, np.arange(0, nx - 1), np.arange(nx - 1, 0, -1))
+        d = np.where(even, 1, -1)
+        
+        # for each row: pairs of upper and lower vertex ...
+        pairs = np.empty((ny - 1, 2 * (nx - 1)), dtype=np.int64)
+        pairs[:, 0::2] = (y + 1) * nx + x
+        pairs[:, 1::2] = y * nx + x + d
+        
+        # ... followed by a degenerate triangle to finish the row
+        degenerate = np.where(even, (y + 2) * nx - 1, (y + 1) * nx)
+        rows = np.hstack((pairs, degenerate, degenerate))
+        
+        # start with one, first index always zero
+        return np.concatenate(([0], rows.ravel()))
+    
+    
+    @staticmethod
+    def _indices_restart(nx, ny, restart_index):
+        y = np.arange(ny - 1)[:, np.newaxis]
+        x = np.arange(nx)
+        
+        # for each row: pairs of upper and lower vertex, then restart
+        rows = np.empty((ny - 1, 2 * nx + 1), dtype=np.int64)
+        rows[:, 0:-1:2] = (y + 1) * nx + x
+        rows[:, 1:-1:2] = y * nx + x
+        rows[:, -1] = restart_index
+        
+        return rows.ravel()[:-1]
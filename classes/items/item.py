@@ -26,12 +26,19 @@ import numpy as np
 import ctypes
 import sys
 import math
+import itertools
+
+from scipy.spatial import cKDTree
 
 from PyQt5.QtGui import QColor, QMatrix4x4, QVector2D, QVector3D, QVector4D, QQuaternion
 
 import OpenGL
 from OpenGL.GL import *
 
+from ..gl_state import GlState
+from ..segment_index import SegmentIndex
+from ..vertex_format import VertexFormat
+
 class Item():
     """
     This class represents a separate object/item in 3D space.
@@ -60,7 +67,12 @@ class Item():
     in this directory which inherit from it).
     """
     
-    def __init__(self, label, program, primitive_type=GL_LINES, linewidth=1, origin=(0,0,0), scale=1, filled=False, vertexcount_max=0):
+    _serials = itertools.count()
+    
+    # glDrawElements index type by itemsize of `vdata_indices`
+    index_types = {1: GL_UNSIGNED_BYTE, 2: GL_UNSIGNED_SHORT, 4: GL_UNSIGNED_INT}
+    
+    def __init__(self, label, program, primitive_type=GL_LINES, linewidth=1, origin=(0,0,0), scale=1, filled=False, vertexcount_max=0, vertex_format=None):
         """
         @param label
         A string containing a unique name for this item.
@@ -92,15 +104,33 @@ class Item():
         True or False. Determines if drawn triangles will be filled with color.
         """
         
-        # generate attribute state label aka VAO
-        self.vao = glGenVertexArrays(1)
+        # OpenGL objects are created by realize(), so that items can be
+        # constructed without an OpenGL context, e.g. in worker threads
+        self.realized = False
+        self.vao = None # attribute state label aka VAO
+        self.vbo_array = None # this buffer labels positions+colors
+        self.vbo_element_array = None # VertexBuffer ID for indices
         
-        # generate data buffer labels aka VBO
-        self.vbo_array = glGenBuffers(1) # this buffer labels positions+colors
-        self.vbo_element_array = glGenBuffers(1) # VertexBuffer ID for indices
+        # set by subclasses whose index buffer is shared between
+        # instances. It is then neither created, uploaded nor deleted by
+        # this class, but set by setup_vao() of the subclass.
+        self.vbo_element_array_shared = False
         
         self.program = program
         self.label = label
+        
+        # draw order among items with identical render state, see RenderQueue
+        self.serial = next(Item._serials)
+        
+        # The BVH of the PainterWidget this item is part of, if any.
+        # It is kept up to date whenever the world bounds change.
+        self.bvh = None
+        
+        # Scene graph. The local coordinate system of this item is relative
+        # to the coordinate system of the parent, see set_parent().
+        self.parent = None
+        self.children = []
+        self._mat_frame = None # cache of frame_matrix()
 
         self.vertexcount_max = vertexcount_max # maximum number of vertices
         self.vertexcount = 0 # current number of appended/used vertices
@@ -110,6 +140,7 @@ class Item():
         self.filled = filled # if a triangle should be drawn filled
         
         # billboard mode
+        self._billboard = False
         self.billboard = False # set to True to always face camera
         self.billboard_axis = None # must be strings "X", "Y", or "Z"
         
@@ -123,20 +154,49 @@ class Item():
         self.rotation_angle = 0 
         self.rotation_vector = QVector3D(0, 1, 0) # default rotation around Y
         
+        # Model matrix as list, cached until origin, scale or rotation change.
+        # Not used in billboard mode, which depends on the camera.
+        self._mat_m_list = None
+        
+        # Bounding volumes in local coordinates, calculated by upload().
+        # None as long as there are no vertices, which means that the
+        # item can not be culled.
+        self.bbox_local = None # (min, max) as numpy arrays
+        self.bsphere_local = None # (center, radius)
+        self._bounds_world = None # cache of world_bounds()
+        
+        # acceleration structures for picking and vertex queries, built on demand
+        self._segment_index = None
+        self._kdtree = None
+        
         self.dirty = True
         
+        # Called to request drawing a new frame, set by the PainterWidget
+        # this item is part of, see request_update().
+        self.notify = None
+        
         self.uniforms = {}
 
-        # TODO: Support not only for attributes "color" and "position", but arbitrary
-        # formats.
-        supported_vertex_format = [
-            ("position", np.float32, 3),
-            ("color", np.float32, 4)
-            ]
-        self.vdata_pos_col = np.zeros(self.vertexcount_max, supported_vertex_format)
+        # layout of vdata_pos_col, see VertexFormat
+        if vertex_format == None:
+            vertex_format = VertexFormat.standard
+        self.vertex_format = vertex_format
+        self.vdata_pos_col = vertex_format.empty(self.vertexcount_max)
+        self.vdata_owner = None # see adopt_vertices()
+        self._dirty_range = None # (start, end), see mark_dirty()
+
+        # one buffer per attribute if the format is not interleaved
+        self.vbos = {}
+        if not vertex_format.interleaved:
+            for name in vertex_format.names:
+                self.vbos[name] = None
 
         if not "vdata_indices" in list(vars(self).keys()):
             self.vdata_indices = None
+            
+        # index in vdata_indices separating primitives, if any
+        if not "restart_index" in list(vars(self).keys()):
+            self.restart_index = None
         
         
     def __del__(self):
@@ -146,27 +206,66 @@ class Item():
         pass
     
     
+    def realize(self, state=None):
+        """
+        Creates the OpenGL objects of this item, sets up its VAO and
+        uploads its vertex data. Until then, this item consists of CPU
+        data only.
+        
+        The first `draw()` calls this. Call it explicitly to do the work
+        earlier. Requires a current OpenGL context.
+        
+        @param state
+        The GlState of the current frame, if called while drawing.
+        """
+        if self.realized:
+            return
+        
+        self._create_gl_objects()
+        self.upload()
+        
+        if state != None:
+            state.invalidate() # raw OpenGL calls have been made
+            
+            
+    def realize_steps(self, slice_bytes):
+        """
+        Generator doing the work of `realize()` in steps, uploading
+        slices of about `slice_bytes`, see `upload_steps()`. After each
+        step, it yields the number of bytes uploaded. Used to upload large
+        items within a time budget per frame, see
+        `PainterWidget.item_create_async()`.
+        """
+        if self.realized:
+            return
+        
+        self._create_gl_objects()
+        self.calculate_bounds()
+        for uploaded in self.upload_steps(slice_bytes):
+            yield uploaded
+            
+            
+    def _create_gl_objects(self):
+        self.program.realize()
+        
+        self.vao = glGenVertexArrays(1)
+        self.vbo_array = glGenBuffers(1)
+        if not self.vbo_element_array_shared:
+            self.vbo_element_array = glGenBuffers(1) # shared ones are set by setup_vao()
+        for name in self.vbos:
+            self.vbos[name] = glGenBuffers(1)
+        self.realized = True
+        
+        self.setup_vao(self.program.locations)
+        
+        
     def setup_vao(self, locations):
-        stride = self.vdata_pos_col.strides[0]
-
         glBindVertexArray(self.vao)
         glBindBuffer(GL_ARRAY_BUFFER, self.vbo_array) # not part of the VAO state
 
-        # TODO: Support not only for attributes "color" and "position", but arbitrary
-        # formats.
-        offset_pos = ctypes.c_void_p(0)
-        loc_pos = locations["attributes"]["position"]
-        glEnableVertexAttribArray(loc_pos)
-        glVertexAttribPointer(loc_pos, 3, GL_FLOAT, GL_FALSE, stride, offset_pos)
-        
-        if "color" in locations["attributes"]:
-            offset_col = ctypes.c_void_p(self.vdata_pos_col.dtype["position"].itemsize)
-            loc_col = locations["attributes"]["color"]
-            glEnableVertexAttribArray(loc_col)
-            glVertexAttribPointer(loc_col, 4, GL_FLOAT, GL_FALSE, stride, offset_col)
+        self.vertex_format.setup(locations, self.vbos)
         
-        
-        if self.vdata_indices != None:
+        if self.vdata_indices is not None:
             # indexed drawing is optional and per-item
             glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.vbo_element_array)
         
@@ -189,10 +288,35 @@ class Item():
         if self.vertexcount + length_to_append > self.vertexcount_max:
             raise IndexError("Item '{}': You are trying to append more vertices for item than the maximum of {}. Use set_vertexcount_max to increase the maximum possible vertices.".format(self.label, self.vertexcount_max))
         
-        for vertex in vertexdata:
-            self.vdata_pos_col["position"][self.vertexcount] = vertex[0]
-            self.vdata_pos_col["color"][self.vertexcount] = vertex[1]
-            self.vertexcount += 1
+        if length_to_append == 0:
+            return
+        
+        start = self.vertexcount
+        end = start + length_to_append
+        fmt = self.vertex_format
+        self.vdata_pos_col["position"][start:end] = fmt.encode("position", [vertex[0] for vertex in vertexdata])
+        self.vdata_pos_col["color"][start:end] = fmt.encode("color", [vertex[1] for vertex in vertexdata])
+        self.vertexcount = end
+        
+        
+    def set_vertex_attribute(self, name, values, start=0):
+        """
+        Sets an attribute of consecutive vertices in CPU data storage,
+        converting from floats for normalized attributes, but doesn't
+        upload to the GPU. Use this for attributes of the vertex format
+        other than position and color.
+        
+        @param name
+        Name of the attribute in the vertex format.
+        
+        @param values
+        Array-like with one value or tuple per vertex.
+        
+        @param start
+        Number of the first vertex to set.
+        """
+        values = self.vertex_format.encode(name, values)
+        self.vdata_pos_col[name][start:start + len(values)] = values
 
 
     def set_vertexcount_max(self, new_count):
@@ -205,11 +329,175 @@ class Item():
         """
         if new_count > self.vertexcount_max:
             self.vertexcount_max = new_count
-            extension = np.zeros(new_count, [("position", np.float32, 3), ("color", np.float32, 4)])
-            self.vdata_pos_col = np.append(self.vdata_pos_col, extension)
+            self.vdata_pos_col = self.vertex_format.extend(self.vdata_pos_col, new_count)
         else:
             raise BufferError("Item '{}': You are trying to set a vertex count lower than has been reserved during initialization. This isn't yet supported. User a lower count during initialization instead.".format(self.label, self.vertexcount_max))
+
+
+    def adopt_vertices(self, vdata, count, owner=None, vertex_format=None):
+        """
+        Uses `vdata` as CPU data storage, without copying it. This allows
+        to draw vertices produced elsewhere, e.g. by a data acquisition
+        layer, a memory mapped file or another process.
+        
+        After the vertices in `vdata` have been modified, call
+        `mark_dirty()`. Like `upload()`, this re-calculates the bounding
+        volumes, and uploads the vertices if the item is realized.
+
+        @param vdata
+        One of
+          * a numpy structured array with the dtype of the vertex format,
+            e.g. a numpy.memmap
+          * a C-contiguous numpy array of another dtype, e.g. float32 of
+            shape (n, 7) for the standard format, whose rows have the
+            size of one vertex
+          * any object supporting the buffer protocol, e.g. a memoryview,
+            bytearray or mmap
+        Its number of vertices is the new `vertexcount_max`.
+
+        @param count
+        The number of vertices used.
+
+        @param owner
+        An object providing the memory of `vdata`, e.g. SharedVertices.
+        It is kept as long as the item uses `vdata`, and is closed by
+        `release_vertices()`.
+        
+        @param vertex_format
+        The VertexFormat of `vdata`, if different from the current one,
+        see `VertexFormat.from_dtype()`. Must be interleaved.
+        """
+        if vertex_format == None:
+            vertex_format = self.vertex_format
+        if not vertex_format.interleaved:
+            raise ValueError("Item '{}': Only interleaved vertex formats can adopt vertices".format(self.label))
+        
+        dtype = vertex_format.dtype
+        if not isinstance(vdata, np.ndarray):
+            vdata = np.frombuffer(vdata, dtype=dtype)
+            
+        # numpy would copy strided data before uploading
+        if not vdata.flags["C_CONTIGUOUS"]:
+            raise ValueError("Item '{}': Adopted vertex data must be contiguous".format(self.label))
+        
+        if vdata.dtype != dtype:
+            if vdata.dtype.names != None or vdata.nbytes % dtype.itemsize != 0:
+                raise TypeError("Item '{}': Vertex data of dtype {} don't match the vertex format {}".format(self.label, vdata.dtype, dtype))
+            vdata = vdata.reshape(-1).view(dtype)
             
+        if count > len(vdata):
+            raise IndexError("Item '{}': {} vertices used, but only {} adopted".format(self.label, count, len(vdata)))
+
+        if vertex_format != self.vertex_format:
+            self.vertex_format = vertex_format
+            if self.realized:
+                self.setup_vao(self.program.locations)
+            
+        self.vdata_pos_col = vdata
+        self.vdata_owner = owner
+        self.vertexcount_max = len(vdata)
+        self.vertexcount = count
+        self._dirty_range = None
+        self.upload()
+        
+        
+    def update_vertices(self, start, vertices):
+        """
+        Overwrites attributes of consecutive vertices in CPU data storage
+        and marks them dirty, see `mark_dirty()`.
+        
+        @param start
+        Number of the first vertex.
+        
+        @param vertices
+        A numpy structured array, or a dict of attribute name to values.
+        Values already of the type of the attribute in the vertex format
+        are copied as they are, all others are converted from floats like
+        in `set_vertex_attribute()`.
+        """
+        fields = Item.vertex_fields(vertices)
+        count = len(next(iter(fields.values())))
+        if start < 0 or start + count > self.vertexcount_max:
+            raise IndexError("Item '{}': Vertices {} to {} are out of range of {} vertices".format(self.label, start, start + count, self.vertexcount_max))
+        
+        for name, values in fields.items():
+            if getattr(values, "dtype", None) == self.vdata_pos_col.dtype[name].base:
+                self.vdata_pos_col[name][start:start + count] = values
+            else:
+                self.set_vertex_attribute(name, values, start)
+        self.mark_dirty(start, count)
+        
+        
+    @staticmethod
+    def vertex_fields(vertices):
+        """
+        Returns a dict of attribute name to values of `vertices`, a numpy
+        structured array or a dict, see `update_vertices()`.
+        """
+        if hasattr(vertices, "dtype") and vertices.dtype.names != None:
+            return {name: vertices[name] for name in vertices.dtype.names}
+        return dict(vertices)
+        
+        
+    def mark_dirty(self, start, count):
+        """
+        Signals that vertices have been modified directly in
+        `vdata_pos_col`, e.g. in a buffer adopted by `adopt_vertices()`.
+        They are uploaded when the item is drawn next, together with all
+        other ranges marked until then. The bounding volumes grow to
+        include them.
+        
+        Vertices beyond `vertexcount` become used, which allows to
+        append to the storage.
+        
+        @param start
+        Number of the first modified vertex.
+        
+        @param count
+        Number of modified vertices.
+        """
+        end = start + count
+        if start < 0 or end > self.vertexcount_max:
+            raise IndexError("Item '{}': Vertices {} to {} are out of range of {} vertices".format(self.label, start, end, self.vertexcount_max))
+        if count <= 0:
+            return
+        
+        self.vertexcount = max(self.vertexcount, end)
+        if self._dirty_range == None:
+            self._dirty_range = (start, end)
+        else:
+            self._dirty_range = (min(self._dirty_range[0], start), max(self._dirty_range[1], end))
+        self.dirty = True
+        
+        self._segment_index = None
+        self._kdtree = None
+        if self.bbox_local is None:
+            self.calculate_bounds()
+            return
+        
+        positions = self.positions()[start:end]
+        box_min, box_max = self.bbox_local
+        self.bbox_local = (np.minimum(box_min, positions.min(axis=0)), np.maximum(box_max, positions.max(axis=0)))
+        center, radius = self.bsphere_local
+        self.bsphere_local = (center, max(radius, Item.max_distance(positions, center)))
+        self._bounds_world = None
+        self._bounds_changed()
+        
+        
+    def release_vertices(self):
+        """
+        Frees the CPU data storage after it has been uploaded. The item
+        can still be drawn and transformed, but its vertices can't be
+        modified, picked or uploaded again.
+        """
+        self.vdata_pos_col = self.vertex_format.empty(0)
+        self.vertexcount_max = 0
+        self._segment_index = None
+        self._kdtree = None
+        if self.vdata_owner != None:
+            self.vdata_owner.close()
+            self.vdata_owner = None
+
             
     def substitute(self, vertex_nr, pos, col):
         """
@@ -229,33 +517,38 @@ class Item():
         """
         if vertex_nr > self.vertexcount: return
     
-        stride = self.vdata_pos_col.strides[0]
-        position_size = self.vdata_pos_col.dtype["position"].itemsize
-        color_size = self.vdata_pos_col.dtype["color"].itemsize
-        
-        glBindBuffer(GL_ARRAY_BUFFER, self.vbo_array)
-        
-        # replace position
-        position = np.array([pos[0], pos[1], pos[2]], dtype=np.float32)
-        offset = vertex_nr * stride
-        glBufferSubData(GL_ARRAY_BUFFER, offset, position_size, position)
-        
-        # replace color
-        color = np.array([col[0], col[1], col[2], col[3]], dtype=np.float32)
-        offset = vertex_nr * stride + position_size
-        glBufferSubData(GL_ARRAY_BUFFER, offset, color_size, color)
+        fmt = self.vertex_format
+        self.vdata_pos_col["position"][vertex_nr] = fmt.encode("position", pos[0:3])
+        self.vdata_pos_col["color"][vertex_nr] = fmt.encode("color", col[0:4])
+        self.upload_vertices(vertex_nr, 1, ["position", "color"])
+        
+        self._segment_index = None
+        self._kdtree = None
+        self.bounds_include(pos)
     
     
     def remove(self):
         """
         Removes self. The object will disappear from the world.
         """
-        glDeleteBuffers(1, [self.vbo_array])
-        if self.vdata_indices != None:
-            glDeleteBuffers(1, [self.vbo_element_array])
-            
-        glDeleteVertexArrays(1, [self.vao])
+        if self.realized:
+            glDeleteBuffers(1, [self.vbo_array])
+            for vbo in self.vbos.values():
+                glDeleteBuffers(1, [vbo])
+            if not self.vbo_element_array_shared:
+                glDeleteBuffers(1, [self.vbo_element_array])
+                
+            glDeleteVertexArrays(1, [self.vao])
+            self.realized = False
         self.dirty = True
+        
+        # children stay where they are relative to the world origin
+        for child in list(self.children):
+            child.set_parent(None, keep_world=True)
+        if self.parent != None:
+            self.parent.children.remove(self)
+            self.parent = None
+        
         print("Item {}: removing myself.".format(self.label))
         
         
@@ -267,16 +560,485 @@ class Item():
         `append_vertices()`. Note that uploading a large set of data
         is an expensive operation. To modify data, call `substitute()`
         instead.
+        
+        This also re-calculates the bounding volumes of this item.
+        Before `realize()`, only this is done.
         """
-        glBindVertexArray(self.vao)
+        self.calculate_bounds()
+        if not self.realized:
+            return # everything is uploaded by realize()
+        
+        self._dirty_range = None
+        for uploaded in self.upload_steps():
+            pass
         
-        glBindBuffer(GL_ARRAY_BUFFER, self.vbo_array) # this is not part of the VAO state
-        glBufferData(GL_ARRAY_BUFFER, self.vdata_pos_col.nbytes, self.vdata_pos_col, GL_DYNAMIC_DRAW) # TODO: make STATIC/DYNAMIC configurable
         
-        if self.vdata_indices != None:
+    def upload_steps(self, slice_bytes=None):
+        """
+        Generator uploading the entire CPU data like `upload()`, but in
+        slices of about `slice_bytes`. After each slice, it yields the
+        number of bytes uploaded. The OpenGL state may change between
+        slices. Requires `realize_steps()` or `realize()` to have created
+        the OpenGL objects.
+        
+        @param slice_bytes
+        Size of slices, or None to upload each buffer at once.
+        """
+        buffers = []
+        if self.vertex_format.interleaved:
+            buffers.append((self.vbo_array, self.vdata_pos_col))
+        else:
+            for name, vbo in self.vbos.items():
+                buffers.append((vbo, self.vdata_pos_col[name]))
+                
+        for vbo, data in buffers:
+            glBindBuffer(GL_ARRAY_BUFFER, vbo) # this is not part of the VAO state
+            if slice_bytes == None:
+                glBufferData(GL_ARRAY_BUFFER, data.nbytes, data, GL_DYNAMIC_DRAW) # TODO: make STATIC/DYNAMIC configurable
+                yield data.nbytes
+                continue
+            
+            # allocate, then fill
+            glBufferData(GL_ARRAY_BUFFER, data.nbytes, None, GL_DYNAMIC_DRAW)
+            stride = data.strides[0]
+            rows = max(1, slice_bytes // stride)
+            for start in range(0, len(data), rows):
+                chunk = data[start:start + rows]
+                glBindBuffer(GL_ARRAY_BUFFER, vbo)
+                glBufferSubData(GL_ARRAY_BUFFER, start * stride, chunk.nbytes, chunk)
+                yield chunk.nbytes
+        
+        if self.vdata_indices is not None and not self.vbo_element_array_shared:
+            # bound here as well for indices created after setup_vao(), see weld()
+            glBindVertexArray(self.vao)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.vbo_element_array)
             glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.vdata_indices.nbytes, self.vdata_indices, GL_STATIC_DRAW) # indexes never change and are static
+            glBindVertexArray(0)
+            yield self.vdata_indices.nbytes
+            
+            
+    def upload_size(self):
+        """
+        Returns the number of bytes uploaded by `upload()`.
+        """
+        size = self.vdata_pos_col.nbytes
+        if self.vdata_indices is not None and not self.vbo_element_array_shared:
+            size += self.vdata_indices.nbytes
+        return size
         
-        glBindVertexArray(0)
+        
+    def upload_vertices(self, start, count, attributes=None, state=None):
+        """
+        Uploads a range of vertices from the CPU data to the GPU, after
+        they have been modified in `vdata_pos_col`.
+        
+        If the vertex format is not interleaved, only the given
+        attributes are uploaded, each as one contiguous block.
+        Otherwise, the entire vertices of the range are uploaded.
+        
+        @param start
+        Number of the first vertex.
+        
+        @param count
+        Number of vertices.
+        
+        @param attributes
+        List of attribute names, or None for all.
+        
+        @param state
+        The GlState of the current frame, if called while drawing.
+        """
+        if not self.realized:
+            return # everything is uploaded by realize()
+        
+        if state == None:
+            state = GlState()
+        
+        end = start + count
+        if self.vertex_format.interleaved:
+            stride = self.vdata_pos_col.strides[0]
+            state.bind_buffer(GL_ARRAY_BUFFER, self.vbo_array)
+            glBufferSubData(GL_ARRAY_BUFFER, start * stride, count * stride, self.vdata_pos_col[start:end])
+            return
+        
+        if attributes == None:
+            attributes = self.vertex_format.names
+        for name in attributes:
+            data = self.vdata_pos_col[name]
+            size = data.strides[0]
+            state.bind_buffer(GL_ARRAY_BUFFER, self.vbos[name])
+            glBufferSubData(GL_ARRAY_BUFFER, start * size, count * size, data[start:end])
+            
+            
+    def weld(self, tolerance=1e-6):
+        """
+        Merges vertices with equal attributes into one and draws them
+        with an index buffer via glDrawElements. The drawn primitives
+        don't change, but for long contiguous paths vertex memory and
+        vertex shader work are about halved. Call `upload()` afterwards.
+        
+        Vertex numbers change, numbers of segments in drawing order (see
+        `pick()`) don't.
+        
+        Returns the number of removed vertices.
+        
+        @param tolerance
+        Positions are compared after quantization to this unit. All
+        other attributes are compared exactly.
+        """
+        if self.vbo_element_array_shared:
+            raise SystemError("Item '{}': Can not weld vertices drawn with a shared index buffer".format(self.label))
+        
+        count = self.vertexcount
+        if count == 0:
+            return 0
+        
+        # one row of bytes per vertex, hashed by np.unique
+        fmt = self.vertex_format
+        keys = []
+        for name in fmt.names:
+            data = self.vdata_pos_col[name][:count].reshape(count, -1)
+            if name == "position":
+                data = np.round(fmt.decode("position", data) / tolerance).astype(np.int64)
+            keys.append(np.ascontiguousarray(data).view(np.uint8).reshape(count, -1))
+        keys = np.ascontiguousarray(np.hstack(keys))
+        keys = keys.view(np.dtype((np.void, keys.shape[1]))).ravel()
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        
+        # keep vertices in order of their first use, for locality
+        order = np.argsort(first)
+        keep = first[order]
+        renumber = np.empty(len(keep), dtype=np.int64)
+        renumber[order] = np.arange(len(keep))
+        inverse = renumber[inverse.ravel()]
+        
+        indices = inverse if self.vdata_indices is None else inverse[self.vdata_indices]
+        
+        welded = len(keep)
+        for name in fmt.names:
+            data = self.vdata_pos_col[name]
+            data[:welded] = data[:count][keep]
+        self.vertexcount = welded
+        self.vdata_indices = indices.astype(np.uint16 if self.vertexcount_max < 0xFFFF else np.uint32)
+        
+        self._segment_index = None
+        self._kdtree = None
+        self.dirty = True
+        return count - welded
+        
+        
+    def vertex_order(self):
+        """
+        Returns the numbers of the vertices in drawing order as numpy
+        array: `vdata_indices` for indexed drawing, otherwise all used
+        vertices.
+        """
+        if self.vdata_indices is None:
+            return np.arange(self.vertexcount)
+        return self.vdata_indices.astype(np.int64)
+        
+        
+    def positions(self):
+        """
+        Returns the positions of all used vertices in local coordinates
+        as float32 numpy array, decoded from the vertex format. This is
+        a view without copying for float32 positions.
+        """
+        return self.vertex_format.decode("position", self.vdata_pos_col["position"][:self.vertexcount])
+    
+    
+    def calculate_bounds(self):
+        """
+        Calculates the axis-aligned bounding box and the bounding sphere
+        of all used vertices in local coordinates.
+        
+        Since this is called whenever the vertex data changes, also
+        acceleration structures built from vertices are forgotten here.
+        """
+        self._bounds_world = None
+        self._segment_index = None
+        self._kdtree = None
+        
+        if self.vertexcount == 0:
+            self.bbox_local = None
+            self.bsphere_local = None
+            self._bounds_changed()
+            return
+        
+        positions = self.positions()
+        box_min = positions.min(axis=0).astype(np.float64)
+        box_max = positions.max(axis=0).astype(np.float64)
+        self.bbox_local = (box_min, box_max)
+        
+        # sphere around the box center, tighter than the box diagonal
+        center = (box_min + box_max) * 0.5
+        self.bsphere_local = (center, Item.max_distance(positions, center))
+        self._bounds_changed()
+        
+        
+    @staticmethod
+    def max_distance(positions, center):
+        """
+        Returns the largest distance of `positions` from `center`. It is
+        calculated in chunks, since float64 temporaries of all positions
+        would be larger than the vertex data itself.
+        """
+        distance_sq = 0
+        for start in range(0, len(positions), 65536):
+            chunk = positions[start:start + 65536] - center
+            distance_sq = max(distance_sq, (chunk * chunk).sum(axis=1).max())
+        return math.sqrt(distance_sq)
+    
+    
+    def bounds_include(self, pos):
+        """
+        Grow the bounding volumes so that they include `pos`.
+        
+        @param pos
+        3-tuple of floats in local coordinates
+        """
+        pos = np.array(pos[0:3], dtype=np.float64)
+        if self.bbox_local is None:
+            self.bbox_local = (pos, pos)
+            self.bsphere_local = (pos, 0)
+        else:
+            box_min, box_max = self.bbox_local
+            self.bbox_local = (np.minimum(box_min, pos), np.maximum(box_max, pos))
+            center, radius = self.bsphere_local
+            self.bsphere_local = (center, max(radius, np.linalg.norm(pos - center)))
+        self._bounds_world = None
+        self._bounds_changed()
+        
+        
+    def world_bounds(self):
+        """
+        Returns the bounding volumes transformed into world space as a
+        tuple (box_min, box_max, center, radius), or None if this item
+        has no vertices.
+        
+        The result is cached until the vertices or the transformation
+        change. In billboard mode, the rotation follows the camera, so
+        a sphere around the origin containing all rotations is used.
+        """
+        if self.bbox_local is None:
+            return None
+        
+        center_local, radius_local = self.bsphere_local
+        
+        if self.billboard:
+            origin = self.world_origin()
+            center = np.array([origin.x(), origin.y(), origin.z()])
+            radius = (np.linalg.norm(center_local) + radius_local) * abs(self.scale)
+            return (center - radius, center + radius, center, radius)
+        
+        if self._bounds_world is None:
+            m = np.array(self.model_matrix_list()).reshape(4, 4)
+            rot = m[0:3, 0:3] # rotation and scale
+            trans = m[0:3, 3]
+            
+            # transform the box center and project the half extents
+            box_min, box_max = self.bbox_local
+            box_center = rot.dot((box_min + box_max) * 0.5) + trans
+            box_half = np.abs(rot).dot((box_max - box_min) * 0.5)
+            
+            center = rot.dot(center_local) + trans
+            radius = radius_local * abs(self.scale)
+            
+            self._bounds_world = (box_center - box_half, box_center + box_half, center, radius)
+            
+        return self._bounds_world
+        
+        
+    def is_visible(self, frustum):
+        """
+        Returns False if this item is completely outside of `frustum`.
+        Items without vertices are always considered visible.
+        
+        @param frustum
+        An instance of Frustum
+        """
+        bounds = self.world_bounds()
+        if bounds is None:
+            return True
+        
+        box_min, box_max, center, radius = bounds
+        return frustum.intersects_sphere(center, radius) and frustum.intersects_aabb(box_min, box_max)
+        
+        
+    def segment_index(self):
+        """
+        Returns the SegmentIndex of this item, building it if needed.
+        It is forgotten whenever the vertex data change.
+        """
+        if self._segment_index is None:
+            positions = self.positions()
+            self._segment_index = SegmentIndex(positions, self.primitive_type, self.vdata_indices, self.restart_index)
+        return self._segment_index
+        
+        
+    def kdtree(self):
+        """
+        Returns a scipy.spatial.cKDTree over the positions of all used
+        vertices in local coordinates, building it if needed. It is
+        forgotten whenever the vertex data change, but stays valid when
+        this item or one of its ancestors is moved, scaled or rotated.
+        """
+        if self._kdtree is None:
+            self._kdtree = cKDTree(self.positions())
+        return self._kdtree
+    
+    
+    def _world_matrix(self):
+        """
+        Returns the Model matrix as numpy array and the number of world
+        units per local unit, or None in billboard mode, where world
+        positions depend on the camera.
+        """
+        if self.billboard:
+            return None
+        mat_m = np.array(self.model_matrix_list()).reshape(4, 4)
+        # origins, rotations and uniform scales only, so lengths scale alike
+        return mat_m, float(np.linalg.norm(mat_m[0:3, 0]))
+    
+    
+    def world_positions(self, vertices):
+        """
+        Returns the positions of vertices in world coordinates as numpy
+        array of shape (n, 3), or None in billboard mode.
+        
+        @param vertices
+        Array-like of vertex numbers
+        """
+        world = self._world_matrix()
+        if world == None:
+            return None
+        mat_m, scale = world
+        return self.positions()[vertices].dot(mat_m[0:3, 0:3].T) + mat_m[0:3, 3]
+        
+        
+    def nearest_vertex(self, point):
+        """
+        Returns a tuple (vertex number, distance) of the vertex closest
+        to `point`, or None if there is none. Always None in billboard
+        mode.
+        
+        @param point
+        3-tuple in world coordinates
+        """
+        tree = self.kdtree()
+        world = self._world_matrix()
+        if tree is None or tree.n == 0 or world == None:
+            return None
+        mat_m, scale = world
+        distance, vertex = tree.query(np.linalg.solve(mat_m, np.append(point, 1))[0:3])
+        return int(vertex), float(distance) * scale
+        
+        
+    def vertices_within_radius(self, point, radius):
+        """
+        Returns a numpy array of the numbers of all vertices within
+        `radius` of `point`, sorted. Always empty in billboard mode.
+        
+        @param point
+        3-tuple in world coordinates
+        
+        @param radius
+        Radius in world units
+        """
+        tree = self.kdtree()
+        world = self._world_matrix()
+        if tree is None or world == None:
+            return np.zeros(0, dtype=np.int64)
+        mat_m, scale = world
+        center = np.linalg.solve(mat_m, np.append(point, 1))[0:3]
+        return np.array(tree.query_ball_point(center, radius / scale, return_sorted=True), dtype=np.int64)
+        
+        
+    def vertices_within_box(self, box_min, box_max):
+        """
+        Returns a numpy array of the numbers of all vertices inside of an
+        axis-aligned box, sorted. Always empty in billboard mode.
+        
+        @param box_min
+        Lower corner in world coordinates, 3-tuple
+        
+        @param box_max
+        Upper corner in world coordinates, 3-tuple
+        """
+        box_min = np.asarray(box_min, dtype=np.float64)
+        box_max = np.asarray(box_max, dtype=np.float64)
+        
+        # The box is not axis-aligned in local coordinates. Candidates are
+        # within the sphere around it, and tested in world coordinates.
+        center = (box_min + box_max) * 0.5
+        candidates = self.vertices_within_radius(center, float(np.linalg.norm(box_max - center)))
+        if len(candidates) == 0:
+            return candidates
+        positions = self.world_positions(candidates)
+        inside = ((positions >= box_min) & (positions <= box_max)).all(axis=1)
+        return candidates[inside]
+        
+        
+    def pick(self, origin, direction, tan_tolerance, mat_v_inverted=None):
+        """
+        Find the line segment (or triangle edge) of this item closest to
+        a ray in world space.
+        
+        Returns None if no segment is within `tan_tolerance`, otherwise
+        a dict with the keys
+          * "label": label of this item
+          * "item": this item
+          * "segment": 2-tuple of the vertex numbers of the segment
+          * "segment_number": number of the segment in drawing order,
+            see SegmentIndex.segments()
+          * "vertex": vertex number of the segment end closest to the ray
+          * "position": closest point on the segment in world coordinates
+          * "t": distance of that point from the ray origin
+          * "tan_angle": tangent of the angle between ray and segment
+        
+        @param origin
+        Start of the ray in world coordinates, 3-tuple
+        
+        @param direction
+        Normalized direction of the ray in world coordinates, 3-tuple
+        
+        @param tan_tolerance
+        Tangent of the maximum angle between the ray and a segment,
+        corresponding to a picking tolerance in pixels.
+        
+        @param mat_v_inverted
+        The inverted View matrix. Mandatory only when self.billboard == True
+        """
+        if self.vertexcount == 0 or len(self.vdata_pos_col) == 0:
+            return None # no vertices, or released, see release_vertices()
+        
+        mat_m = np.array(self.model_matrix_list(mat_v_inverted)).reshape(4, 4)
+        mat_m_inv = np.linalg.inv(mat_m)
+        
+        # transform the ray into local coordinates
+        origin_local = mat_m_inv.dot(np.append(origin, 1))[0:3]
+        direction_local = mat_m_inv[0:3, 0:3].dot(direction)
+        
+        index = self.segment_index()
+        hit = index.query_ray(origin_local, direction_local, tan_tolerance, abs(self.scale))
+        if hit == None:
+            return None
+        
+        segment, s, t, tan_angle = hit
+        vertex_a = int(index.seg_a[segment])
+        vertex_b = int(index.seg_b[segment])
+        position = index.positions[vertex_a] + s * (index.positions[vertex_b] - index.positions[vertex_a])
+        
+        return {
+            "label": self.label,
+            "item": self,
+            "segment": (vertex_a, vertex_b),
+            "segment_number": segment,
+            "vertex": vertex_a if s < 0.5 else vertex_b,
+            "position": tuple(mat_m.dot(np.append(position, 1))[0:3]),
+            "t": t,
+            "tan_angle": tan_angle,
+            }
         
         
     def set_scale(self, fac):
@@ -287,6 +1049,7 @@ class Item():
         Scale factor
         """
         self.scale = fac
+        self._transform_changed()
         
         
     def set_origin(self, tpl):
@@ -298,10 +1061,167 @@ class Item():
         """
         self.origin = QVector3D(*tpl)
         self.origin_tuple = tpl
+        self._transform_changed()
+        
+        
+    def set_rotation(self, angle, vector=None):
+        """
+        Alternative method to set rotation.
+        
+        @param angle
+        Rotation angle around self.rotation_vector in degrees
+        
+        @param vector
+        Optional new rotation axis as 3-tuple
+        """
+        self.rotation_angle = angle
+        if vector != None:
+            self.rotation_vector = QVector3D(*vector)
+        self._transform_changed()
+        
+        
+    @property
+    def billboard(self):
+        return self._billboard
+    
+    
+    @billboard.setter
+    def billboard(self, val):
+        # billboards have different world bounds
+        self._billboard = val
+        self._transform_changed()
+        
+        
+    def set_parent(self, parent, keep_world=False):
+        """
+        Make the local coordinate system of this item relative to the
+        coordinate system of another item, e.g. to attach toolpaths, labels
+        and probe maps to a work coordinate system. When the parent moves
+        or rotates, all its descendants follow.
+        
+        Children inherit translation and rotation, but not the scale of
+        their parent: scale is the unit of the vertices of an item, not
+        of its coordinate system (a CoordSystem with scale 50 has 50 long
+        axes, but its children keep their own units).
+        
+        Billboards only inherit their position.
+        
+        @param parent
+        Another Item, or None to make self relative to the world again.
+        
+        @param keep_world
+        If True, origin and rotation are changed so that this item stays
+        where it is in the world. Otherwise they are kept, and the item
+        moves along with the change of its coordinate system.
+        """
+        ancestor = parent
+        while ancestor != None:
+            if ancestor is self:
+                raise ValueError("Item '{}': Can not become a descendant of itself.".format(self.label))
+            ancestor = ancestor.parent
+            
+        if keep_world:
+            # the frame relative to the new parent
+            frame = np.array(Item.qt_mat_to_list(self.frame_matrix())).reshape(4, 4)
+            if parent != None:
+                parent_frame = np.array(Item.qt_mat_to_list(parent.frame_matrix())).reshape(4, 4)
+                frame = np.linalg.inv(parent_frame).dot(frame)
+            self.origin_tuple = tuple(float(x) for x in frame[0:3, 3])
+            self.origin = QVector3D(*self.origin_tuple)
+            if not self.billboard:
+                # the frame of billboards doesn't contain their rotation
+                self.rotation_angle, axis = Item.axis_angle(frame[0:3, 0:3])
+                self.rotation_vector = QVector3D(*axis)
+            
+        if self.parent != None:
+            self.parent.children.remove(self)
+        self.parent = parent
+        if parent != None:
+            parent.children.append(self)
+            
+        self._transform_changed()
+        
+        
+    def frame_matrix(self):
+        """
+        Returns the transformation from the local coordinate system of
+        this item into world coordinates, without scale, as QMatrix4x4.
+        This is what children of this item are relative to.
+        
+        The result is cached until the transformation of this item or
+        one of its ancestors changes.
+        """
+        if self._mat_frame is None:
+            if self.parent == None:
+                mat = QMatrix4x4()
+            else:
+                mat = QMatrix4x4(self.parent.frame_matrix())
+            mat.translate(self.origin)
+            if not self.billboard:
+                mat.rotate(self.rotation_angle, self.rotation_vector)
+            self._mat_frame = mat
+        return self._mat_frame
+    
+    
+    def world_origin(self):
+        """
+        Returns the origin of this item in world coordinates as QVector3D.
+        """
+        return self.frame_matrix().column(3).toVector3D()
+        
+        
+    def _transform_changed(self):
+        """
+        Forget everything that depends on origin, scale or rotation, for
+        this item and all of its descendants.
+        """
+        self._mat_frame = None
+        self._mat_m_list = None
+        self._bounds_world = None
+        self._bounds_changed()
+        
+        for child in self.children:
+            child._transform_changed()
+        
+        
+    def request_update(self):
+        """
+        Marks this item as changed, and requests a new frame from the
+        PainterWidget it is part of. Use this for changes the next
+        frame has to show without any call of the PainterWidget.
+        """
+        self.dirty = True
+        if self.notify != None:
+            self.notify()
+            
+            
+    def _bounds_changed(self):
+        """
+        Notify the BVH that the world bounds of this item have changed.
+        """
+        if self.bvh is not None:
+            self.bvh.update(self)
+        
+        
+    def model_matrix_list(self, mat_v_inverted=None):
+        """
+        Returns the Model matrix as a list suitable for `set_uniform()`.
+        
+        Unless in billboard mode, the result is cached until one of
+        `set_origin()`, `set_scale()` or `set_rotation()` is called.
+        
+        @param mat_v_inverted
+        The inverted View matrix. Mandatory only when self.billboard == True
+        """
+        if self.billboard:
+            return Item.qt_mat_to_list(self.calculate_model_matrix(mat_v_inverted))
+        
+        if self._mat_m_list is None:
+            self._mat_m_list = Item.qt_mat_to_list(self.calculate_model_matrix())
+        return self._mat_m_list
 
 
-        
-    def draw(self, mat_v_inverted):
+    def draw(self, mat_v_inverted, state=None):
         """
         Draws this object. Call this from within `paintGL()`.
         Assumes that glUseProgram() has been called.
@@ -309,10 +1229,23 @@ class Item():
         @param viewmatrix_inverted
         The inverted View matrix. It contains Camera position and angles.
         Mandatory only when self.billboard == True
+        
+        @param state
+        An instance of GlState shared by all items drawn during one
+        frame. OpenGL state changes are made through it so that
+        redundant calls are skipped. When None, all calls are made.
         """
+        if state == None:
+            state = GlState()
+            
+        self.realize(state)
         
-        mat_m = self.calculate_model_matrix(mat_v_inverted)
-        mat_m = Item.qt_mat_to_list(mat_m)
+        if self._dirty_range != None:
+            start, end = self._dirty_range
+            self._dirty_range = None
+            self.upload_vertices(start, end - start, state=state)
+        
+        mat_m = self.model_matrix_list(mat_v_inverted)
         self.program.set_uniform("mat_m", mat_m)
         
         for key, val in self.uniforms.items():
@@ -321,30 +1254,37 @@ class Item():
             self.program.set_uniform(key, val)
 
         if self.filled:
-            glPolygonMode( GL_FRONT_AND_BACK, GL_FILL )
+            state.polygon_mode(GL_FILL)
         else:
-            glPolygonMode( GL_FRONT_AND_BACK, GL_LINE )
+            state.polygon_mode(GL_LINE)
         
         # set up state
-        glBindVertexArray(self.vao)
-        glBindBuffer(GL_ARRAY_BUFFER, self.vbo_array) # this is not part of the VAO state
+        state.bind_vertex_array(self.vao)
+        state.bind_buffer(GL_ARRAY_BUFFER, self.vbo_array) # this is not part of the VAO state
         
         # draw!
-        glLineWidth(self.linewidth)
-        if self.vdata_indices != None:
+        state.line_width(self.linewidth)
+        self.draw_primitives(state)
+        
+        self.dirty = False
+        
+        
+    def draw_primitives(self, state):
+        """
+        Issues the draw calls, after `draw()` has set up the state.
+        Subclasses drawing only ranges of their vertices override this.
+        """
+        if self.vdata_indices is not None:
             # indexed drawing
-            glDrawElements(self.primitive_type, self.vdata_indices.size, GL_UNSIGNED_INT, ctypes.c_void_p(0))
+            glDrawElements(self.primitive_type, self.vdata_indices.size, Item.index_types[self.vdata_indices.itemsize], ctypes.c_void_p(0))
         else:
             glDrawArrays(self.primitive_type, 0, self.vertexcount)
         
-        glBindVertexArray(0)
-        
-        self.dirty = False
-        
         
     def calculate_model_matrix(self, viewmatrix_inv=None):
         """
-        Calculates the Model matrix based upon self.origin and self.scale.
+        Calculates the Model matrix based upon self.origin and self.scale,
+        relative to the coordinate system of self.parent, if any.
         
         If self.billboard == False, the Model matrix will also be rotated
         determined by self.rotation_angle and self.rotation_axis.
@@ -362,10 +1302,13 @@ class Item():
         The inverted View matrix as instance of QMatrix4x4. Mandatory when
         self.billboard == True, otherwise optional.
         """
-        mat_m = QMatrix4x4()
-        mat_m.translate(self.origin)
-        
         if self.billboard:
+            # The position is inherited from the parent, if any, but the
+            # rotation follows the camera.
+            origin = self.world_origin()
+            mat_m = QMatrix4x4()
+            mat_m.translate(origin)
+            
             # Billboard calulation is based on excellent tutorial:
             # http://nehe.gamedev.net/article/billboarding_how_to/18011/
             
@@ -378,8 +1321,8 @@ class Item():
             cam_pos = viewmatrix_inv * QVector4D(0,0,0,1)
             cam_pos = QVector3D(cam_pos[0], cam_pos[1], cam_pos[2])
             
-            # calculate self look vector (vector from self.origin to camera)
-            bill_look = cam_pos - self.origin
+            # calculate self look vector (vector from origin to camera)
+            bill_look = cam_pos - origin
             bill_look.normalize()
             
             if self.billboard_axis == None:
@@ -428,7 +1371,7 @@ class Item():
             mat_m[2,2] = bill_look[2]
             
         else:
-            mat_m.rotate(self.rotation_angle, self.rotation_vector)
+            mat_m = QMatrix4x4(self.frame_matrix())
         
         mat_m.scale(self.scale)
         
@@ -449,6 +1392,28 @@ class Item():
         return math.acos(QVector3D.dotProduct(v1, v2) / (v1.length() * v2.length()))
     
 
+    @staticmethod
+    def axis_angle(rotation):
+        """
+        Returns a tuple (angle in degrees, axis as 3-tuple) of the rotation
+        described by the 3x3 rotation matrix `rotation`, as expected by
+        `set_rotation()`.
+        """
+        r = np.asarray(rotation, dtype=np.float64)
+        cos = np.clip((np.trace(r) - 1) / 2, -1, 1)
+        angle = math.acos(cos)
+        axis = np.array([r[2, 1] - r[1, 2], r[0, 2] - r[2, 0], r[1, 0] - r[0, 1]])
+        
+        if angle < 1e-9:
+            return (0, (0, 1, 0)) # no rotation, default axis
+        if math.pi - angle < 1e-6:
+            # half turn: the matrix is symmetric, the axis follows from r + I
+            sym = (r + np.eye(3)) / 2
+            axis = sym[:, int(np.argmax(np.diag(sym)))]
+        axis = axis / np.linalg.norm(axis)
+        return (math.degrees(angle), tuple(float(x) for x in axis))
+    
+    
     @staticmethod
     def qt_mat_to_list(mat):
         """
@@ -0,0 +1,265 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import re
+import numpy as np
+import OpenGL
+from OpenGL.GL import *
+
+from .item import Item
+from ..gl_state import GlState
+from ..colormaps import Colormaps
+
+class LeveledGcodePath(Item):
+    """
+    Plots a GcodePath compensated for the surface measured by a
+    HeightMap, e.g. for isolation milling of a slightly warped PCB
+    (auto-leveling).
+    
+    Segments of the path are subdivided so that no piece is longer than
+    the spacing of the height grid. The height of the surface below each
+    vertex is interpolated bilinearly and added to its Z coordinate.
+    Everything is done with vectorized numpy operations.
+    
+    The subdivision is done once. Whenever the heights of the HeightMap
+    change, only the offsets are re-calculated, during the next `draw()`.
+    The compensated G-code can be exported with `to_gcode()`.
+    """
+    
+    # words of motion lines which are replaced when exporting
+    _re_motion_words = re.compile(r"([XYZIJKR]\s*[-+]?[0-9.]+|G0?[0-3](?![0-9]))", re.IGNORECASE)
+    _re_comment = re.compile(r"(\(.*\)|;.*)")
+    _re_g_code = re.compile(r"G\s*0*([0-9]+)", re.IGNORECASE)
+    
+    # G codes of motion lines which are exported unchanged: other motion
+    # modes like arcs, probing and canned cycles, and non-modal moves
+    _passthrough_codes = set([2, 3, 28, 30, 33, 38, 53, 73, 76, 92] + list(range(80, 90)))
+    
+    def __init__(self, label, prog_id, gcode_path, heightmap, reference=0, max_length=None):
+        """
+        @param label
+        A string containing a unique name for this item.
+            
+        @param prog_id
+        OpenGL program ID (determines shaders to use) to use for this item.
+        
+        @param gcode_path
+        The GcodePath to compensate. Its position, scale, rotation and
+        parent are taken over.
+        
+        @param heightmap
+        The HeightMap of the measured surface. Its local Z axis is the
+        direction of compensation.
+        
+        @param reference
+        Height of the HeightMap which corresponds to no compensation.
+        
+        @param max_length
+        Maximum length of subdivided segments in local XY units of the
+        HeightMap. Defaults to the smaller grid spacing.
+        """
+        super(LeveledGcodePath, self).__init__(label, prog_id, GL_LINE_STRIP, gcode_path.linewidth, gcode_path.origin_tuple, gcode_path.scale, vertex_format=gcode_path.vertex_format)
+        self.set_rotation(gcode_path.rotation_angle, gcode_path.rotation_vector)
+        if gcode_path.parent != None:
+            self.set_parent(gcode_path.parent)
+            
+        self.gcode_path = gcode_path
+        self.heightmap = heightmap
+        self.reference = reference
+        
+        if max_length == None:
+            positions = heightmap.vdata_pos_col["position"]
+            max_length = min(abs(positions[1][0] - positions[0][0]), abs(positions[heightmap.nodes_x][1] - positions[0][1]))
+        self.max_length = max_length
+        
+        self.subdivide()
+        self.compensate()
+        
+        
+    def _to_heightmap(self):
+        """
+        Returns the matrix transforming local coordinates of this item
+        into local coordinates of the HeightMap, as numpy array.
+        """
+        mat_m = np.array(self.model_matrix_list()).reshape(4, 4)
+        mat_h = np.array(self.heightmap.model_matrix_list()).reshape(4, 4)
+        return np.linalg.inv(mat_h).dot(mat_m)
+    
+    
+    def subdivide(self):
+        """
+        Subdivides the segments of the GcodePath. The result is kept in
+        HeightMap coordinates, together with the segment and the fraction
+        along the segment each new vertex came from.
+        
+        Float and normalized attributes, like colors, are interpolated.
+        Other integer attributes, like the categories of palette mode,
+        are taken from the end of the segment.
+        """
+        path = self.gcode_path
+        
+        # vertices in drawing order, also when the path is indexed
+        order = path.vertex_order()
+        count = len(order)
+        positions = path.positions()[order].astype(np.float64)
+        
+        mat = self._to_heightmap()
+        positions_h = positions.dot(mat[0:3, 0:3].T) + mat[0:3, 3]
+        
+        # number of pieces per segment
+        lengths = np.linalg.norm(np.diff(positions_h[:, 0:2], axis=0), axis=1)
+        pieces = np.maximum(1, np.ceil(lengths / self.max_length).astype(np.int64))
+        
+        # for each new vertex after the first: its segment and the
+        # fraction t in (0, 1] along it
+        segment = np.repeat(np.arange(count - 1), pieces)
+        first = np.cumsum(pieces) - pieces
+        t = (np.arange(len(segment)) - np.repeat(first, pieces) + 1) / np.repeat(pieces, pieces)
+        
+        self.segment = np.concatenate(([-1], segment))
+        self.fraction = np.concatenate(([1.0], t))
+        
+        start = positions_h[:-1][segment]
+        end = positions_h[1:][segment]
+        self.positions_h = np.vstack((positions_h[0:1], start + (end - start) * t[:, np.newaxis]))
+        
+        # G-code line of each vertex, see GcodePath.vertex_lines
+        self.vertex_lines = path.vertex_lines[:count][self.segment + 1]
+        
+        n = len(self.positions_h)
+        if n > self.vertexcount_max:
+            self.set_vertexcount_max(n)
+            
+        fmt = self.vertex_format
+        for name in fmt.names:
+            if name == "position":
+                continue
+            values = fmt.decode(name, path.vdata_pos_col[name][:path.vertexcount])[order]
+            values_end = values[1:][segment]
+            if fmt.dtype[name].base.kind == "f" or fmt.is_normalized(name):
+                values_start = values[:-1][segment]
+                values_end = values_start + (values_end - values_start) * t.reshape((-1,) + (1,) * (values.ndim - 1))
+            self.set_vertex_attribute(name, np.concatenate((values[0:1], values_end)))
+        self.vertexcount = n
+        
+        
+    def compensate(self):
+        """
+        Calculates the compensated vertex positions from the current
+        heights of the HeightMap. Call `upload()` afterwards, or let
+        `draw()` do both.
+        """
+        positions_h = self.positions_h.copy()
+        positions_h[:, 2] += self.heightmap.z_at(positions_h) - self.reference
+        
+        mat = np.linalg.inv(self._to_heightmap())
+        positions = positions_h.dot(mat[0:3, 0:3].T) + mat[0:3, 3]
+        
+        self.vdata_pos_col["position"][:self.vertexcount] = self.vertex_format.encode("position", positions)
+        self.compensated_version = self.heightmap.version
+        
+        
+    def to_gcode(self):
+        """
+        Returns the compensated G-code as a list of strings.
+        
+        Each G0 or G1 line is replaced by straight moves of the same
+        motion mode to its subdivided points. The first move keeps the
+        other words of the original line, e.g. the feed rate. Since the
+        vertices are in machine coordinates, moves are written with G53.
+        
+        All other lines are passed through unchanged. These include
+        lines without motion, but also arcs, probing moves, canned
+        cycles and moves with G28, G30, G53 or G92, which are therefore
+        not compensated. Break arcs into lines with `do_fractionize_arcs`
+        of the GcodePath to compensate them.
+        """
+        self.compensate_if_needed()
+        
+        gcode = self.gcode_path.gcode
+        positions = self.positions()
+        
+        # Export the vertices ending the segment of the target
+        # (odd segments in GcodePath), not those ending the short first
+        # segment which only serves visualization
+        segment = self.segment
+        exported = (segment % 2 == 1) | ((segment % 2 == 0) & (self.fraction < 1))
+        exported[0] = False
+        
+        lines = self.vertex_lines[exported]
+        points = positions[exported]
+        
+        # points of each line are contiguous
+        starts = np.searchsorted(lines, np.arange(len(gcode)), side="left")
+        ends = np.searchsorted(lines, np.arange(len(gcode)), side="right")
+        
+        # lines whose target equals their start have no motion
+        vertices = self.gcode_path.positions()[self.gcode_path.vertex_order()]
+        line_start = vertices[0:2 * len(gcode):2]
+        line_target = vertices[2:2 * len(gcode) + 1:2]
+        has_motion = (line_start != line_target).any(axis=1)
+        
+        result = []
+        for line_number, line in enumerate(gcode):
+            code = LeveledGcodePath._re_comment.sub("", line)
+            mode = self.gcode_path.line_motion_modes[line_number]
+            codes = [int(c) for c in LeveledGcodePath._re_g_code.findall(code)]
+            if not has_motion[line_number] or not mode in (0, 1) or LeveledGcodePath._passthrough_codes.intersection(codes):
+                result.append(line)
+                continue
+            
+            # keep everything but coordinates, motion mode and comments
+            words = " ".join(LeveledGcodePath._re_motion_words.sub("", code).split())
+            motion = "G53 G{} ".format(mode)
+            
+            for i in range(starts[line_number], ends[line_number]):
+                coordinates = "X{:.4f} Y{:.4f} Z{:.4f}".format(*points[i])
+                if i == starts[line_number] and words:
+                    result.append(motion + words + " " + coordinates)
+                else:
+                    result.append(motion + coordinates)
+                    
+        return result
+    
+    
+    def compensate_if_needed(self):
+        if self.compensated_version != self.heightmap.version:
+            self.compensate()
+            return True
+        return False
+    
+    
+    def draw(self, mat_v_inverted, state=None):
+        if state == None:
+            state = GlState()
+        self.realize(state)
+            
+        if self.compensate_if_needed():
+            self.upload()
+            state.invalidate() # upload() made raw OpenGL calls
+                
+        # follow the color scheme of the GcodePath in palette mode
+        if self.gcode_path.palette_mode:
+            self.uniforms = self.gcode_path.uniforms
+            Colormaps.bind(self.program, self.gcode_path.colormap, state)
+            
+        super(LeveledGcodePath, self).draw(mat_v_inverted, state)
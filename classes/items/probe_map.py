@@ -0,0 +1,218 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import numpy as np
+from scipy.spatial import Delaunay, QhullError
+
+class ProbeMap():
+    """
+    Interpolates heights measured at scattered probe points onto the
+    nodes of a HeightMap, e.g. during the auto-leveling probe cycle of
+    a CNC machine.
+    
+    The interpolation is piecewise linear within a Delaunay triangulation
+    of the probe points, like `scipy.interpolate.griddata` with method
+    "linear". Unlike griddata, the triangulation is kept and extended
+    incrementally. For each node of the HeightMap, the containing triangle
+    and the barycentric weights are cached. When probe points are added,
+    only nodes in triangles which the triangulation replaced are located
+    again, and when a probe value changes, only nodes in triangles around
+    that probe point are re-evaluated.
+    
+    Changed heights are written into the HeightMap with `update_z()`, so
+    that only the changed part is uploaded to the GPU.
+    """
+    
+    points_max = 1 << 21 # triangles are identified by 3 indices of 21 bits
+    
+    def __init__(self, heightmap, fill_value=0):
+        """
+        @param heightmap
+        The HeightMap to write into. The probe points are given in its
+        local XY coordinates.
+        
+        @param fill_value
+        Height of nodes outside of the convex hull of the probe points.
+        """
+        self.heightmap = heightmap
+        self.fill_value = fill_value
+        
+        self.nodes_xy = heightmap.vdata_pos_col["position"][:, 0:2].astype(np.float64)
+        node_count = len(self.nodes_xy)
+        
+        self.points = np.zeros((0, 2))
+        self.values = np.zeros(0)
+        
+        # Delaunay triangulation, None until there are 3 points not on a line.
+        # Qhull can only extend triangulations started from at least 4
+        # points, not all on a circle. Until then, it is replaced whenever
+        # points are added.
+        self.triangulation = None
+        self._incremental = False
+        self._simplex_keys = np.zeros(0, dtype=np.int64) # see _keys()
+        
+        # per node: the probe points of the containing triangle,
+        # or -1 if outside of the convex hull, and barycentric weights
+        self.node_vertices = np.full((node_count, 3), -1, dtype=np.int64)
+        self.node_weights = np.zeros((node_count, 3))
+        self._node_keys = np.full(node_count, -1, dtype=np.int64)
+        
+        self.z = np.full(node_count, fill_value, dtype=np.float32)
+        
+        
+    def add(self, points, values):
+        """
+        Adds probe points and updates the HeightMap.
+        
+        Interpolation starts with 3 points not on a line. The
+        triangulation is extended incrementally from 4 points on which
+        are not all on a circle, e.g. the corners of a rectangle. Before
+        that, all nodes are located again.
+        
+        @param points
+        Array-like of shape (n, 2) of XY coordinates, or a single 2-tuple.
+        
+        @param values
+        Array-like of n measured heights, or a single height.
+        """
+        points = np.array(points, dtype=np.float64, ndmin=2)
+        values = np.array(values, dtype=np.float64, ndmin=1)
+        if len(points) != len(values):
+            raise ValueError("Got {} probe points but {} values".format(len(points), len(values)))
+        if len(self.points) + len(points) > ProbeMap.points_max:
+            raise ValueError("More than {} probe points".format(ProbeMap.points_max))
+        
+        self.points = np.vstack((self.points, points))
+        self.values = np.concatenate((self.values, values))
+        
+        if not self._incremental:
+            if len(self.points) < 3:
+                return
+            triangulation = None
+            if len(self.points) >= 4:
+                try:
+                    triangulation = Delaunay(self.points, incremental=True)
+                except QhullError:
+                    pass # e.g. all points on a circle
+            self._incremental = triangulation is not None
+            if triangulation is None:
+                try:
+                    triangulation = Delaunay(self.points)
+                except QhullError:
+                    return # all points on a line so far
+            self.triangulation = triangulation
+            changed = np.arange(len(self.nodes_xy))
+        else:
+            # only points outside of the hull can enlarge it
+            hull_grows = (self.triangulation.find_simplex(points) < 0).any()
+            self.triangulation.add_points(points)
+            changed = self._nodes_in_replaced_simplices(hull_grows)
+            
+        self._simplex_keys = ProbeMap._keys(self.triangulation.simplices)
+        self._locate(changed)
+        self._evaluate(changed)
+        
+        
+    def set_value(self, index, value):
+        """
+        Changes the measured height of a probe point, e.g. after probing
+        it again, and updates the HeightMap.
+        
+        @param index
+        Index of the probe point, in the order of addition.
+        """
+        self.values[index] = value
+        if self.triangulation is None:
+            return
+        changed = np.flatnonzero((self.node_vertices == index).any(axis=1))
+        self._evaluate(changed)
+        
+        
+    @staticmethod
+    def _keys(vertices):
+        # one integer per triangle, independent of the vertex order
+        vertices = np.sort(vertices, axis=1).astype(np.int64)
+        return (vertices[:, 0] << 42) | (vertices[:, 1] << 21) | vertices[:, 2]
+    
+    
+    def _nodes_in_replaced_simplices(self, hull_grows):
+        """
+        Returns the indices of nodes whose triangle is not part of the
+        triangulation any more, and of nodes outside of the convex hull
+        if it has grown.
+        """
+        keys = ProbeMap._keys(self.triangulation.simplices)
+        replaced = np.setdiff1d(self._simplex_keys, keys, assume_unique=True)
+        
+        changed = np.isin(self._node_keys, replaced)
+        if hull_grows:
+            changed |= self._node_keys == -1
+        return np.flatnonzero(changed)
+    
+    
+    def _locate(self, nodes):
+        """
+        Finds the containing triangles of `nodes` and calculates their
+        barycentric weights.
+        """
+        if len(nodes) == 0:
+            return
+        tri = self.triangulation
+        xy = self.nodes_xy[nodes]
+        
+        simplices = tri.find_simplex(xy)
+        inside = simplices >= 0
+        
+        # see the documentation of scipy.spatial.Delaunay.transform
+        transform = tri.transform[simplices[inside]]
+        b = np.einsum("ijk,ik->ij", transform[:, 0:2], xy[inside] - transform[:, 2])
+        
+        self.node_vertices[nodes] = -1
+        self.node_vertices[nodes[inside]] = tri.simplices[simplices[inside]]
+        self.node_weights[nodes[inside]] = np.column_stack((b, 1 - b.sum(axis=1)))
+        
+        self._node_keys[nodes] = -1
+        self._node_keys[nodes[inside]] = ProbeMap._keys(self.node_vertices[nodes[inside]])
+        
+        
+    def _evaluate(self, nodes):
+        """
+        Interpolates the heights of `nodes` and writes them into the
+        HeightMap.
+        """
+        if len(nodes) == 0:
+            return
+        vertices = self.node_vertices[nodes]
+        inside = vertices[:, 0] >= 0
+        
+        z = np.full(len(nodes), self.fill_value, dtype=np.float64)
+        z[inside] = (self.node_weights[nodes[inside]] * self.values[vertices[inside]]).sum(axis=1)
+        self.z[nodes] = z
+        
+        # write the block of rows and columns enclosing all changed nodes
+        nx = self.heightmap.nodes_x
+        rows = nodes // nx
+        cols = nodes % nx
+        row0, row1 = rows.min(), rows.max() + 1
+        col0, col1 = cols.min(), cols.max() + 1
+        grid = self.z.reshape(self.heightmap.nodes_y, nx)
+        self.heightmap.update_z(grid[row0:row1, col0:col1], row0, col0)
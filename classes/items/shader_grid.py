@@ -0,0 +1,138 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import numpy as np
+
+import OpenGL
+from OpenGL.GL import *
+
+from .item import Item
+
+class ShaderGrid(Item):
+    """
+    Draws a 2-dimensional grid in the local XY plane, like OrthoLineGrid,
+    but as a single quad. The lines are computed per fragment by the
+    "grid" shaders, anti-aliased, with minor and major spacing, and
+    fading out with distance from the camera.
+    
+    The cost is 4 vertices, independent of spacing and extent. The quad
+    can therefore be made large enough to appear infinite, since the
+    grid fades out long before its edges.
+    
+    Requires a program with the uniforms of shaders/grid-fragment.c.
+    """
+    
+    def __init__(self, label, prog,
+                 spacing_minor=10, spacing_major=100, extent=100000,
+                 origin=(0,0,0), scale=1, linewidth=1,
+                 color_minor=(1,1,1,0.2), color_major=(1,1,1,0.4),
+                 fade_distance=5000):
+        """
+        @param label
+        A string containing a unique name for this item.
+            
+        @param prog_id
+        OpenGL program ID (determines shaders to use) to use for this item.
+        
+        @param spacing_minor
+        At which intervals to draw a minor line.
+        
+        @param spacing_major
+        At which intervals to draw a major line.
+        
+        @param extent
+        The grid covers -extent to +extent in local X and Y.
+        
+        @param origin
+        Origin of this item in world space.
+        
+        @param scale
+        Scale of this item in world space.
+        
+        @param linewidth
+        Width of rendered lines in pixels.
+        
+        @param color_minor
+        Color of minor lines.
+        
+        @param color_major
+        Color of major lines.
+        
+        @param fade_distance
+        Distance from the camera in world units where the grid has faded
+        out completely. Fading starts at half of it.
+        """
+        super(ShaderGrid, self).__init__(label, prog, GL_TRIANGLE_STRIP, linewidth, origin, scale, True, 4)
+        
+        color = (0, 0, 0, 0) # unused, the shaders compute colors
+        self.append_vertices([[(-extent, -extent, 0), color]])
+        self.append_vertices([[(extent, -extent, 0), color]])
+        self.append_vertices([[(-extent, extent, 0), color]])
+        self.append_vertices([[(extent, extent, 0), color]])
+        
+        self.set_spacing(spacing_minor, spacing_major)
+        self.set_colors(color_minor, color_major)
+        self.set_fade_distance(fade_distance)
+        self.uniforms["line_width"] = [linewidth]
+        
+        
+    def set_spacing(self, minor, major):
+        """
+        Sets the intervals of minor and major lines in local units.
+        """
+        self.uniforms["spacing_minor"] = [minor]
+        self.uniforms["spacing_major"] = [major]
+        self.dirty = True
+        
+        
+    def set_colors(self, minor, major):
+        """
+        Sets the colors of minor and major lines as RGBA 4-tuples.
+        """
+        self.uniforms["color_minor"] = list(minor)
+        self.uniforms["color_major"] = list(major)
+        self.dirty = True
+        
+        
+    def set_fade_distance(self, distance):
+        """
+        Sets the distance from the camera in world units where the grid
+        has faded out completely.
+        """
+        self.uniforms["fade_distance"] = [distance]
+        self.dirty = True
+        
+        
+    @staticmethod
+    def fade(position_view, fade_distance):
+        """
+        Returns the opacity factor applied by shaders/grid-fragment.c to
+        a fragment at the view space position `position_view`, which
+        is interpolated linearly from the corners of the quad.
+        """
+        distance = np.linalg.norm(position_view)
+        t = np.clip((distance - 0.5 * fade_distance) / (0.5 * fade_distance), 0, 1)
+        return 1 - t * t * (3 - 2 * t) # smoothstep()
+    
+    
+    def pick(self, origin, direction, tan_tolerance, mat_v_inverted=None):
+        return None # the lines have no vertices
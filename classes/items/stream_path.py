@@ -0,0 +1,189 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import numpy as np
+import OpenGL
+from OpenGL.GL import *
+
+from .item import Item
+from ..stream_buffer import StreamBuffer
+from ..gl_state import GlState
+
+class StreamPath(Item):
+    """
+    Draws vertices which are replaced every frame, e.g. live sensor
+    overlays or spindle traces, without synchronization stalls.
+    
+    Vertices passed to `stream()` go straight into a StreamBuffer and
+    are drawn from there. Nothing is kept on the CPU, so this item can't
+    be picked and isn't culled.
+    
+    The vertex format must be interleaved.
+    """
+    
+    def __init__(self, label, prog_id, primitive_type=GL_LINE_STRIP, size=1<<22, segments=3, linewidth=1, origin=(0,0,0), scale=1, vertex_format=None, method=None):
+        """
+        @param label
+        A string containing a unique name for this item.
+            
+        @param prog_id
+        OpenGL program ID (determines shaders to use) to use for this item.
+        
+        @param primitive_type
+        An OpenGL integer GL_LINES, GL_LINE_STRIP, GL_POINTS and others.
+        
+        @param size
+        Size of the StreamBuffer in bytes. One of its segments must take
+        all vertices streamed during one frame.
+        
+        @param segments
+        Number of segments of the StreamBuffer.
+        
+        @param linewidth
+        Width of rendered lines in pixels.
+        
+        @param origin
+        Origin of this item in world space.
+        
+        @param scale
+        Scale of this item in world space.
+        
+        @param vertex_format
+        Layout of vertex data, see VertexFormat. Must be interleaved.
+        
+        @param method
+        Method of writing, see StreamBuffer.
+        """
+        super(StreamPath, self).__init__(label, prog_id, primitive_type, linewidth, origin, scale, vertex_format=vertex_format)
+        if not self.vertex_format.interleaved:
+            raise ValueError("Item '{}': StreamPath requires an interleaved vertex format".format(self.label))
+        
+        # created by realize()
+        self.stream_buffer = None
+        self._stream_buffer_args = (size, segments, method)
+        self._stride = self.vertex_format.dtype.itemsize
+        
+        self._pending = None # (first, count) of vertices streamed since the last draw
+        self._drawn = None # (first, count) of vertices drawn
+        
+        
+    def _create_gl_objects(self):
+        if self.stream_buffer == None:
+            self.stream_buffer = StreamBuffer(*self._stream_buffer_args)
+        super(StreamPath, self)._create_gl_objects()
+        
+        
+    def setup_vao(self, locations):
+        glBindVertexArray(self.vao)
+        glBindBuffer(GL_ARRAY_BUFFER, self.stream_buffer.vbo)
+        self.vertex_format.setup(locations)
+        glBindVertexArray(0)
+        
+        
+    def stream(self, vertices, state=None):
+        """
+        Sets the vertices drawn from the next frame on. Several calls
+        during the same frame add up. Requires a current OpenGL context,
+        since vertices are written straight into the StreamBuffer.
+        
+        When the vertices don't fit into the current segment of the
+        StreamBuffer anymore, because no frame has been drawn for a while
+        (e.g. the window is hidden), the vertices streamed since the last
+        frame are replaced instead.
+        
+        @param vertices
+        A numpy structured array of `vertex_format.dtype`, or a Python
+        list with one `[position, color]` element per vertex.
+        
+        @param state
+        The GlState of the current frame, if called while drawing.
+        """
+        if not isinstance(vertices, np.ndarray):
+            data = np.zeros(len(vertices), self.vertex_format.dtype)
+            data["position"] = self.vertex_format.encode("position", [vertex[0] for vertex in vertices])
+            data["color"] = self.vertex_format.encode("color", [vertex[1] for vertex in vertices])
+            vertices = data
+            
+        if len(vertices) == 0:
+            return
+        
+        self.realize(state)
+        
+        if self._pending != None and self.stream_buffer.space(self._stride) < vertices.nbytes:
+            # nothing of the current segment has been drawn yet
+            self.stream_buffer.rewind()
+            self._pending = None
+            
+        first = self.stream_buffer.write(vertices, self._stride, state) // self._stride
+        if self._pending != None and self._pending[0] + self._pending[1] == first:
+            self._pending = (self._pending[0], self._pending[1] + len(vertices))
+        else:
+            self._pending = (first, len(vertices))
+        self.dirty = True
+        
+        
+    def upload(self):
+        """
+        Nothing to upload, vertices are streamed.
+        """
+        pass
+    
+    
+    def upload_steps(self, slice_bytes=None):
+        return iter(())
+    
+    
+    def upload_size(self):
+        return 0
+    
+    
+    def remove(self):
+        if self.stream_buffer != None:
+            self.stream_buffer.remove()
+            self.stream_buffer = None
+        super(StreamPath, self).remove()
+        
+        
+    def pick(self, origin, direction, tan_tolerance, mat_v_inverted=None):
+        return None # there are no vertices on the CPU
+    
+    
+    def draw(self, mat_v_inverted, state=None):
+        if state == None:
+            state = GlState()
+        self.realize(state)
+            
+        if self._pending != None:
+            self._drawn = self._pending
+            self._pending = None
+            
+        if self._drawn == None:
+            return
+        
+        super(StreamPath, self).draw(mat_v_inverted, state)
+        
+        # the GPU reads the drawn vertices until the fence
+        self.stream_buffer.fence(self.stream_buffer.segment_of(self._drawn[0] * self._stride))
+        
+        
+    def draw_primitives(self, state):
+        glDrawArrays(self.primitive_type, self._drawn[0], self._drawn[1])
@@ -0,0 +1,519 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import ctypes
+import math
+import collections
+
+import OpenGL
+from OpenGL.GL import *
+
+import numpy as np
+
+from .item import Item
+from .height_map import HeightMap
+from ..gl_state import GlState
+from ..frustum import Frustum
+from ..colormaps import Colormaps
+
+class Tile():
+    """
+    GPU resources of one loaded tile of a TiledHeightMap.
+    """
+    
+    __slots__ = ["vao", "vbo_position", "vbo_z"]
+    
+    def __init__(self):
+        self.vao = None
+        self.vbo_position = None
+        self.vbo_z = None
+        
+        
+class TiledHeightMap(Item):
+    """
+    Draws a very large regular grid of heights, e.g. a laser-scanned
+    surface with tens of millions of nodes, which is too large to be
+    drawn as a single HeightMap.
+    
+    The grid is covered by a quadtree of tiles. All tiles have the same
+    number of nodes, but a tile of level L samples only every 2^L-th
+    node, so the root tile covers the entire grid at the coarsest level
+    and the tiles of level 0 are at full resolution.
+    
+    In each frame, the quadtree is traversed from the root. Tiles outside
+    of the view frustum are skipped, and a tile is refined into its
+    children as long as its geometric error, projected onto the screen,
+    is larger than `max_error` pixels.
+    
+    Tiles are loaded lazily from the height array, which can be a
+    numpy.memmap, so that only visible detail is read from disk and lives
+    in GPU memory. At most `loads_per_frame` tiles are loaded per frame;
+    until all children are there, the parent is drawn instead. The least
+    recently drawn tiles are evicted once more than `tiles_max` are
+    loaded.
+    
+    Cracks between neighbouring tiles of different levels are covered
+    with skirts: Each tile has a ring of additional nodes around it,
+    duplicating the border nodes but lowered by the height range of the
+    parent tile, which is the largest possible gap.
+    
+    Tiles are drawn with the same program as HeightMap, and all tiles
+    share one index buffer with HeightMaps of the same size.
+    """
+    
+    def __init__(self, label, prog, heights, spacing=1, fill=True,
+                 origin=(0,0,0), scale=1, linewidth=1,
+                 tile_nodes=65, max_error=2, tiles_max=256, loads_per_frame=8):
+        """
+        @param label
+        A string containing a unique name for this item.
+            
+        @param prog_id
+        OpenGL program ID (determines shaders to use) to use for this item.
+        
+        @param heights
+        2D array of heights with shape (rows, columns), indexed [y][x].
+        Typically a numpy.memmap. If a string is given, it is the path of
+        a .npy file which will be memory-mapped.
+        
+        @param spacing
+        Distance between neighbouring nodes in local units.
+        
+        @param fill
+        If True, draw filled triangles, otherwise a wireframe.
+        
+        @param origin
+        Origin of this item in world space.
+        
+        @param scale
+        Scale of this item in world space.
+        
+        @param linewidth
+        Width of rendered lines in pixels.
+        
+        @param tile_nodes
+        Number of nodes along each side of a tile. One more than a power
+        of two is a good choice.
+        
+        @param max_error
+        Maximum geometric error of drawn tiles, projected onto the screen,
+        in pixels.
+        
+        @param tiles_max
+        Number of tiles kept in GPU memory.
+        
+        @param loads_per_frame
+        Maximum number of tiles loaded during one frame.
+        """
+        if isinstance(heights, str):
+            heights = np.load(heights, mmap_mode="r")
+        self.heights = heights
+        self.nodes_y, self.nodes_x = heights.shape
+        if self.nodes_x < 2 or self.nodes_y < 2:
+            raise ValueError("TiledHeightMap needs at least 2x2 nodes")
+        
+        self.spacing = spacing
+        self.tile_nodes = tile_nodes
+        self.max_error = max_error
+        self.tiles_max = tiles_max
+        self.loads_per_frame = loads_per_frame
+        
+        # one additional ring of nodes around each tile for the skirts
+        self.vdata_indices = HeightMap.indices(tile_nodes + 2, tile_nodes + 2)
+        
+        super(TiledHeightMap, self).__init__(label, prog, GL_TRIANGLE_STRIP, linewidth, origin, scale, fill)
+        
+        self.vbo_element_array_shared = True
+        
+        # number of tiles (x, y) for each level, the last one being the root
+        cells = tile_nodes - 1
+        count_x = max(1, int(math.ceil((self.nodes_x - 1) / cells)))
+        count_y = max(1, int(math.ceil((self.nodes_y - 1) / cells)))
+        self.tile_counts = [(count_x, count_y)]
+        while count_x > 1 or count_y > 1:
+            count_x = (count_x + 1) // 2
+            count_y = (count_y + 1) // 2
+            self.tile_counts.append((count_x, count_y))
+        self.levels = len(self.tile_counts)
+        
+        self.z_ranges = self.calculate_z_ranges()
+        self.height_min = float(self.z_ranges[-1][0, 0, 0])
+        self.height_max = float(self.z_ranges[-1][0, 0, 1])
+        self.uniforms = {
+            "height_max": [self.height_max],
+            "height_min": [self.height_min],
+            }
+        self.colormap = "spectrum" # see HeightMap.set_colormap()
+        
+        # loaded tiles by (level, tx, ty), least recently drawn first
+        self.tiles = collections.OrderedDict()
+        self.locations = None
+        
+        self.frame_stats = {
+            "tiles_drawn": 0,
+            "tiles_loaded": 0,
+            }
+        
+        self.calculate_bounds()
+        
+        
+    def calculate_z_ranges(self):
+        """
+        Returns, for each level, an array of shape (tiles_y, tiles_x, 2)
+        containing the minimum and maximum height within each tile.
+        
+        This reads the height array once, in bands of one tile row, and
+        is needed to cull tiles before they are loaded.
+        """
+        cells = self.tile_nodes - 1
+        count_x, count_y = self.tile_counts[0]
+        starts = np.arange(count_x) * cells
+        ends = np.minimum(starts + cells, self.nodes_x - 1)
+        
+        ranges = np.empty((count_y, count_x, 2))
+        for ty in range(count_y):
+            row0 = ty * cells
+            row1 = min(row0 + cells, self.nodes_y - 1)
+            band = np.asarray(self.heights[row0:row1 + 1])
+            col_min = band.min(axis=0)
+            col_max = band.max(axis=0)
+            # neighbouring tiles share their border column
+            ranges[ty, :, 0] = np.minimum(np.minimum.reduceat(col_min, starts), col_min[ends])
+            ranges[ty, :, 1] = np.maximum(np.maximum.reduceat(col_max, starts), col_max[ends])
+            
+        result = [ranges]
+        for count_x, count_y in self.tile_counts[1:]:
+            # combine 2x2 children, padding odd counts
+            prev = result[-1]
+            padded = np.empty((2 * count_y, 2 * count_x, 2))
+            padded[..., 0] = np.inf
+            padded[..., 1] = -np.inf
+            padded[:prev.shape[0], :prev.shape[1]] = prev
+            blocks = padded.reshape(count_y, 2, count_x, 2, 2)
+            ranges = np.empty((count_y, count_x, 2))
+            ranges[..., 0] = blocks[..., 0].min(axis=(1, 3))
+            ranges[..., 1] = blocks[..., 1].max(axis=(1, 3))
+            result.append(ranges)
+            
+        return result
+    
+    
+    def calculate_bounds(self):
+        """
+        The bounds follow from the grid dimensions and the height range,
+        without any vertices on the CPU.
+        """
+        self._bounds_world = None
+        box_min = np.array([0, 0, self.height_min], dtype=np.float64)
+        box_max = np.array([(self.nodes_x - 1) * self.spacing, (self.nodes_y - 1) * self.spacing, self.height_max], dtype=np.float64)
+        self.bbox_local = (box_min, box_max)
+        center = (box_min + box_max) * 0.5
+        self.bsphere_local = (center, float(np.linalg.norm(box_max - center)))
+        self._bounds_changed()
+        
+        
+    def tile_box(self, key):
+        """
+        Returns the bounding box of a tile in local coordinates as list
+        [xmin, ymin, zmin, xmax, ymax, zmax]. Skirts are not included.
+        """
+        level, tx, ty = key
+        span = (self.tile_nodes - 1) << level
+        z_min, z_max = self.z_ranges[level][ty, tx]
+        return [
+            tx * span * self.spacing,
+            ty * span * self.spacing,
+            z_min,
+            min((tx + 1) * span, self.nodes_x - 1) * self.spacing,
+            min((ty + 1) * span, self.nodes_y - 1) * self.spacing,
+            z_max,
+            ]
+    
+    
+    def tile_children(self, key):
+        level, tx, ty = key
+        if level == 0:
+            return []
+        count_x, count_y = self.tile_counts[level - 1]
+        return [(level - 1, x, y)
+                for y in (2 * ty, 2 * ty + 1) if y < count_y
+                for x in (2 * tx, 2 * tx + 1) if x < count_x]
+    
+    
+    def tile_error(self, key):
+        """
+        Estimated geometric error of a tile compared to full resolution:
+        The distance between samples, but not more than the height range
+        within the tile. Flat areas are thus never refined.
+        """
+        level, tx, ty = key
+        if level == 0:
+            return 0
+        z_min, z_max = self.z_ranges[level][ty, tx]
+        return min((1 << level) * self.spacing, z_max - z_min)
+    
+    
+    def tile_data(self, key):
+        """
+        Reads the nodes of a tile, including the skirt ring, from the
+        height array. Returns the arrays of positions and heights.
+        """
+        level, tx, ty = key
+        step = 1 << level
+        n = self.tile_nodes
+        span = (n - 1) * step
+        
+        # the ring duplicates the border nodes
+        k = np.concatenate(([0], np.arange(n), [n - 1])) * step
+        ix = np.minimum(tx * span + k, self.nodes_x - 1)
+        iy = np.minimum(ty * span + k, self.nodes_y - 1)
+        
+        z = np.array(self.heights[np.ix_(iy, ix)], dtype=np.float32)
+        
+        # The edges of neighbours of any level interpolate heights of the
+        # nodes along the shared edge, at full resolution for a finer
+        # neighbour. The height range of the parent tile, computed at full
+        # resolution, also covers coarse samples beyond the ends of the edge.
+        parent = min(level + 1, self.levels - 1)
+        z_min, z_max = self.z_ranges[parent][ty >> (parent - level), tx >> (parent - level)]
+        depth = z_max - z_min
+        
+        # no skirts at the border of the grid
+        if tx > 0:
+            z[:, 0] -= depth
+        if tx * span + span < self.nodes_x - 1:
+            z[:, -1] -= depth
+        if ty > 0:
+            z[0, :] -= depth
+        if ty * span + span < self.nodes_y - 1:
+            z[-1, :] -= depth
+            
+        positions = np.zeros((n + 2) * (n + 2), [("position", np.float32, 3)])
+        positions["position"][:, 0] = np.tile(ix, n + 2) * self.spacing
+        positions["position"][:, 1] = np.repeat(iy, n + 2) * self.spacing
+        
+        return positions, z.ravel()
+    
+    
+    def tile_load(self, key):
+        positions, z = self.tile_data(key)
+        
+        tile = Tile()
+        tile.vao = glGenVertexArrays(1)
+        tile.vbo_position = glGenBuffers(1)
+        tile.vbo_z = glGenBuffers(1)
+        
+        glBindVertexArray(tile.vao)
+        
+        loc_pos = self.locations["attributes"]["position"]
+        glBindBuffer(GL_ARRAY_BUFFER, tile.vbo_position)
+        glBufferData(GL_ARRAY_BUFFER, positions.nbytes, positions, GL_STATIC_DRAW)
+        glEnableVertexAttribArray(loc_pos)
+        glVertexAttribPointer(loc_pos, 3, GL_FLOAT, GL_FALSE, positions.strides[0], ctypes.c_void_p(0))
+        
+        loc_z = self.locations["attributes"]["z"]
+        glBindBuffer(GL_ARRAY_BUFFER, tile.vbo_z)
+        glBufferData(GL_ARRAY_BUFFER, z.nbytes, z, GL_STATIC_DRAW)
+        glEnableVertexAttribArray(loc_z)
+        glVertexAttribPointer(loc_z, 1, GL_FLOAT, GL_FALSE, 4, ctypes.c_void_p(0))
+        
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.vbo_element_array)
+        
+        glBindVertexArray(0)
+        
+        self.tiles[key] = tile
+        self.frame_stats["tiles_loaded"] += 1
+        return tile
+    
+    
+    def tile_unload(self, key):
+        tile = self.tiles.pop(key)
+        glDeleteBuffers(1, [tile.vbo_position])
+        glDeleteBuffers(1, [tile.vbo_z])
+        glDeleteVertexArrays(1, [tile.vao])
+        
+        
+    def select_tiles(self, mat_m):
+        """
+        Traverses the quadtree and returns the keys of the tiles to draw
+        in this frame. Missing tiles are loaded within the budget of
+        `loads_per_frame`.
+        
+        @param mat_m
+        The Model matrix of this item as row-major list.
+        """
+        mat_p = np.array(self.program.uniform_value("mat_p")).reshape(4, 4)
+        mat_v = np.array(self.program.uniform_value("mat_v")).reshape(4, 4)
+        mat_m = np.array(mat_m).reshape(4, 4)
+        
+        # work in local coordinates: frustum and camera are transformed
+        # instead of every tile box
+        frustum = Frustum((mat_p.dot(mat_v).dot(mat_m)).ravel().tolist())
+        cam = np.linalg.inv(mat_v.dot(mat_m)).dot([0, 0, 0, 1])
+        cam = (cam[0:3] / cam[3]).tolist()
+        
+        # pixels per local unit at distance 1
+        viewport_height = glGetIntegerv(GL_VIEWPORT)[3]
+        pixels_per_unit = mat_p[1, 1] * viewport_height / 2
+        perspective = mat_p[3, 2] != 0
+        
+        selected = []
+        budget = [self.loads_per_frame]
+        
+        def error_pixels(key, box):
+            error = self.tile_error(key)
+            if not perspective:
+                return error * pixels_per_unit
+            # distance from the camera to the closest point of the box
+            distance = math.sqrt(sum(
+                (max(box[i], min(cam[i], box[i + 3])) - cam[i]) ** 2
+                for i in range(3)))
+            return error * pixels_per_unit / max(distance, 1e-6)
+        
+        def available(key):
+            if key in self.tiles:
+                return True
+            if budget[0] == 0:
+                return False
+            budget[0] -= 1
+            self.tile_load(key)
+            return True
+        
+        def visit(key, box, inside):
+            if key[0] == 0 or error_pixels(key, box) <= self.max_error:
+                selected.append(key)
+                return
+            
+            children = []
+            for child in self.tile_children(key):
+                child_box = self.tile_box(child)
+                # children of a box completely inside are inside, too
+                child_inside = 1 if inside == 1 else frustum.classify_box(child_box)
+                if child_inside >= 0:
+                    children.append((child, child_box, child_inside))
+                
+            # each child must be tried, so that loading progresses everywhere
+            if all([available(child) for child, _, _ in children]):
+                for child, child_box, child_inside in children:
+                    visit(child, child_box, child_inside)
+            else:
+                selected.append(key)
+                
+        root = (self.levels - 1, 0, 0)
+        root_box = self.tile_box(root)
+        root_inside = frustum.classify_box(root_box)
+        if root_inside >= 0:
+            if not root in self.tiles:
+                self.tile_load(root)
+            visit(root, root_box, root_inside)
+            
+        return selected
+    
+    
+    def set_colormap(self, name):
+        """
+        See `HeightMap.set_colormap()`.
+        """
+        if not name in Colormaps.palettes:
+            raise KeyError("Unknown colormap {}".format(name))
+        self.colormap = name
+        self.dirty = True
+        
+        
+    def setup_vao(self, locations):
+        if not "z" in locations["attributes"]:
+            raise SystemError("TiledHeightMap requires a program with attribute z")
+        self.locations = locations
+        
+        # use the index buffer shared with HeightMaps of the tile size
+        self.vbo_element_array = HeightMap.index_buffer(self.tile_nodes + 2, self.tile_nodes + 2)
+        
+        
+    def upload(self):
+        """
+        Nothing to upload, tiles are loaded while drawing.
+        """
+        pass
+    
+    
+    def upload_steps(self, slice_bytes=None):
+        return iter(())
+    
+    
+    def upload_size(self):
+        return 0
+    
+    
+    def remove(self):
+        for key in list(self.tiles.keys()):
+            self.tile_unload(key)
+        super(TiledHeightMap, self).remove()
+        
+        
+    def segment_index(self):
+        return None # there are no vertices on the CPU
+    
+    
+    def kdtree(self):
+        return None
+    
+    
+    def pick(self, origin, direction, tan_tolerance, mat_v_inverted=None):
+        return None
+    
+    
+    def draw(self, mat_v_inverted, state=None):
+        if state == None:
+            state = GlState()
+        self.realize(state)
+            
+        mat_m = self.model_matrix_list(mat_v_inverted)
+        
+        self.frame_stats["tiles_loaded"] = 0
+        selected = self.select_tiles(mat_m)
+        if self.frame_stats["tiles_loaded"] > 0:
+            state.invalidate() # loading made raw OpenGL calls
+            
+        self.program.set_uniform("mat_m", mat_m)
+        for key, val in self.uniforms.items():
+            self.program.set_uniform(key, val)
+        Colormaps.bind(self.program, self.colormap, state)
+            
+        if self.filled:
+            state.polygon_mode(GL_FILL)
+        else:
+            state.polygon_mode(GL_LINE)
+        state.line_width(self.linewidth)
+        
+        count = self.vdata_indices.size
+        index_type = Item.index_types[self.vdata_indices.itemsize]
+        for key in selected:
+            self.tiles.move_to_end(key)
+            state.bind_vertex_array(self.tiles[key].vao)
+            glDrawElements(GL_TRIANGLE_STRIP, count, index_type, ctypes.c_void_p(0))
+            
+        # evict least recently drawn tiles, but never those just drawn
+        while len(self.tiles) > max(self.tiles_max, len(selected)):
+            self.tile_unload(next(iter(self.tiles)))
+            
+        self.frame_stats["tiles_drawn"] = len(selected)
+        self.dirty = False
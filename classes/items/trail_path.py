@@ -0,0 +1,234 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import time
+import numpy as np
+import OpenGL
+from OpenGL.GL import *
+
+from .item import Item
+from ..segment_index import SegmentIndex
+from ..vertex_format import VertexFormat
+from ..gl_state import GlState
+
+class TrailPath(Item):
+    """
+    Draws the last `capacity` positions appended, e.g. machine positions
+    reported while a job is running, as a line strip.
+    
+    Positions are kept in a circular buffer of fixed size. Appending is
+    O(1), and only the vertices appended since the last frame are
+    uploaded during the next `draw()`. Memory and cost per frame are
+    therefore constant, however long the trail has been running. After
+    wrapping around, the strip is drawn with 2 glDrawArrays() calls.
+    
+    With a program having the attribute "time", like the "trail" shader,
+    vertices fade out with their age. Since the trail changes all the
+    time, it is never culled.
+    """
+    
+    # vertex format for programs with the attribute "time"
+    time_format = VertexFormat([
+        ("position", np.float32, 3),
+        ("color", np.uint8, 4, True),
+        ("time", np.float32, 1), # seconds since creation of the item
+        ])
+    
+    def __init__(self, label, prog_id, capacity=10000, color=(1,1,1,1), fade_time=0, linewidth=1, origin=(0,0,0), scale=1):
+        """
+        @param label
+        A string containing a unique name for this item.
+            
+        @param prog_id
+        OpenGL program ID (determines shaders to use) to use for this item.
+        
+        @param capacity
+        Number of positions kept.
+        
+        @param color
+        Default color of appended positions.
+        
+        @param fade_time
+        Seconds after which a vertex has faded out completely. 0 for no
+        fading. Requires a program with the attribute "time".
+        
+        @param linewidth
+        Width of rendered lines in pixels.
+        
+        @param origin
+        Origin of this item in world space.
+        
+        @param scale
+        Scale of this item in world space.
+        """
+        self.timed = "time" in prog_id.locations["attributes"]
+        vertex_format = TrailPath.time_format if self.timed else VertexFormat.compact
+        
+        # one more slot repeating slot 0, see draw_primitives()
+        super(TrailPath, self).__init__(label, prog_id, GL_LINE_STRIP, linewidth, origin, scale, False, capacity + 1, vertex_format)
+        
+        self.capacity = capacity
+        self.color = self.vertex_format.encode("color", color)
+        self.appended = 0 # total number of positions appended
+        self._uploaded = 0 # value of self.appended at the last upload
+        self._time_start = time.time()
+        
+        if self.timed:
+            self.set_fade_time(fade_time)
+        elif fade_time > 0:
+            raise ValueError("Item '{}': fading requires a program with attribute time".format(self.label))
+        
+        
+    def set_fade_time(self, seconds):
+        """
+        Sets the seconds after which a vertex has faded out completely,
+        0 for no fading.
+        """
+        self.uniforms["fade_time"] = [seconds]
+        self.request_update()
+        
+        
+    def append(self, position, color=None):
+        """
+        Appends a position, replacing the oldest one when the trail is
+        full. The GPU data are updated during the next `draw()`.
+        
+        @param position
+        3-tuple in local coordinates
+        
+        @param color
+        4-tuple, or None for the default color of the trail.
+        """
+        slot = self.appended % self.capacity
+        self._set_slot(slot, position, color)
+        if slot == 0:
+            self._set_slot(self.capacity, position, color)
+        
+        self.appended += 1
+        self.vertexcount = min(self.appended, self.capacity)
+        self._segment_index = None
+        self._kdtree = None
+        self.request_update()
+        
+        
+    def clear(self):
+        """
+        Removes all positions.
+        """
+        self.appended = 0
+        self._uploaded = 0
+        self.vertexcount = 0
+        self._segment_index = None
+        self._kdtree = None
+        self.request_update()
+        
+        
+    def _set_slot(self, slot, position, color):
+        data = self.vdata_pos_col
+        data["position"][slot] = position
+        data["color"][slot] = self.color if color is None else self.vertex_format.encode("color", color)
+        if self.timed:
+            data["time"][slot] = time.time() - self._time_start
+            
+            
+    def vertex_order(self):
+        """
+        Returns the numbers of the vertices from oldest to newest.
+        """
+        head = self.appended % self.capacity
+        if self.appended <= self.capacity or head == 0:
+            return np.arange(self.vertexcount)
+        return np.concatenate((np.arange(head, self.capacity + 1), np.arange(1, head)))
+    
+    
+    def calculate_bounds(self):
+        """
+        Never culled, see class documentation.
+        """
+        self.bbox_local = None
+        self.bsphere_local = None
+        self._bounds_world = None
+        self._bounds_changed()
+        
+        
+    def segment_index(self):
+        if self._segment_index is None:
+            positions = self.vertex_format.decode("position", self.vdata_pos_col["position"])
+            self._segment_index = SegmentIndex(positions, self.primitive_type, self.vertex_order())
+        return self._segment_index
+    
+    
+    def upload_steps(self, slice_bytes=None):
+        # the whole buffer includes the positions appended until now
+        appended = self.appended
+        for uploaded in super(TrailPath, self).upload_steps(slice_bytes):
+            yield uploaded
+        self._uploaded = appended
+        
+        
+    def draw(self, mat_v_inverted, state=None):
+        if state == None:
+            state = GlState()
+        self.realize(state)
+            
+        # upload the positions appended since the last frame, at most 2
+        # ranges when wrapping around
+        appended = self.appended
+        pending = min(appended - self._uploaded, self.capacity)
+        if pending > 0:
+            start = (appended - pending) % self.capacity
+            first = min(pending, self.capacity - start)
+            self.upload_vertices(start, first, None, state)
+            if pending > first:
+                self.upload_vertices(0, pending - first, None, state)
+            if start == 0 or start + pending > self.capacity:
+                self.upload_vertices(self.capacity, 1, None, state) # slot 0 was written
+            self._uploaded = appended
+            
+        if appended == 0:
+            return
+        
+        if self.timed:
+            now = time.time() - self._time_start
+            self.uniforms["time_now"] = [now]
+            
+            # keep drawing frames until the newest position has faded out
+            fade_time = self.uniforms["fade_time"][0]
+            newest = self.vdata_pos_col["time"][(appended - 1) % self.capacity]
+            if fade_time > 0 and now - newest < fade_time:
+                self.request_update()
+            
+        super(TrailPath, self).draw(mat_v_inverted, state)
+        
+        
+    def draw_primitives(self, state):
+        # positions appended meanwhile are drawn in the next frame
+        appended = self._uploaded
+        head = appended % self.capacity
+        if appended <= self.capacity or head == 0:
+            glDrawArrays(self.primitive_type, 0, min(appended, self.capacity))
+            return
+        
+        # oldest positions up to the end of the buffer, continued by slot
+        # self.capacity which repeats slot 0, then the newest positions
+        glDrawArrays(self.primitive_type, head, self.capacity + 1 - head)
+        glDrawArrays(self.primitive_type, 0, head)
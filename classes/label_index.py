@@ -0,0 +1,169 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import re
+import bisect
+
+class LabelIndex():
+    """
+    This class maps item labels to items for the whole PainterWidget.
+    
+    Labels are kept in a dict for O(1) lookup, and additionally in a
+    sorted list, so that all labels starting with a prefix form one
+    contiguous range that is found by binary search. Hierarchical labels
+    like "job42/contour/3" can thus be addressed as a group ("job42")
+    in O(log n + k) for k matching labels.
+    """
+    
+    # characters which make a string a regular expression rather than a literal
+    _regexp_chars = set(".^$*+?{}[]\\|()")
+    
+    def __init__(self):
+        self.items = {} # label -> item
+        self.labels = [] # sorted
+        
+        
+    def __len__(self):
+        return len(self.items)
+    
+    
+    def __contains__(self, label):
+        return label in self.items
+    
+    
+    def get(self, label):
+        """
+        Returns the item with `label`, or None.
+        """
+        return self.items.get(label)
+    
+    
+    def add(self, label, item):
+        """
+        Add an item. An existing item with the same label is replaced.
+        """
+        if not label in self.items:
+            bisect.insort(self.labels, label)
+        self.items[label] = item
+        
+        
+    def pop(self, label):
+        """
+        Remove and return the item with `label`, or None.
+        """
+        item = self.items.pop(label, None)
+        if item != None:
+            i = bisect.bisect_left(self.labels, label)
+            del self.labels[i]
+        return item
+    
+    
+    def prefix_range(self, prefix):
+        """
+        Returns the slice bounds (lo, hi) of all labels in self.labels
+        starting with `prefix`.
+        """
+        lo = bisect.bisect_left(self.labels, prefix)
+        if prefix == "":
+            hi = len(self.labels)
+        else:
+            # the smallest string greater than all strings starting with prefix
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            hi = bisect.bisect_left(self.labels, upper, lo)
+        return lo, hi
+    
+    
+    def with_prefix(self, prefix):
+        """
+        Returns a list of all labels starting with `prefix`, sorted.
+        """
+        lo, hi = self.prefix_range(prefix)
+        return self.labels[lo:hi]
+    
+    
+    def in_group(self, group):
+        """
+        Returns a list of all labels in a group, sorted. The group "a/b"
+        contains the label "a/b" itself and all labels starting with "a/b/".
+        """
+        labels = self.with_prefix(group + "/")
+        if group in self.items:
+            labels.insert(0, group)
+        return labels
+    
+    
+    def pop_prefix(self, prefix):
+        """
+        Remove all items whose labels start with `prefix`. Returns a
+        list of tuples (label, item).
+        """
+        lo, hi = self.prefix_range(prefix)
+        labels = self.labels[lo:hi]
+        del self.labels[lo:hi]
+        return [(label, self.items.pop(label)) for label in labels]
+    
+    
+    def pop_group(self, group):
+        """
+        Remove all items of a group, see in_group(). Returns a list of
+        tuples (label, item).
+        """
+        removed = self.pop_prefix(group + "/")
+        item = self.pop(group)
+        if item != None:
+            removed.insert(0, (group, item))
+        return removed
+    
+    
+    def pop_matching(self, label_regexp):
+        """
+        Remove all items matched by `label_regexp`, which is one of
+          * a group followed by "/*", see pop_group()
+          * a regular expression, see match()
+        Returns a list of tuples (label, item).
+        """
+        if label_regexp.endswith("/*") and LabelIndex.is_literal(label_regexp[:-2]):
+            return self.pop_group(label_regexp[:-2])
+        if LabelIndex.is_literal(label_regexp):
+            return self.pop_prefix(label_regexp)
+        return [(label, self.pop(label)) for label in self.match(label_regexp)]
+    
+    
+    def match(self, label_regexp):
+        """
+        Returns a list of all labels matched by `re.match(label_regexp, label)`.
+        
+        Since re.match only matches at the beginning of a label, a regexp
+        without special characters is a literal prefix, and is answered
+        through the sorted index. All others have to be tested against
+        every label.
+        """
+        if LabelIndex.is_literal(label_regexp):
+            return self.with_prefix(label_regexp)
+        
+        regexp = re.compile(label_regexp)
+        return [label for label in self.labels if regexp.match(label)]
+    
+    
+    @staticmethod
+    def is_literal(label_regexp):
+        return not any(c in LabelIndex._regexp_chars for c in label_regexp)
@@ -28,6 +28,10 @@ import sys
 import math
 import os
 import re
+import time
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, CancelledError
+from multiprocessing import resource_tracker
 
 from PyQt5.QtGui import QColor, QMatrix4x4, QVector2D, QVector3D, QVector4D, QQuaternion
 from PyQt5.QtOpenGL import QGLWidget
@@ -39,6 +43,13 @@ OpenGL.FULL_LOGGING = False
 from OpenGL.GL import *
 
 from .program import Program
+from .gl_state import GlState
+from .render_queue import RenderQueue
+from .frustum import Frustum
+from .bvh import BVH
+from .label_index import LabelIndex
+from .shared_vertices import SharedVertices, build_shared
+from .command_queue import CommandQueue
 
 
 class PainterWidget(QGLWidget):
@@ -97,6 +108,7 @@ class PainterWidget(QGLWidget):
     Middle Button drag left/right/up/down: Move camera left/right/up/down
     Wheel rotate up/down: Move camera ahead/back
     Right Button drag up/down: Move camera ahead/back (same as wheel)
+    Left Button click: Pick the item under the cursor, see pick()
     
     The FOV (Field of View) is held constant. "Zooming" is rather moving
     the camera ahead, which is more natural than changing the FOV of the 
@@ -110,6 +122,14 @@ class PainterWidget(QGLWidget):
     
     __version__ = "0.2.0"
     
+    # Emitted with the result of pick() when the user clicks (presses
+    # and releases the left mouse button without dragging) onto an item.
+    picked = pyqtSignal(object)
+    
+    # Emitted with the result of measure() when the user has clicked
+    # two points while self.measuring is True.
+    measured = pyqtSignal(object)
+    
     def __init__(self, parent, refresh_rate = 20):
         super(PainterWidget, self).__init__(parent)
         
@@ -118,6 +138,8 @@ class PainterWidget(QGLWidget):
         
         self.mat_p = QMatrix4x4() # the current Projection matrix
         
+        self.frustum = None # the current view frustum, see paintGL()
+        
         self.cam_right = QVector3D() # the current camera right direction
         self.cam_up = QVector3D() # the current camera up direction
         self.cam_look = QVector3D() # the current camera look direction
@@ -139,6 +161,28 @@ class PainterWidget(QGLWidget):
 
         # contains OpenGL "programs" of different shaders
         self.programs = {}
+        
+        # all items of all programs by label
+        self.item_index = LabelIndex()
+        
+        # bounding volume hierarchy over all items drawn into the 3D world
+        self.bvh = BVH()
+        
+        # shadow copy of the OpenGL state, and the per-frame draw list
+        self.gl_state = GlState()
+        self.render_queue = RenderQueue()
+        
+        # Scene mutations queued by other threads, applied at the
+        # beginning of each frame. Queueing a command requests a frame.
+        self.commands = CommandQueue(self._update_requested)
+        
+        # some numbers describing the last drawn frame
+        self.frame_stats = {
+            "items_drawn": 0,
+            "items_culled": 0,
+            "state_changes_skipped": 0,
+            "commands_applied": 0,
+            }
                 
         # Setup inital world Rotation states
         self._rotation_quat = QQuaternion() # to rotate the View matrix
@@ -151,7 +195,28 @@ class PainterWidget(QGLWidget):
 
         self._mouse_fov_start = None # state for mouse click
         
+        self._mouse_click_start = None # state for picking by mouse click
+        
+        # When True, picked positions snap to the closest vertex.
+        self.snap_to_vertex = False
+        
+        # When True, each click adds a point to self.measure_points.
+        # After two points, the `measured` signal is emitted.
+        self.measuring = False
+        self.measure_points = []
+        
         self._refresh_rate = refresh_rate
+        
+        # Items created by item_create_async() are built by worker threads
+        # and uploaded in slices of self.upload_slice_bytes at the
+        # beginning of each frame, for at most self.upload_budget seconds.
+        self.upload_budget = 0.004
+        self.upload_slice_bytes = 1 << 20
+        self._build_executor = None
+        self._process_executor = None # see item_create_shared()
+        self._builds = LabelIndex() # futures of pending items by label
+        self._built = collections.deque() # filled by the worker threads
+        self._uploads = collections.deque() # items being uploaded
     
 
     def initializeGL(self):
@@ -211,12 +276,17 @@ class PainterWidget(QGLWidget):
     def item_create(self, class_name, item_label, program_label, *args):
         """ Creates an item and returns the object for further manipulation.
         
+        If an item with the same label already exists, it is returned
+        instead, and nothing is created.
+        
         @param class_name
         A string of the class name that should be instantiated and drawn.
         e.g. "Star", "CoordSystem" etc. See item.py for available classes.
         
         @param item_label
-        A string containing the unique label for this item.
+        A string containing the unique label for this item. Labels can
+        be hierarchical, separated by "/", e.g. "job42/contour/3". This
+        allows to remove all items of a group at once, see item_remove().
         
         @param program_label
         A string containing the label of a previously created program.
@@ -226,30 +296,243 @@ class PainterWidget(QGLWidget):
         Arguments to pass to the initialization method of the given
         `class_name`. See item.py for the required arguments.
         """
+        item = self.item_index.get(item_label)
+        if item != None:
+            return item
+        
+        # supersedes an item of the same label still being created
+        self._builds_cancel(self._builds.pop(item_label))
+        
         prog = self.programs[program_label]
         item = prog.item_create(class_name, item_label, *args)
-       
+        self._item_register(item_label, prog, item)
         return item
     
     
+    def item_create_async(self, class_name, item_label, program_label, *args, progress=None):
+        """
+        Like item_create(), but the item is built by a worker thread, and
+        its vertex data is uploaded in slices during the following frames,
+        so that creating large items doesn't freeze the window. The item
+        appears in the scene once it is completely uploaded.
+        
+        Returns a concurrent.futures.Future, whose result is the item. If
+        the item already exists or is already being created, a Future for
+        that item is returned.
+        
+        @param progress
+        An optional function called in the GUI thread with the number of
+        uploaded bytes and the total number of bytes after each slice.
+        """
+        item = self.item_index.get(item_label)
+        if item != None:
+            future = Future()
+            future.set_result(item)
+            return future
+        
+        if item_label in self._builds:
+            return self._builds.get(item_label)
+        
+        prog = self.programs[program_label]
+        
+        if self._build_executor == None:
+            self._build_executor = ThreadPoolExecutor()
+            
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self._builds.add(item_label, future)
+        
+        build = self._build_executor.submit(prog.item_build, class_name, item_label, *args)
+        build.add_done_callback(lambda build: self._built.append((item_label, future, prog, build, progress, True)))
+        self.dirty = True
+        return future
+    
+    
+    def item_create_shared(self, class_name, item_label, program_label, builder, *args, item_args=(), keep_vertices=True, progress=None):
+        """
+        Like item_create_async(), but the vertices are built by a worker
+        process, into shared memory, see build_shared(). The item adopts
+        them without copying, see Item.adopt_vertices(). Use this for
+        very large items, whose vertex data would otherwise be pickled
+        between the processes, holding them twice in memory.
+        
+        @param builder
+        A picklable function `builder(allocate, *args)` returning the
+        number of vertices built, see build_shared(). It must allocate
+        vertices of the dtype of the vertex format of the item.
+        
+        @param item_args
+        Arguments to pass to the initialization method of `class_name`,
+        after label and program.
+        
+        @param keep_vertices
+        If False, the shared memory is released once the vertices are
+        uploaded, see Item.release_vertices(). Otherwise the item keeps
+        it as its CPU data storage.
+        
+        @param progress
+        See item_create_async()
+        """
+        item = self.item_index.get(item_label)
+        if item != None:
+            future = Future()
+            future.set_result(item)
+            return future
+        
+        if item_label in self._builds:
+            return self._builds.get(item_label)
+        
+        prog = self.programs[program_label]
+        
+        if self._process_executor == None:
+            # Workers must share the resource tracker of this process,
+            # otherwise it unlinks their segments when they exit.
+            resource_tracker.ensure_running()
+            self._process_executor = ProcessPoolExecutor()
+            
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self._builds.add(item_label, future)
+        
+        def adopt(build):
+            adopted = Future()
+            try:
+                handle, vertexcount = build.result()
+                shared = SharedVertices.attach(handle)
+                shared.unlink() # freed when this process closes it
+                item = prog.item_build(class_name, item_label, *item_args)
+                item.adopt_vertices(shared.array, vertexcount, shared)
+                adopted.set_result(item)
+            except Exception as e:
+                adopted.set_exception(e)
+            self._built.append((item_label, future, prog, adopted, progress, keep_vertices))
+        
+        build = self._process_executor.submit(build_shared, builder, *args)
+        build.add_done_callback(adopt)
+        self.dirty = True
+        return future
+    
+    
+    def _item_register(self, item_label, prog, item):
+        if item_label in self.item_index:
+            raise ValueError("Item '{}': label already exists.".format(item_label))
+        
+        prog.items[item_label] = item
+        self.item_index.add(item_label, item)
+        item.notify = self._update_requested
+        
+        # Items of programs drawing into the 3D world are kept in the BVH.
+        # The item keeps its BVH leaf up to date when it moves.
+        if "mat_p" in prog.locations["uniforms"] and item.bvh == None:
+            item.bvh = self.bvh
+            self.bvh.update(item)
+            
+            
+    def _upload_pending(self):
+        """
+        Uploads items built by item_create_async() until
+        self.upload_budget seconds have passed. Called from paintGL().
+        """
+        deadline = time.perf_counter() + self.upload_budget
+        
+        while self._built:
+            item_label, future, prog, build, progress, keep_vertices = self._built.popleft()
+            if build.exception() != None:
+                if self._builds.get(item_label) is future:
+                    self._builds.pop(item_label).set_exception(build.exception())
+                continue
+            item = build.result()
+            if not self._builds.get(item_label) is future:
+                # cancelled by item_create() or item_remove()
+                item.release_vertices()
+                continue
+            steps = item.realize_steps(self.upload_slice_bytes)
+            self._uploads.append([item_label, future, prog, item, steps, item.upload_size(), 0, progress, keep_vertices])
+            
+        while self._uploads and time.perf_counter() < deadline:
+            upload = self._uploads[0]
+            item_label, future, prog, item, steps, total, uploaded, progress, keep_vertices = upload
+            if not self._builds.get(item_label) is future:
+                self._uploads.popleft()
+                item.remove()
+                item.release_vertices()
+                continue
+            try:
+                upload[6] += next(steps)
+                if progress != None:
+                    progress(upload[6], total)
+            except StopIteration:
+                self._uploads.popleft()
+                if not keep_vertices:
+                    item.release_vertices()
+                self._item_register(item_label, prog, item)
+                self._builds.pop(item_label).set_result(item)
+            except Exception as e:
+                self._uploads.popleft()
+                item.remove()
+                self._builds.pop(item_label).set_exception(e)
+                
+        if self._builds or self._uploads:
+            # keep drawing frames until all items are uploaded
+            self.dirty = True
+            
+            
+    def _builds_cancel(self, *futures):
+        """
+        Cancels items being created by item_create_async() or
+        item_create_shared(). Their futures raise CancelledError, and
+        _upload_pending() discards them once they are built.
+        """
+        for future in futures:
+            if future != None:
+                future.set_exception(CancelledError())
+    
+    
+    def item_get(self, item_label):
+        """
+        Returns the item with the given label, or None.
+        """
+        return self.item_index.get(item_label)
+    
+    
+    def items_in_group(self, group):
+        """
+        Returns a list of all items in a group, sorted by label. The group
+        "job42" contains the item "job42" and all items whose labels start
+        with "job42/".
+        """
+        return [self.item_index.get(label) for label in self.item_index.in_group(group)]
+    
+    
     def item_remove(self, label_regexp):
-        """ Removes a previously created item. It will disappear from the
+        """ Removes previously created items. They will disappear from the
         scene.
         
         @param label_regexp
-        A regular expression to match.
+        One of
+          * a group followed by "/*", e.g. "job42/*": removes the item
+            "job42" and all items whose labels start with "job42/"
+          * a regular expression to match with re.match(), i.e. matching
+            at the beginning of labels. An expression without special
+            characters (e.g. a plain label) is a prefix and is looked
+            up in the sorted label index, all others are tested against
+            every label.
+            
+        Items of matching labels which are still being created by
+        item_create_async() or item_create_shared() are cancelled.
         """
-        program_labels = list(self.programs.keys())
-        
-        for program_label in program_labels:
-            item_labels = list(self.programs[program_label].items.keys())
-            for item_label in item_labels:
-                if re.match(label_regexp, item_label):
-                    item = self.programs[program_label].items[item_label]
-                    item.remove()
-                    del self.programs[program_label].items[item_label]
+        cancelled = self._builds.pop_matching(label_regexp)
+        self._builds_cancel(*[future for label, future in cancelled])
         
-
+        removed = self.item_index.pop_matching(label_regexp)
+        for label, item in removed:
+            self.bvh.remove(item)
+            item.bvh = None
+            item.notify = None
+            del item.program.items[label]
+            item.remove()
+            
+            
     def paintGL(self):
         """ This function is automatially called by the Qt libraries
         whenever updateGL() has been called. This happens for example
@@ -269,11 +552,22 @@ class PainterWidget(QGLWidget):
         3. For each object in the scene:
            a. Binding the data buffers of the object
            b. Drawing of the object
+        
+        Objects are drawn sorted by program and render state, see
+        RenderQueue.
         """
         print("paintGL called")
         
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         
+        # Programs created before the OpenGL context existed are compiled
+        # now. Items create their OpenGL objects when first drawn.
+        for prog in self.programs.values():
+            prog.realize()
+            
+        self.frame_stats["commands_applied"] = self.commands.apply(self)
+        self._upload_pending()
+        
         # ======= VIEW MATRIX BEGIN ==========
         # start with an empty matrix
         self.mat_v = QMatrix4x4()
@@ -316,15 +610,41 @@ class PainterWidget(QGLWidget):
         mat_p_list = PainterWidget.qt_mat_to_list(self.mat_p) #Transform Qt object to Python list
         # ======= PROJECTION MATRIX END ==========
         
-        # loop over all programs/shaders
-        # first switch to that program (expensive operation)
-        # then draw all items belonging to that program
+        # ======= FRUSTUM BEGIN ==========
+        # Items completely outside of the view frustum are not drawn.
+        # Only programs which use the Projection matrix draw into the
+        # 3D world, all others (2D overlays) are never culled. Visible
+        # items of the 3D world are found via the BVH, without touching
+        # the invisible ones.
+        self.frustum = Frustum(PainterWidget.qt_mat_to_list(self.mat_p * self.mat_v))
+        # ======= FRUSTUM END ==========
+        
+        # Collect all visible items into the render queue. The queue sorts
+        # them by program and render state, so that each program is switched
+        # to only once (expensive operation) and redundant state changes
+        # are skipped by self.gl_state.
+        self.gl_state.invalidate()
+        self.gl_state.calls_skipped = 0
+        
         for key, prog in self.programs.items():
-            if len(list(prog.items.keys())) > 0:
-                glUseProgram(prog.id)
-                prog.set_uniform("mat_v", mat_v_list) # set view matrix
-                prog.set_uniform("mat_p", mat_p_list) # set projection matrix
-                prog.items_draw(self.mat_v_inverted)
+            if "mat_p" in prog.locations["uniforms"]:
+                continue # found via the BVH below
+            for label, item in prog.items.items():
+                self.render_queue.push(item)
+                
+        visible = self.bvh.query_frustum(self.frustum)
+        for item in visible:
+            self.render_queue.push(item)
+        self.frame_stats["items_culled"] = len(self.bvh) - len(visible)
+                
+        view_uniforms = {
+            "mat_v": mat_v_list, # set view matrix
+            "mat_p": mat_p_list, # set projection matrix
+            }
+        self.frame_stats["items_drawn"] = self.render_queue.flush(self.gl_state, self.mat_v_inverted, view_uniforms)
+        self.frame_stats["state_changes_skipped"] = self.gl_state.calls_skipped
+        
+        glBindVertexArray(0)
       
         # nothing more to do here!
         # Swapping the OpenGL buffer is done automatically by Qt. See Qt documentation.
@@ -356,6 +676,7 @@ class PainterWidget(QGLWidget):
         if btns & Qt.LeftButton:
             self._mouse_rotation_start_vec = self._find_trackball_vector(x, y)
             self._rotation_quat_start = self._rotation_quat
+            self._mouse_click_start = (x, y)
             
         elif btns & (Qt.MidButton):
             self._mouse_translation_start_vec = QVector3D(x, y, 0)
@@ -382,8 +703,166 @@ class PainterWidget(QGLWidget):
             
 
     def mouseReleaseEvent(self, event):
-        # nothing to be done here.
-        pass
+        """
+        Called by the Qt libraries whenever a mouse button is released.
+        
+        If the left button has been released without dragging, the item
+        under the cursor is picked and the `picked` signal is emitted.
+        """
+        if event.button() != Qt.LeftButton or self._mouse_click_start == None:
+            return
+        
+        x = event.localPos().x()
+        y = event.localPos().y()
+        start_x, start_y = self._mouse_click_start
+        self._mouse_click_start = None
+        
+        if abs(x - start_x) > 2 or abs(y - start_y) > 2:
+            return # was a drag
+        
+        if self.receivers(self.picked) > 0 or self.measuring:
+            hit = self.pick(x, y)
+            if hit == None:
+                return
+            
+            self.picked.emit(hit)
+            if self.measuring:
+                self.measure_add(hit["position"])
+                
+                
+    def unproject(self, px, py):
+        """
+        Returns the ray through a pixel as a tuple (origin, direction)
+        of numpy arrays in world coordinates. The origin is on the near
+        plane, the direction is normalized.
+        
+        Uses the View and Projection matrices of the last drawn frame.
+        
+        @param px
+        Horizontal pixel coordinate relative to the window
+        
+        @param py
+        Vertical pixel coordinate relative to the window
+        """
+        x = 2 * px / self.width - 1
+        y = 1 - 2 * py / self.height
+        
+        mat_pv_inverted = (self.mat_p * self.mat_v).inverted()[0]
+        near = mat_pv_inverted * QVector4D(x, y, -1, 1)
+        far = mat_pv_inverted * QVector4D(x, y, 1, 1)
+        
+        near = np.array([near[0], near[1], near[2]]) / near[3]
+        far = np.array([far[0], far[1], far[2]]) / far[3]
+        direction = far - near
+        return near, direction / np.linalg.norm(direction)
+    
+    
+    def pick(self, px, py, tolerance=5):
+        """
+        Find the item under a pixel.
+        
+        Items whose bounds are hit by the ray through the pixel are found
+        via the BVH, then the closest line segment (or triangle edge) of
+        each is found via its SegmentIndex. Only items of programs drawing
+        into the 3D world can be picked.
+        
+        Returns None if nothing is within `tolerance`, otherwise the
+        dict returned by `Item.pick()` of the closest item. For GcodePath
+        items, this contains the G-code line number.
+        
+        If self.snap_to_vertex is True, "position" and "vertex" are
+        replaced by the vertex of the picked item which is closest to
+        the picked position, and "snapped" is set to True.
+        
+        @param px
+        Horizontal pixel coordinate relative to the window
+        
+        @param py
+        Vertical pixel coordinate relative to the window
+        
+        @param tolerance
+        Maximum distance in pixels between cursor and picked segment
+        """
+        origin, direction = self.unproject(px, py)
+        
+        # the angle covered by one pixel
+        tan_tolerance = tolerance * 2 * math.tan(math.radians(self.fov) / 2) / self.height
+        
+        best = None
+        for t, item in self.bvh.query_ray(origin, direction, tan_tolerance=tan_tolerance):
+            hit = item.pick(origin, direction, tan_tolerance, self.mat_v_inverted)
+            if hit != None and (best == None or hit["tan_angle"] < best["tan_angle"]):
+                best = hit
+                
+        if best != None and self.snap_to_vertex:
+            self.snap(best)
+                
+        return best
+    
+    
+    def snap(self, hit):
+        """
+        Move the position of a pick result to the closest vertex of the
+        picked item, found via the k-d tree of the item. Billboards can
+        not be snapped to.
+        
+        @param hit
+        A dict as returned by pick(). It is modified in place.
+        """
+        item = hit["item"]
+        nearest = item.nearest_vertex(hit["position"])
+        if nearest == None:
+            return hit
+        
+        vertex, distance = nearest
+        hit["vertex"] = vertex
+        hit["position"] = tuple(item.world_positions([vertex])[0])
+        hit["snapped"] = True
+        return hit
+    
+    
+    def measure_add(self, position):
+        """
+        Add a point to the current measurement. When this is the second
+        point, the measurement is completed: the `measured` signal is
+        emitted, and the points are cleared for the next measurement.
+        
+        Returns the result of measure() when the measurement has been
+        completed, otherwise None.
+        
+        @param position
+        3-tuple in world coordinates
+        """
+        self.measure_points.append(tuple(position))
+        if len(self.measure_points) < 2:
+            return None
+        
+        result = PainterWidget.measure(*self.measure_points)
+        self.measure_points = []
+        self.measured.emit(result)
+        return result
+    
+    
+    @staticmethod
+    def measure(p1, p2):
+        """
+        Returns a dict describing the distance between two points with
+        the keys "from", "to", "delta" (3-tuple) and "distance".
+        
+        @param p1
+        3-tuple
+        
+        @param p2
+        3-tuple
+        """
+        delta = np.subtract(p2, p1)
+        return {
+            "from": tuple(p1),
+            "to": tuple(p2),
+            "delta": tuple(delta),
+            "distance": float(np.linalg.norm(delta)),
+            }
+                
 
 
     def mouseMoveEvent(self, event):
@@ -508,13 +987,22 @@ class PainterWidget(QGLWidget):
         return vec
 
 
+    def _update_requested(self):
+        """
+        called by any thread after queueing a command, and by items
+        requesting a new frame, see Item.request_update()
+        """
+        self.dirty = True
+        
+        
     def _timer_timeout(self):
         """
         called regularly from timer
         """
         if self.dirty:
-            self.updateGL()
+            # cleared before painting, paintGL() may request another frame
             self.dirty = False
+            self.updateGL()
             
 
     @staticmethod
@@ -34,12 +34,17 @@ from OpenGL.GL import *
 from .items.item import Item
 from .items.coord_system import CoordSystem
 from .items.ortho_line_grid import OrthoLineGrid
+from .items.shader_grid import ShaderGrid
 from .items.star import Star
 from .items.text import Text
 from .items.arc import Arc
 from .items.circle import Circle
 from .items.gcode_path import GcodePath
+from .items.stream_path import StreamPath
+from .items.trail_path import TrailPath
+from .items.leveled_gcode_path import LeveledGcodePath
 from .items.height_map import HeightMap
+from .items.tiled_height_map import TiledHeightMap
 
 from .shader import Shader
 
@@ -64,14 +69,51 @@ class Program():
         @param fragment_filepath
         A string containing the absolute filepath of the GLSL fragment shader
         source code.
+        
+        The shaders are compiled by `realize()`, so that programs and their
+        items can be created before an OpenGL context exists. Until then,
+        `locations` already contains the names of all uniforms and
+        attributes given in `shader_opts`, with locations None.
         """
-        self.id = glCreateProgram()
+        self.id = None
         self.label = label
-        self.shader_vertex = Shader(GL_VERTEX_SHADER, vertex_filepath)
-        self.shader_fragment = Shader(GL_FRAGMENT_SHADER, fragment_filepath)
-        
+        self.vertex_filepath = vertex_filepath
+        self.fragment_filepath = fragment_filepath
         self.shader_opts = shader_opts
         
+        self.locations = {
+            "uniforms": dict.fromkeys(shader_opts["uniforms"]),
+            "attributes": dict.fromkeys(shader_opts["attributes"])
+            }
+        
+        self.uniform_function_dispatcher = {
+            "Matrix4fv": glUniformMatrix4fv,
+            "1f": glUniform1f,
+            "1i": glUniform1i,
+            "4fv": glUniform4fv,
+            }
+        
+        self.items = {}
+        
+        # Values last set for each uniform. Uniform values are part of the
+        # program object, so this stays valid across frames.
+        self._uniform_values = {}
+        
+        
+    def realize(self):
+        """
+        Compiles and links the shaders and looks up the locations of
+        uniforms and attributes, if not done yet. Requires a current
+        OpenGL context. PainterWidget calls this at the beginning of each
+        frame.
+        """
+        if self.id != None:
+            return
+        
+        self.id = glCreateProgram()
+        self.shader_vertex = Shader(GL_VERTEX_SHADER, self.vertex_filepath)
+        self.shader_fragment = Shader(GL_FRAGMENT_SHADER, self.fragment_filepath)
+        
         glAttachShader(self.id, self.shader_vertex.id)
         glAttachShader(self.id, self.shader_fragment.id)
         
@@ -87,42 +129,58 @@ class Program():
         glDetachShader(self.id, self.shader_vertex.id)
         glDetachShader(self.id, self.shader_fragment.id)
         
-        self.locations = {
-            "uniforms": {},
-            "attributes": {}
-            }
-        
-        self.uniform_function_dispatcher = {
-            "Matrix4fv": glUniformMatrix4fv,
-            "1f": glUniform1f,
-            }
-        
-        for varname, tpe in shader_opts["uniforms"].items():
+        for varname, tpe in self.shader_opts["uniforms"].items():
             self.locations["uniforms"][varname] = glGetUniformLocation(self.id, varname)
             
-        for varname, tpe in shader_opts["attributes"].items():
+        for varname, tpe in self.shader_opts["attributes"].items():
             self.locations["attributes"][varname] = glGetAttribLocation(self.id, varname)
         
-        self.items = {}
-        
         
     def item_create(self, class_name, item_label, *args):
         if not item_label in self.items:
             # create
-            klss = self.str_to_class(class_name)
-            item = klss(item_label, self, *args)
+            item = self.item_build(class_name, item_label, *args)
             self.items[item_label] = item
-            
-            item.setup_vao(self.locations)
-            item.upload()
         else:
             item = self.items[item_label]
             
         return item
+    
+    
+    def item_build(self, class_name, item_label, *args):
+        """
+        Constructs an item of this program without adding it to
+        self.items. Items make no OpenGL calls before they are realized,
+        so this can be called from a worker thread.
+        """
+        klss = self.str_to_class(class_name)
+        item = klss(item_label, self, *args)
+        
+        # only calculates the bounds, OpenGL objects are created and
+        # uploaded during the first draw, see Item.realize()
+        item.upload()
+        return item
         
         
     def set_uniform(self, key, val):
+        """
+        Set a uniform of this program. Assumes that glUseProgram() has
+        been called.
+        
+        The call is skipped when the uniform already has the given value,
+        which is the common case for View and Projection matrices, and
+        for the Model matrices of items that don't move.
+        
+        @param val
+        A scalar, list, tuple or numpy array. It is flattened into a
+        list of values.
+        """
         if key in self.locations["uniforms"]:
+            val = np.ravel(val).tolist()
+            if self._uniform_values.get(key) == val:
+                return
+            self._uniform_values[key] = val
+            
             function_string = self.shader_opts["uniforms"][key]
             location = self.locations["uniforms"][key]
             function = self.uniform_function_dispatcher[function_string]
@@ -133,9 +191,10 @@ class Program():
                 transpose = GL_TRUE
                 function(location, count, transpose, val)
             elif "v" in function_string:
+                # arrays of vectors, e.g. "4fv" with 4 floats per element
+                count = len(val) // int(function_string[0])
                 function(location, count, val)
             else:
-                print("set_uniform", key, val)
                 function(location, *val)
                 
             
@@ -143,9 +202,18 @@ class Program():
           print("Warning: set_uniform(): Uniform {} is not used in the shader.".format(key))
 
 
-    def items_draw(self, mat_v_inverted):
+    def uniform_value(self, key):
+        """
+        Returns the value last set for uniform `key` as a list, or None
+        if it has not been set yet. Items can use this to read the
+        View and Projection matrices during drawing.
+        """
+        return self._uniform_values.get(key)
+
+
+    def items_draw(self, mat_v_inverted, state=None):
         for label, item in self.items.items():
-            item.draw(mat_v_inverted)
+            item.draw(mat_v_inverted, state)
 
 
     @staticmethod
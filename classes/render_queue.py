@@ -0,0 +1,84 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+class RenderQueue():
+    """
+    This class collects the items to be drawn during one frame, and
+    draws them sorted by render state.
+    
+    Draw packets are sorted by program, polygon mode, line width and
+    primitive type, in this order. Together with `GlState`, which skips
+    redundant OpenGL calls, this keeps the number of actual state
+    changes per frame close to the number of distinct render states,
+    rather than the number of items.
+    
+    Items with identical render state are drawn in the order in which
+    they have been created, which matters for blending.
+    """
+    
+    def __init__(self):
+        self.packets = []
+        
+        
+    def push(self, item):
+        """
+        Schedule an item to be drawn during the next `flush()`.
+        """
+        self.packets.append(item)
+        
+        
+    def flush(self, state, mat_v_inverted, view_uniforms):
+        """
+        Sort and draw all pushed items, then empty the queue.
+        
+        @param state
+        An instance of GlState.
+        
+        @param mat_v_inverted
+        The inverted View matrix, passed on to `Item.draw()`.
+        
+        @param view_uniforms
+        A dict of uniform values common to all programs, e.g. the View
+        and Projection matrices. They are set once whenever the program
+        is switched, but only for programs whose shaders use them.
+        
+        Returns the number of drawn items.
+        """
+        packets = self.packets
+        packets.sort(key=RenderQueue.sort_key)
+        
+        for item in packets:
+            prog = item.program
+            if state.use_program(prog.id):
+                for key, val in view_uniforms.items():
+                    if key in prog.locations["uniforms"]:
+                        prog.set_uniform(key, val)
+                        
+            item.draw(mat_v_inverted, state)
+        
+        self.packets = []
+        return len(packets)
+        
+        
+    @staticmethod
+    def sort_key(item):
+        return (item.program.id, item.filled, item.linewidth, item.primitive_type, item.serial)
@@ -0,0 +1,216 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import numpy as np
+
+import OpenGL
+from OpenGL.GL import *
+
+class SegmentIndex():
+    """
+    This class is an acceleration structure for finding the line segment
+    of an item which is closest to a ray, used for mouse picking.
+    
+    All primitives are reduced to line segments (triangles to their
+    edges). Consecutive segments are grouped into chunks, and for each
+    chunk a bounding sphere is stored. Since the vertices of toolpaths
+    and most other items are spatially coherent, a ray query first
+    rejects almost all chunks with one vectorized test, and then
+    calculates exact distances only for the segments of the remaining
+    chunks.
+    
+    All coordinates are local coordinates of the item.
+    """
+    
+    chunk_size = 64
+    
+    def __init__(self, positions, primitive_type, indices=None, restart_index=None):
+        """
+        @param positions
+        Numpy array of shape (n, 3) of vertex positions.
+        
+        @param primitive_type
+        The OpenGL primitive type with which the vertices are drawn.
+        
+        @param indices
+        Optional numpy array of vertex indices for indexed drawing.
+        
+        @param restart_index
+        Optional primitive restart index contained in `indices`, see
+        glPrimitiveRestartIndex(). Each run of indices between restarts
+        is a separate primitive.
+        """
+        self.positions = np.asarray(positions, dtype=np.float64)
+        
+        if indices is None:
+            order = np.arange(len(self.positions))
+        else:
+            order = np.asarray(indices, dtype=np.int64)
+            
+        if restart_index == None or indices is None:
+            self.seg_a, self.seg_b = SegmentIndex.segments(order, primitive_type)
+        else:
+            restarts = np.flatnonzero(order == restart_index)
+            pieces = [SegmentIndex.segments(piece[piece != restart_index], primitive_type) for piece in np.split(order, restarts)]
+            self.seg_a = np.concatenate([piece[0] for piece in pieces])
+            self.seg_b = np.concatenate([piece[1] for piece in pieces])
+        
+        a = self.positions[self.seg_a]
+        b = self.positions[self.seg_b]
+        
+        # bounding sphere of each chunk of consecutive segments
+        starts = np.arange(0, len(self.seg_a), self.chunk_size)
+        if len(starts) > 0:
+            box_min = np.minimum.reduceat(np.minimum(a, b), starts)
+            box_max = np.maximum.reduceat(np.maximum(a, b), starts)
+        else:
+            box_min = box_max = np.zeros((0, 3))
+        self.chunk_centers = (box_min + box_max) * 0.5
+        self.chunk_radii = np.linalg.norm(box_max - box_min, axis=1) * 0.5
+        
+        
+    def __len__(self):
+        return len(self.seg_a)
+        
+        
+    def query_ray(self, origin, direction, tan_tolerance, scale=1):
+        """
+        Find the segment closest to a ray, measured as the angle under
+        which the distance between ray and segment appears from the
+        ray origin. This corresponds to a distance in pixels on screen.
+        
+        Returns a tuple (segment number, parameter along the segment
+        0..1, ray parameter t, tangent of angle), or None if no segment
+        is closer than `tan_tolerance`.
+        
+        @param origin
+        Start of the ray, numpy array of 3 floats.
+        
+        @param direction
+        Direction of the ray, numpy array of 3 floats. Must have the
+        length 1 / `scale`, i.e. length 1 in world units.
+        
+        @param tan_tolerance
+        Tangent of the maximum angle between the ray and a segment.
+        
+        @param scale
+        Number of world units per local unit.
+        """
+        if len(self.seg_a) == 0:
+            return None
+        
+        dd = direction.dot(direction)
+        
+        # reject chunks whose bounding sphere is outside of the cone
+        # around the ray
+        rel = self.chunk_centers - origin
+        t = np.maximum(rel.dot(direction) / dd, 0)
+        dist = np.linalg.norm(rel - t[:, np.newaxis] * direction, axis=1)
+        radii = self.chunk_radii
+        t_far = t + radii * scale
+        chunks = np.nonzero(dist <= radii + tan_tolerance * t_far / scale)[0]
+        if len(chunks) == 0:
+            return None
+        
+        candidates = (chunks[:, np.newaxis] * self.chunk_size + np.arange(self.chunk_size)).ravel()
+        candidates = candidates[candidates < len(self.seg_a)]
+        
+        # closest points between the ray and each candidate segment
+        a = self.positions[self.seg_a[candidates]]
+        v = self.positions[self.seg_b[candidates]] - a
+        w = origin - a
+        
+        b_ = v.dot(direction)
+        c_ = (v * v).sum(axis=1)
+        d_ = w.dot(direction)
+        e_ = (v * w).sum(axis=1)
+        
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # parameter along the segment, 0 for parallel segments
+            denom = dd * c_ - b_ * b_
+            parallel = denom <= 1e-12 * dd * c_
+            s = np.where(parallel, 0, (dd * e_ - b_ * d_) / denom)
+            s = np.clip(s, 0, 1)
+            
+            # parameter along the ray, then the segment again after clamping
+            t = np.maximum((b_ * s - d_) / dd, 0)
+            s = np.where(c_ > 0, np.clip((b_ * t + e_) / c_, 0, 1), 0)
+            
+        p_ray = origin + t[:, np.newaxis] * direction
+        p_seg = a + s[:, np.newaxis] * v
+        dist = np.linalg.norm(p_ray - p_seg, axis=1) * scale
+        
+        tan_angle = dist / np.maximum(t, 1e-9)
+        best = np.argmin(tan_angle)
+        if tan_angle[best] > tan_tolerance:
+            return None
+        
+        return (int(candidates[best]), float(s[best]), float(t[best]), float(tan_angle[best]))
+    
+    
+    @staticmethod
+    def segments(order, primitive_type):
+        """
+        Returns two arrays of vertex numbers, the start and end vertices
+        of all line segments (or triangle edges) of a primitive.
+        
+        @param order
+        Numpy array of vertex numbers in drawing order.
+        
+        @param primitive_type
+        The OpenGL primitive type.
+        """
+        n = len(order)
+        
+        if primitive_type == GL_LINES:
+            n -= n % 2
+            return order[0:n:2], order[1:n:2]
+        
+        if primitive_type == GL_LINE_STRIP:
+            return order[:-1], order[1:]
+        
+        if primitive_type == GL_LINE_LOOP:
+            return order, np.roll(order, -1)
+        
+        # edges of triangles are interleaved to keep chunks compact
+        if primitive_type == GL_TRIANGLES:
+            n -= n % 3
+            v0, v1, v2 = order[0:n:3], order[1:n:3], order[2:n:3]
+            return np.stack((v0, v1, v2), axis=1).ravel(), np.stack((v1, v2, v0), axis=1).ravel()
+        
+        if primitive_type == GL_TRIANGLE_STRIP:
+            if n < 3:
+                return order[:-1], order[1:]
+            a = np.stack((order[:-2], order[:-2]), axis=1).ravel()
+            b = np.stack((order[1:-1], order[2:]), axis=1).ravel()
+            return np.append(a, order[-2]), np.append(b, order[-1])
+        
+        if primitive_type == GL_TRIANGLE_FAN:
+            if n < 3:
+                return order[:-1], order[1:]
+            spokes = np.full(n - 2, order[0])
+            a = np.stack((spokes, order[1:-1]), axis=1).ravel()
+            b = np.stack((order[1:-1], order[2:]), axis=1).ravel()
+            return np.append(a, order[0]), np.append(b, order[-1])
+        
+        # GL_POINTS and others: degenerate segments
+        return order, order
@@ -0,0 +1,124 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+class SharedVertices():
+    """
+    Vertex data in a `multiprocessing.shared_memory` segment, as a numpy
+    structured array.
+    
+    A worker process creates the segment with `create()`, writes the
+    vertices into `array` and passes `handle()` back to the GUI process,
+    which maps the same memory with `attach()`. The vertex data are never
+    pickled or copied between the processes.
+    
+    See `build_shared()` and `PainterWidget.item_create_shared()`.
+    """
+    
+    def __init__(self, shm, dtype, count):
+        self.shm = shm
+        self.dtype = np.dtype(dtype)
+        self.count = count
+        self.array = np.ndarray(count, self.dtype, buffer=shm.buf)
+        
+        
+    @staticmethod
+    def create(dtype, count):
+        """
+        Returns zeroed storage for `count` vertices of numpy `dtype` in
+        a new segment.
+        """
+        size = max(1, np.dtype(dtype).itemsize * count) # empty segments are not allowed
+        return SharedVertices(shared_memory.SharedMemory(create=True, size=size), dtype, count)
+    
+    
+    @staticmethod
+    def attach(handle):
+        """
+        Maps the segment of another process, see `handle()`.
+        """
+        name, dtype, count = handle
+        return SharedVertices(shared_memory.SharedMemory(name=name), dtype, count)
+    
+    
+    def handle(self):
+        """
+        Returns a small picklable tuple identifying this segment.
+        """
+        return (self.shm.name, self.dtype, self.count)
+    
+    
+    def close(self):
+        """
+        Unmaps the segment in this process. All numpy arrays using
+        its memory, including views of `array`, must have been deleted.
+        """
+        self.array = None
+        self.shm.close()
+        
+        
+    def unlink(self):
+        """
+        Removes the name of the segment. Processes which have mapped it
+        keep their mapping, the memory is freed when the last one closes.
+        Call this once, usually right after `attach()`.
+        """
+        self.shm.unlink()
+        
+        
+def build_shared(builder, *args):
+    """
+    Runs `builder` in a worker process, giving it shared memory for
+    the vertices it builds. Returns `(handle, vertexcount)`, see
+    `SharedVertices.attach()`.
+    
+    @param builder
+    A picklable function `builder(allocate, *args)` returning the number
+    of vertices built. `allocate(count, dtype)` returns a numpy array
+    of `count` zeroed vertices to be filled by the builder. It must be
+    called exactly once.
+    """
+    allocated = []
+    
+    def allocate(count, dtype):
+        if allocated:
+            raise SystemError("build_shared: allocate() can only be called once")
+        shared = SharedVertices.create(dtype, count)
+        allocated.append(shared)
+        return shared.array
+    
+    try:
+        vertexcount = builder(allocate, *args)
+        if not allocated:
+            raise SystemError("build_shared: builder did not call allocate()")
+    except:
+        for shared in allocated:
+            shared.close()
+            shared.unlink()
+        raise
+    
+    shared = allocated[0]
+    handle = shared.handle()
+    shared.close() # the builder must not keep references to the array
+    return (handle, vertexcount)
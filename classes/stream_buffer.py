@@ -0,0 +1,248 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import ctypes
+import numpy as np
+import OpenGL
+from OpenGL.GL import *
+
+from .gl_state import GlState
+
+class StreamBuffer():
+    """
+    A GL_ARRAY_BUFFER for vertex data which changes every frame, used as
+    a ring buffer of `segments` equal parts.
+    
+    Data are written into the current segment, one after the other. When
+    the draw calls using them have been issued, `fence()` places a fence
+    behind them, and writing continues in the next segment. Before a
+    segment is written to again, its fence is waited for, which normally
+    has long been signaled. Thus, data still in use by the GPU are never
+    overwritten, and the driver never has to synchronize.
+    
+    The method of writing is chosen according to the OpenGL version:
+      * "persistent": OpenGL 4.4 or ARB_buffer_storage. The buffer is
+        mapped once, and data are copied straight into it.
+      * "unsynchronized": OpenGL 3.0. Each write maps the range with
+        GL_MAP_UNSYNCHRONIZED_BIT and GL_MAP_INVALIDATE_RANGE_BIT.
+      * "orphan": fallback without fences. Before each segment, the
+        buffer is orphaned by glBufferData() with NULL, and data are
+        written with glBufferSubData(). There is only one segment.
+    """
+    
+    def __init__(self, size, segments=3, method=None):
+        """
+        Must be called with a current OpenGL context.
+        
+        @param size
+        Total size in bytes. Each segment has to take all data written
+        during one frame.
+        
+        @param segments
+        Number of segments. 3 allows the GPU to lag 2 frames behind.
+        
+        @param method
+        "persistent", "unsynchronized" or "orphan". Defaults to the best
+        one available.
+        """
+        if method == None:
+            if bool(glBufferStorage) and bool(glFenceSync):
+                method = "persistent"
+            elif bool(glMapBufferRange) and bool(glFenceSync):
+                method = "unsynchronized"
+            else:
+                method = "orphan"
+        if not method in ("persistent", "unsynchronized", "orphan"):
+            raise ValueError("Unknown stream buffer method {}".format(method))
+        self.method = method
+        
+        if method == "orphan":
+            segments = 1
+        self.segments = segments
+        self.segment_size = size // segments
+        self.size = self.segment_size * segments
+        
+        # one fence per segment, None when not in use by the GPU
+        self._fences = [None] * segments
+        
+        self.segment = 0 # the segment written to
+        self.head = 0 # byte offset of the next write
+        self._segment_used = False
+        
+        # statistics
+        self.bytes_written = 0
+        self.stalls = 0 # number of waits for fences not yet signaled
+        
+        self.vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        self._address = None
+        if method == "persistent":
+            flags = GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT
+            glBufferStorage(GL_ARRAY_BUFFER, self.size, None, flags)
+            self._address = StreamBuffer._address_of(glMapBufferRange(GL_ARRAY_BUFFER, 0, self.size, flags))
+        else:
+            glBufferData(GL_ARRAY_BUFFER, self.size, None, GL_STREAM_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        
+        
+    def write(self, data, alignment=1, state=None):
+        """
+        Copies `data` into the current segment and returns the byte
+        offset of the copy in the buffer.
+        
+        @param data
+        A numpy array.
+        
+        @param alignment
+        The offset is rounded up to a multiple of this, e.g. the size
+        of a vertex, so that glDrawArrays() can address the data.
+        
+        @param state
+        The GlState of the current frame, if called while drawing.
+        """
+        if state == None:
+            state = GlState()
+            
+        data = np.ascontiguousarray(data)
+        nbytes = data.nbytes
+        
+        if not self._segment_used:
+            self._begin_segment(state)
+            
+        start = self.segment * self.segment_size
+        offset = start + -(-(self.head - start) // alignment) * alignment
+        if offset + nbytes > start + self.segment_size:
+            raise IndexError("Stream buffer: {} bytes don't fit into the rest of the segment of {} bytes. Increase the size.".format(nbytes, self.segment_size))
+        
+        state.bind_buffer(GL_ARRAY_BUFFER, self.vbo)
+        if self.method == "persistent":
+            ctypes.memmove(self._address + offset, data.ctypes.data, nbytes)
+        elif self.method == "unsynchronized":
+            access = GL_MAP_WRITE_BIT | GL_MAP_UNSYNCHRONIZED_BIT | GL_MAP_INVALIDATE_RANGE_BIT
+            address = StreamBuffer._address_of(glMapBufferRange(GL_ARRAY_BUFFER, offset, nbytes, access))
+            ctypes.memmove(address, data.ctypes.data, nbytes)
+            glUnmapBuffer(GL_ARRAY_BUFFER)
+        else:
+            glBufferSubData(GL_ARRAY_BUFFER, offset, nbytes, data)
+            
+        self.head = offset + nbytes
+        self.bytes_written += nbytes
+        return offset
+    
+    
+    def space(self, alignment=1):
+        """
+        Returns the number of bytes which can still be written into the
+        current segment, see `write()`.
+        """
+        start = self.segment * self.segment_size
+        if not self._segment_used:
+            return self.segment_size
+        offset = start + -(-(self.head - start) // alignment) * alignment
+        return max(0, start + self.segment_size - offset)
+    
+    
+    def rewind(self):
+        """
+        Continues writing at the beginning of the current segment, over
+        the data written into it so far. Only call this when no draw call
+        uses them yet.
+        """
+        self.head = self.segment * self.segment_size
+        
+        
+    def segment_of(self, offset):
+        """
+        Returns the number of the segment containing byte `offset`.
+        """
+        return offset // self.segment_size
+    
+    
+    def fence(self, segment=None):
+        """
+        Call this after the draw calls using data of `segment` (default:
+        the current one) have been issued. Places a fence, replacing any
+        earlier one of the segment. If it is the current segment and data
+        have been written into it, writing continues in the next one.
+        """
+        if segment == None:
+            segment = self.segment
+            
+        if self.method != "orphan":
+            if self._fences[segment] != None:
+                glDeleteSync(self._fences[segment])
+            self._fences[segment] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        
+        if segment == self.segment and self._segment_used:
+            self.segment = (self.segment + 1) % self.segments
+            self.head = self.segment * self.segment_size
+            self._segment_used = False
+            
+            
+    def remove(self):
+        """
+        Deletes the buffer and all fences.
+        """
+        for segment, fence in enumerate(self._fences):
+            if fence != None:
+                glDeleteSync(fence)
+                self._fences[segment] = None
+        if self._address != None:
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+            glUnmapBuffer(GL_ARRAY_BUFFER)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+            self._address = None
+        glDeleteBuffers(1, [self.vbo])
+        
+        
+    def _begin_segment(self, state):
+        """
+        Waits until the GPU is done with the current segment, and
+        orphans the buffer in the fallback method.
+        """
+        fence = self._fences[self.segment]
+        if fence != None:
+            result = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 0)
+            if result == GL_TIMEOUT_EXPIRED:
+                self.stalls += 1
+                while result == GL_TIMEOUT_EXPIRED:
+                    result = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1000000) # 1 ms
+            glDeleteSync(fence)
+            self._fences[self.segment] = None
+            
+        if self.method == "orphan":
+            state.bind_buffer(GL_ARRAY_BUFFER, self.vbo)
+            glBufferData(GL_ARRAY_BUFFER, self.size, None, GL_STREAM_DRAW)
+            
+        self.head = self.segment * self.segment_size
+        self._segment_used = True
+        
+        
+    @staticmethod
+    def _address_of(pointer):
+        """
+        glMapBufferRange() returns an integer or a ctypes pointer,
+        depending on the PyOpenGL version.
+        """
+        if hasattr(pointer, "value"):
+            return pointer.value
+        return int(pointer)
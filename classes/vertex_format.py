@@ -0,0 +1,268 @@
+"""
+pyglpainter - Copyright (c) 2015 Michael Franzl
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import ctypes
+import collections
+import numpy as np
+
+import OpenGL
+from OpenGL.GL import *
+
+class VertexFormat():
+    """
+    Declares the layout of the vertex data of an Item. The same
+    declaration determines the numpy dtype of the CPU data and the
+    glVertexAttribPointer() calls describing the GPU buffer.
+    
+    Each attribute is a tuple (name, type, components, normalized):
+    
+      * name: the name of the attribute in the shader
+      * type: a numpy type like np.float32, np.float16 or np.uint8
+      * components: number of values per vertex, 1 to 4
+      * normalized: optional, for integer types only. If True, the
+        shader sees values mapped to 0..1 (unsigned) or -1..1 (signed).
+        On the CPU, use `encode()` and `decode()` to convert from and
+        to floats.
+        
+    Vertices are padded to a multiple of 4 bytes, as recommended by
+    OpenGL. Attributes which are not known to the program of an item
+    are not passed to the shader.
+    
+    By default, attributes are interleaved in one numpy structured array
+    and one buffer. A format returned by `separate()` instead keeps each
+    attribute in its own contiguous numpy array and buffer, see
+    VertexArrays. Changing one attribute of a range of vertices, e.g.
+    recoloring, is then a single contiguous upload.
+    
+    See the predefined formats `standard`, `compact` and `half` at the
+    bottom of this file.
+    """
+    
+    gl_types = {
+        np.dtype(np.float32): GL_FLOAT,
+        np.dtype(np.float16): GL_HALF_FLOAT,
+        np.dtype(np.int8): GL_BYTE,
+        np.dtype(np.uint8): GL_UNSIGNED_BYTE,
+        np.dtype(np.int16): GL_SHORT,
+        np.dtype(np.uint16): GL_UNSIGNED_SHORT,
+        np.dtype(np.int32): GL_INT,
+        np.dtype(np.uint32): GL_UNSIGNED_INT,
+        }
+    
+    def __init__(self, attributes, interleaved=True):
+        """
+        @param attributes
+        List of attribute tuples, see class documentation.
+        
+        @param interleaved
+        If False, each attribute is stored in its own array and buffer.
+        """
+        self.interleaved = interleaved
+        self.attributes = []
+        fields = []
+        for attribute in attributes:
+            name, tpe, components = attribute[0:3]
+            normalized = len(attribute) > 3 and attribute[3]
+            tpe = np.dtype(tpe)
+            if not tpe in VertexFormat.gl_types:
+                raise TypeError("Vertex attribute {}: unsupported type {}".format(name, tpe))
+            if normalized and tpe.kind == "f":
+                raise TypeError("Vertex attribute {}: only integers can be normalized".format(name))
+            self.attributes.append((name, tpe, components, normalized))
+            fields.append((name, tpe, components))
+            
+        self.names = [attribute[0] for attribute in self.attributes]
+        
+        size = np.dtype(fields).itemsize
+        if size % 4 != 0:
+            fields.append(("_padding", np.uint8, 4 - size % 4))
+        self.dtype = np.dtype(fields)
+        
+        
+    @staticmethod
+    def from_dtype(dtype, normalized=()):
+        """
+        Returns the format of existing vertex data of numpy `dtype`.
+        
+        @param normalized
+        Names of the integer fields which are normalized.
+        """
+        attributes = []
+        for name in dtype.names:
+            tpe, shape = dtype[name].base, dtype[name].shape
+            attributes.append((name, tpe, shape[0] if shape else 1, name in normalized))
+        return VertexFormat(attributes)
+    
+    
+    def separate(self):
+        """
+        Returns this format with each attribute in its own array and
+        buffer.
+        """
+        return VertexFormat(self.attributes, interleaved=False)
+    
+    
+    def empty(self, count):
+        """
+        Returns zeroed storage for `count` vertices: a numpy structured
+        array, or VertexArrays if not interleaved.
+        """
+        if self.interleaved:
+            return np.zeros(count, self.dtype)
+        return VertexArrays(self, count)
+    
+    
+    def extend(self, data, count):
+        """
+        Returns a copy of the storage `data` with `count` zeroed vertices
+        appended.
+        """
+        if self.interleaved:
+            return np.append(data, self.empty(count))
+        return data.extended(count)
+    
+    
+    def is_normalized(self, name):
+        for attribute in self.attributes:
+            if attribute[0] == name:
+                return attribute[3]
+        raise KeyError("Vertex format has no attribute {}".format(name))
+    
+    
+    def encode(self, name, values):
+        """
+        Converts floats into values of attribute `name`, e.g. a color
+        (1, 0.5, 0, 1) into (255, 128, 0, 255) for normalized uint8.
+        """
+        tpe = self.dtype[name].base
+        if not self.is_normalized(name):
+            return np.asarray(values, dtype=tpe)
+        
+        info = np.iinfo(tpe)
+        values = np.rint(np.asarray(values, dtype=np.float64) * info.max)
+        return np.clip(values, info.min, info.max).astype(tpe)
+    
+    
+    def decode(self, name, values):
+        """
+        Converts values of attribute `name` into float32. Returns a view
+        without copying if they already are float32.
+        """
+        tpe = self.dtype[name].base
+        if not self.is_normalized(name):
+            return np.asarray(values, dtype=np.float32)
+        
+        result = np.asarray(values, dtype=np.float32) / np.iinfo(tpe).max
+        if tpe.kind == "i":
+            result = np.maximum(result, -1) # most negative value is -1, too
+        return result
+    
+    
+    def setup(self, locations, buffers=None):
+        """
+        Calls glVertexAttribPointer() for each attribute used by the
+        program. Assumes that the VAO is bound, and for interleaved
+        formats also the GL_ARRAY_BUFFER holding the vertex data.
+        
+        @param locations
+        The attribute locations of a Program, see `Program.locations`.
+        
+        @param buffers
+        For formats which are not interleaved: dict of buffer IDs by
+        attribute name. The GL_ARRAY_BUFFER binding is changed.
+        """
+        stride = self.dtype.itemsize
+        for name, tpe, components, normalized in self.attributes:
+            if not name in locations["attributes"]:
+                continue
+            location = locations["attributes"][name]
+            if self.interleaved:
+                offset = ctypes.c_void_p(self.dtype.fields[name][1])
+                attribute_stride = stride
+            else:
+                glBindBuffer(GL_ARRAY_BUFFER, buffers[name])
+                offset = ctypes.c_void_p(0)
+                attribute_stride = tpe.itemsize * components
+            glEnableVertexAttribArray(location)
+            glVertexAttribPointer(location, components, VertexFormat.gl_types[tpe], GL_TRUE if normalized else GL_FALSE, attribute_stride, offset)
+            
+            
+class VertexArrays():
+    """
+    Vertex data of a VertexFormat which is not interleaved: one
+    contiguous numpy array of shape (count, components) per attribute.
+    
+    Like a structured array, it is indexed by attribute name, so that
+    `vdata_pos_col["color"][i] = ...` works for both layouts.
+    """
+    
+    def __init__(self, vertex_format, count):
+        self.arrays = collections.OrderedDict()
+        for name, tpe, components, normalized in vertex_format.attributes:
+            self.arrays[name] = np.zeros((count, components), tpe)
+            
+            
+    def __getitem__(self, name):
+        return self.arrays[name]
+    
+    
+    def __setitem__(self, name, values):
+        self.arrays[name][:] = values
+        
+        
+    def __len__(self):
+        return len(next(iter(self.arrays.values())))
+    
+    
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+    
+    
+    def extended(self, count):
+        result = VertexArrays.__new__(VertexArrays)
+        result.arrays = collections.OrderedDict()
+        for name, array in self.arrays.items():
+            extension = np.zeros((count,) + array.shape[1:], array.dtype)
+            result.arrays[name] = np.concatenate((array, extension))
+        return result
+    
+    
+# 28 bytes, the format used before vertex formats were configurable
+VertexFormat.standard = VertexFormat([
+    ("position", np.float32, 3),
+    ("color", np.float32, 4),
+    ])
+
+# 16 bytes, colors as normalized bytes
+VertexFormat.compact = VertexFormat([
+    ("position", np.float32, 3),
+    ("color", np.uint8, 4, True),
+    ])
+
+# 12 bytes. Half floats have 11 significant bits, so positions should be
+# small local coordinates relative to the origin of the item. Colors come
+# first so that both attributes start at multiples of 4 bytes.
+VertexFormat.half = VertexFormat([
+    ("color", np.uint8, 4, True),
+    ("position", np.float16, 3),
+    ])
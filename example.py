@@ -77,19 +77,75 @@ def main():
             "mat_p": "Matrix4fv",
             "height_min": "1f",
             "height_max": "1f",
+            "colormap": "1i",
             },
         "attributes": {
             "position": "vec3",
+            "z": "float",
             }
         }
     p.program_create("heightmap", path + "heightmap-vertex.c", path + "heightmap-fragment.c", opts)
+    
+    opts = {
+        "uniforms": {
+            "mat_m": "Matrix4fv",
+            "mat_v": "Matrix4fv",
+            "mat_p": "Matrix4fv",
+            "color_mode": "1i",
+            "palette": "4fv",
+            "scalar_min": "1f",
+            "scalar_max": "1f",
+            "colormap": "1i",
+            },
+        "attributes": {
+            "position": "vec3",
+            "category": "vec4",
+            "scalar": "vec2",
+            }
+        }
+    p.program_create("gcode", path + "gcode-vertex.c", path + "gcode-fragment.c", opts)
+    
+    opts = {
+        "uniforms": {
+            "mat_m": "Matrix4fv",
+            "mat_v": "Matrix4fv",
+            "mat_p": "Matrix4fv",
+            "spacing_minor": "1f",
+            "spacing_major": "1f",
+            "color_minor": "4fv",
+            "color_major": "4fv",
+            "line_width": "1f",
+            "fade_distance": "1f",
+            },
+        "attributes": {
+            "position": "vec3",
+            }
+        }
+    p.program_create("grid", path + "grid-vertex.c", path + "grid-fragment.c", opts)
+    
+    opts = {
+        "uniforms": {
+            "mat_m": "Matrix4fv",
+            "mat_v": "Matrix4fv",
+            "mat_p": "Matrix4fv",
+            "time_now": "1f",
+            "fade_time": "1f",
+            },
+        "attributes": {
+            "position": "vec3",
+            "color": "vec4",
+            "time": "float",
+            }
+        }
+    p.program_create("trail", path + "trail-vertex.c", path + "simple3d-fragment.c", opts)
     # ============= CREATE PROGRAMS END =============
     
 
     # ============= CREATE COMPOUND PRIMITIVES BEGIN =============
     
     # create a "ground" for better orientation
-    grid = p.item_create("OrthoLineGrid", "mygrid1", "simple3d", (0,0), (1000,1000), 10)
+    # lines are computed by the shaders, see also OrthoLineGrid
+    grid = p.item_create("ShaderGrid", "mygrid1", "grid", 10, 100)
     
 
     # Create static 2D overlay text at bottom left corder of window
@@ -180,10 +236,12 @@ def main():
     gcodes.append("G2 X60 Y30 I5 J5")
     cs_offsets = {"G54": (10,10,0) }
     cmpos = (0,0,0) # note this: since no Z movement in Gcode, all is in plane of Z=10
-    mygcode1 = p.item_create("GcodePath", "mygcode1", "simple3d", gcodes, cmpos, "G54", cs_offsets)
-    mygcode1.set_origin(mycs2.origin_tuple)
+    mygcode1 = p.item_create("GcodePath", "mygcode1", "gcode", gcodes, cmpos, "G54", cs_offsets)
+    mygcode1.set_parent(mycs2) # the toolpath moves with mycs2
+    mygcode1.set_color_scheme("motion") # or "tool", "feed", "spindle"
     
     i = p.item_create("Text", "mygcodelabel", "simple3d", "class GcodePath", (0,0,0), 1)
+    i.set_parent(mycs2)
     i.billboard = True
     i.billboard_axis = "Z"
     # ============= CREATE COMPOUND PRIMITIVES END =============
@@ -292,6 +350,13 @@ def main():
             dat["color"][idx] = (1, 1, 1, 1)
 
     i = p.item_create("HeightMap", "myheightmap", "heightmap", grid_x, grid_y, dat, True, (100,400,1), 10)
+    
+    
+    # Trail of the last 300 reported machine positions, fading out
+    # after 60 seconds. Older positions are dropped.
+    mytrail = p.item_create("TrailPath", "mytrail", "trail", 300, (1, 0.8, 0.2, 1), 60, 2, (400,100,0))
+    for n in range(0, 500):
+        mytrail.append((50 * math.cos(n / 20), 50 * math.sin(n / 20), n / 10))
     # ============= CREATE RAW OPENGL PRIMITIVES END =============
     
     
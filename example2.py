@@ -28,14 +28,12 @@ import sys
 import math
 
 import numpy as np
-from scipy.interpolate import griddata
 
 
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtGui import QVector3D
 
 import numpy as np
-from scipy.interpolate import griddata
 
 import time
 
@@ -43,6 +41,7 @@ import OpenGL
 from OpenGL.GL import *
 
 from mainwindow import MainWindow
+from classes.items.probe_map import ProbeMap
 
 def main():
     app = QApplication(sys.argv)
@@ -84,9 +83,11 @@ def main():
             "mat_p": "Matrix4fv",
             "height_min": "1f",
             "height_max": "1f",
+            "colormap": "1i",
             },
         "attributes": {
             "position": "vec3",
+            "z": "float",
             }
         }
     p.program_create("heightmap", path + "heightmap-vertex.c", path + "heightmap-fragment.c", opts)
@@ -137,27 +138,20 @@ def main():
     def func(x, y):
         return x*(1-x)*np.cos(4*np.pi*x) * np.sin(4*np.pi*y**2)**2
     
-    gx, gy = np.mgrid[0:1:100j, 0:1:100j]
-
     dat = np.zeros(100 * 100, [("position", np.float32, 3), ("color", np.float32, 4)])
+    dat["position"][:, 0] = np.tile(np.arange(grid_x), grid_y)
+    dat["position"][:, 1] = np.repeat(np.arange(grid_y), grid_x)
+    dat["color"] = (1, 1, 1, 1)
     i = p.item_create("HeightMap", "myheightmap2", "heightmap", 100, 100, dat, False, (0,0,0), 2)
     
-    
-    for animation in range(0,10):
-        points = np.random.rand(20, 2)
-        values = func(points[:,0], points[:,1])
-        gz = griddata(points, values, (gx, gy), method='cubic', fill_value=0)
-        
-        for y in range(0, grid_y):
-            for x in range(0, grid_x):
-                idx = y * grid_x + x
-                dat["position"][idx] = (x, y, 2 + gz[x][y])
-                #print(dat["position"][idx])
-                dat["color"][idx] = (1, 1, 1, 1)
-                
-        i.set_data(dat)
+    # simulate a probe cycle, adding one point at a time
+    probes = ProbeMap(i, 2)
+    for animation in range(0,50):
+        point = np.random.rand(2)
+        value = func(point[0], point[1])
+        probes.add(point * (grid_x - 1, grid_y - 1), 2 + value)
         print(animation)
-        time.sleep(1)
+        time.sleep(0.1)
 
     
 
@@ -0,0 +1,15 @@
+#version 120
+
+uniform sampler1D colormap; // for scalars, see classes/colormaps.py
+
+varying vec4 v_color;
+varying float v_value;
+
+void main()
+{
+  if (v_value < 0.0) {
+    gl_FragColor = v_color;
+  } else {
+    gl_FragColor = vec4(texture1D(colormap, v_value).rgb, v_color.a);
+  }
+}
@@ -0,0 +1,40 @@
+#version 120
+
+uniform mat4 mat_m;
+uniform mat4 mat_v;
+uniform mat4 mat_p;
+
+// see GcodePath.set_color_scheme()
+uniform int color_mode; // 0: motion mode, 1: tool, 2: feed, 3: spindle speed
+uniform vec4 palette[16];
+uniform float scalar_min;
+uniform float scalar_max;
+
+attribute vec3 position;
+attribute vec4 category; // motion mode, flags (1: highlighted), tool number, alpha * 255
+attribute vec2 scalar; // feed, spindle speed
+
+varying vec4 v_color;
+varying float v_value; // normalized scalar, or -1 when colored by palette
+
+void main()
+{
+  gl_Position = mat_p * mat_v * mat_m * vec4(position, 1.0);
+  
+  float alpha = category.w / 255.0;
+  
+  if (category.y > 0.5) {
+    v_color = vec4(1, 0.5, 1, 1); // highlighted
+    v_value = -1.0;
+  } else if (color_mode == 0) {
+    v_color = vec4(palette[int(category.x)].rgb, alpha);
+    v_value = -1.0;
+  } else if (color_mode == 1) {
+    v_color = vec4(palette[int(mod(category.z, 16.0))].rgb, alpha);
+    v_value = -1.0;
+  } else {
+    float s = (color_mode == 2) ? scalar.x : scalar.y;
+    v_color = vec4(0, 0, 0, alpha);
+    v_value = clamp((s - scalar_min) / max(scalar_max - scalar_min, 1e-12), 0.0, 1.0);
+  }
+}
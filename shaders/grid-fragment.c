@@ -0,0 +1,42 @@
+#version 120
+
+// see classes/items/shader_grid.py
+uniform float spacing_minor;
+uniform float spacing_major;
+uniform vec4 color_minor;
+uniform vec4 color_major;
+uniform float line_width; // in pixels
+uniform float fade_distance;
+
+varying vec2 v_grid;
+varying vec3 v_position;
+
+// coverage of the nearest line at integer grid coordinates
+float grid_lines(vec2 coord)
+{
+  // grid units per pixel
+  vec2 width = fwidth(coord);
+  
+  // distance from the nearest line in pixels, anti-aliased over 1 pixel
+  vec2 dist = abs(fract(coord - 0.5) - 0.5) / width;
+  float line = clamp(0.5 * line_width + 0.5 - min(dist.x, dist.y), 0.0, 1.0);
+  
+  // lines closer than a few pixels fade out instead of causing moire
+  return line * (1.0 - smoothstep(0.2, 0.5, max(width.x, width.y)));
+}
+
+void main()
+{
+  float minor = grid_lines(v_grid / spacing_minor);
+  float major = grid_lines(v_grid / spacing_major);
+  
+  vec4 color = mix(vec4(color_minor.rgb, color_minor.a * minor), color_major, major);
+  // The distance is not linear across the quad, and must not be
+  // interpolated from its corners, which are all far away.
+  color.a *= 1.0 - smoothstep(0.5 * fade_distance, fade_distance, length(v_position));
+  
+  if (color.a < 0.004) {
+    discard;
+  }
+  gl_FragColor = color;
+}
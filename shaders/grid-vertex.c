@@ -0,0 +1,18 @@
+#version 120
+
+uniform mat4 mat_m;
+uniform mat4 mat_v;
+uniform mat4 mat_p;
+
+attribute vec3 position;
+
+varying vec2 v_grid; // local XY coordinates, in which the lines are computed
+varying vec3 v_position; // view space position, interpolated linearly
+
+void main()
+{
+  vec4 position_v = mat_v * mat_m * vec4(position, 1.0);
+  gl_Position = mat_p * position_v;
+  v_grid = position.xy;
+  v_position = position_v.xyz;
+}
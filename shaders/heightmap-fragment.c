@@ -6,29 +6,18 @@ varying float vertex_id;
 uniform float height_min;
 uniform float height_max;
 
+// palette, see classes/colormaps.py
+uniform sampler1D colormap;
+
 void main()
 {
+  // normalize, the texture is clamped to its edges
+  float a = (height - height_min) / max(height_max - height_min, 1e-12);
   
-  float r, g, b;
-
-  // calculate a 7-step color spectrum
-  float a = 6 * ( height - height_min) / ( height_max - height_min); // normalize
-  float x = floor(a);
-  float y = a-x;
-  
-  if (x == 0)      { r=0.2; g=0.2;  b=y;   } // grey
-  else if (x == 1) { r=0;   g=y;    b=1;   } // blue
-  else if (x == 2) { r=0;   g=1;    b=1-y; } // light blue
-  else if (x == 3) { r=y;   g=1-y;  b=0;   } // green
-  else if (x == 4) { r=1;   g=y;    b=0;   } // red
-  else if (x == 5) { r=1;   g=1;    b=y;   } // yellow
-  else if (x == 6) { r=1;   g=1;    b=1;   } // white
-  else             { r=1;   g=1;    b=1;   } // white
-  
-  gl_FragColor = vec4(r, g, b, 1);
+  gl_FragColor = vec4(texture1D(colormap, a).rgb, 1);
   
   // simple way of striping the surface, // requires GLSL version 130
   //if (mod(floor(vertex_id), 10) == 0) {
-  //  gl_FragColor = vec4(r, g, b, 0.7);
+  //  gl_FragColor = vec4(texture1D(colormap, a).rgb, 0.7);
   //}
-}
\ No newline at end of file
+}
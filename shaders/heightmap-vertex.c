@@ -5,13 +5,14 @@ uniform mat4 mat_v;
 uniform mat4 mat_p;
 
 attribute vec3 position;
+attribute float z; // heights are a separate stream, position.z is ignored
 
 varying float height;
 varying float vertex_id;
 
 void main()
 {
-  gl_Position = mat_p * mat_v * mat_m * vec4(position, 1.0);
-  height = position.z;
+  gl_Position = mat_p * mat_v * mat_m * vec4(position.xy, z, 1.0);
+  height = z;
   //vertex_id = gl_VertexID;
 }
\ No newline at end of file
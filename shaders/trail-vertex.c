@@ -0,0 +1,26 @@
+#version 120
+
+uniform mat4 mat_m;
+uniform mat4 mat_v;
+uniform mat4 mat_p;
+
+// see classes/items/trail_path.py
+uniform float time_now; // seconds
+uniform float fade_time; // seconds until a vertex is transparent, 0 for no fading
+
+attribute vec3 position;
+attribute vec4 color;
+attribute float time; // seconds when the vertex was appended
+
+varying vec4 v_color;
+
+void main()
+{
+  gl_Position = mat_p * mat_v * mat_m * vec4(position, 1.0);
+  
+  float fade = 1.0;
+  if (fade_time > 0.0) {
+    fade = 1.0 - clamp((time_now - time) / fade_time, 0.0, 1.0);
+  }
+  v_color = vec4(color.rgb, color.a * fade);
+}
@@ -0,0 +1,32 @@
+from classes.bvh import BVH
+
+
+class FakeItem():
+    def __init__(self, box_min, box_max):
+        self.bounds = (box_min, box_max, None, None)
+        
+    def world_bounds(self):
+        return self.bounds
+    
+    
+def test_query_ray_flat_bounds_within_tolerance():
+    bvh = BVH()
+    line = FakeItem((0, 0, 0), (10, 0, 0)) # a line along X, no thickness
+    bvh.update(line)
+    
+    # passes the line 0.1 units above at a distance of about 10
+    origin, direction = (5, 0.1, 10), (0, 0, -1)
+    assert bvh.query_ray(origin, direction) == []
+    assert [item for t, item in bvh.query_ray(origin, direction, tan_tolerance=0.02)] == [line]
+    assert bvh.query_ray(origin, direction, tan_tolerance=0.005) == []
+    
+    
+def test_query_ray_sorted_by_t():
+    bvh = BVH()
+    near = FakeItem((0, 0, 4), (1, 1, 5))
+    far = FakeItem((0, 0, -5), (1, 1, -4))
+    bvh.update(far)
+    bvh.update(near)
+    hits = bvh.query_ray((0.5, 0.5, 10), (0, 0, -1))
+    assert [item for t, item in hits] == [near, far]
+    assert hits[0][0] == 5
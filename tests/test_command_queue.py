@@ -0,0 +1,86 @@
+import numpy as np
+
+from classes.command_queue import CommandQueue
+
+
+def test_transform_fields_last_wins():
+    queue = CommandQueue()
+    queue.set_transform("a", origin=(1, 2, 3), scale=3)
+    queue.set_transform("a", scale=2)
+    assert queue.take() == [("transform", "a", {"origin": (1, 2, 3), "scale": 2})]
+    
+    
+def test_transform_per_item():
+    queue = CommandQueue()
+    queue.set_transform("a", scale=2)
+    queue.set_transform("b", scale=3)
+    assert queue.take() == [("transform", "a", {"scale": 2}), ("transform", "b", {"scale": 3})]
+
+
+def test_uniform_last_value_wins_per_name():
+    queue = CommandQueue()
+    queue.set_uniform("a", "u", [1])
+    queue.set_uniform("a", "v", [5])
+    queue.set_uniform("a", "u", [2])
+    assert queue.take() == [("uniform", "a", "v", [5]), ("uniform", "a", "u", [2])]
+    
+    
+def test_vertices_last_wins_per_range_and_attributes():
+    queue = CommandQueue()
+    queue.update_vertices("a", 0, {"color": [(1, 0, 0, 1)]})
+    queue.update_vertices("a", 0, {"position": [(1, 1, 1)]})
+    queue.update_vertices("a", 0, {"position": [(2, 2, 2)]})
+    queue.update_vertices("a", 1, {"position": [(3, 3, 3)]})
+    assert queue.take() == [
+        ("vertices", "a", 0, 1, {"color": [(1, 0, 0, 1)]}),
+        ("vertices", "a", 0, 1, {"position": [(2, 2, 2)]}),
+        ("vertices", "a", 1, 1, {"position": [(3, 3, 3)]}),
+        ]
+    
+    
+def test_vertices_structured_array():
+    queue = CommandQueue()
+    vertices = np.zeros(2, [("position", np.float32, 3)])
+    queue.update_vertices("a", 0, {"position": [(1, 1, 1), (2, 2, 2)]})
+    queue.update_vertices("a", 0, vertices)
+    commands = queue.take()
+    assert len(commands) == 1
+    assert commands[0][4] is vertices
+    
+    
+def test_create_and_remove_are_barriers():
+    queue = CommandQueue()
+    queue.set_transform("a", origin=(1, 2, 3))
+    queue.item_remove("a")
+    queue.item_create("Item", "a", "simple3d")
+    queue.set_transform("a", scale=2)
+    assert queue.take() == [
+        ("transform", "a", {"origin": (1, 2, 3)}),
+        ("remove", "a"),
+        ("create", "Item", "a", "simple3d"),
+        ("transform", "a", {"scale": 2}),
+        ]
+    
+    
+def test_coalescing_within_runs_between_barriers():
+    queue = CommandQueue()
+    queue.set_uniform("a", "u", [1])
+    queue.set_uniform("a", "u", [2])
+    queue.item_create("Item", "b", "simple3d")
+    queue.set_uniform("a", "u", [3])
+    queue.set_uniform("a", "u", [4])
+    assert queue.take() == [
+        ("uniform", "a", "u", [2]),
+        ("create", "Item", "b", "simple3d"),
+        ("uniform", "a", "u", [4]),
+        ]
+    
+    
+def test_take_empties_queue_and_notifies():
+    notified = []
+    queue = CommandQueue(lambda: notified.append(True))
+    queue.item_remove("a")
+    assert len(queue) == 1 and len(notified) == 1
+    queue.take()
+    assert len(queue) == 0
+    assert queue.take() == []
@@ -0,0 +1,37 @@
+import numpy as np
+
+from classes.frustum import Frustum
+
+
+def unit_cube():
+    # with the identity as Projection * View, the frustum is the cube -1..1
+    return Frustum(np.identity(4).ravel().tolist())
+
+
+def test_planes_point_inwards():
+    frustum = unit_cube()
+    assert np.allclose(np.linalg.norm(frustum.normals, axis=1), 1)
+    assert np.all(frustum.normals.dot([0, 0, 0]) + frustum.distances > 0)
+    
+    
+def test_intersects_sphere():
+    frustum = unit_cube()
+    assert frustum.intersects_sphere(np.array([0, 0, 0]), 0.1)
+    assert frustum.intersects_sphere(np.array([1.5, 0, 0]), 0.6)
+    assert not frustum.intersects_sphere(np.array([1.5, 0, 0]), 0.4)
+    
+    
+def test_intersects_aabb():
+    frustum = unit_cube()
+    assert frustum.intersects_aabb(np.array([0.5, 0.5, 0.5]), np.array([2, 2, 2]))
+    assert not frustum.intersects_aabb(np.array([1.1, -1, -1]), np.array([2, 1, 1]))
+    
+    
+def test_classify_box():
+    frustum = unit_cube()
+    assert frustum.classify_box([-0.5, -0.5, -0.5, 0.5, 0.5, 0.5]) == 1
+    assert frustum.classify_box([0.5, -0.5, -0.5, 1.5, 0.5, 0.5]) == 0
+    assert frustum.classify_box([-3, -3, 1.5, 3, 3, 2]) == -1
+    
+    # agrees with intersects_aabb
+    assert frustum.classify_box([1.1, -1, -1, 2, 1, 1]) == -1
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("OpenGL")
+
+from classes.command_queue import CommandQueue
+from classes.items.height_map import HeightMap
+from classes.vertex_format import VertexFormat
+
+
+class FakePainter():
+    def __init__(self, *items):
+        self.items = {item.label: item for item in items}
+        
+    def item_get(self, label):
+        return self.items.get(label)
+
+
+def grid(nodes_x, nodes_y):
+    pos_col = VertexFormat.standard.empty(nodes_x * nodes_y)
+    xs, ys = np.meshgrid(np.arange(nodes_x), np.arange(nodes_y))
+    pos_col["position"][:, 0] = xs.ravel()
+    pos_col["position"][:, 1] = ys.ravel()
+    pos_col["color"] = (1, 1, 1, 1)
+    return pos_col
+
+
+@pytest.mark.parametrize("primitive_restart", [False, True])
+def test_pick(primitive_restart):
+    item = HeightMap("h", None, 3, 3, grid(3, 3), True, primitive_restart=primitive_restart)
+    
+    # straight down onto the edge between nodes 4 and 5
+    hit = item.pick((1.5, 1, 10), (0, 0, -1), 0.01)
+    assert hit != None
+    assert sorted(hit["segment"]) == [4, 5]
+    assert np.allclose(hit["position"], (1.5, 1, 0))
+    
+    
+def test_segments_do_not_cross_restarts():
+    item = HeightMap("h", None, 3, 3, grid(3, 3), True, primitive_restart=True)
+    index = item.segment_index()
+    segments = np.stack((index.seg_a, index.seg_b), axis=1)
+    assert segments.max() < 9
+    
+    # rows of the lattice are one unit apart, strips only connect adjacent rows
+    rows = segments // 3
+    assert np.all(np.abs(rows[:, 0] - rows[:, 1]) <= 1)
+    
+    
+def test_vertices_command_updates_heights():
+    item = HeightMap("h", None, 3, 3, grid(3, 3), True)
+    item._z_dirty = None
+    
+    # nodes 2 to 4 span the end of row 0 and the start of row 1
+    positions = item.vdata_pos_col["position"][2:5].copy()
+    positions[:, 2] = (1, 2, 3)
+    queue = CommandQueue()
+    queue.update_vertices("h", 2, {"position": positions})
+    queue.apply(FakePainter(item))
+    
+    assert item.vdata_z.tolist() == [0, 0, 1, 2, 3, 0, 0, 0, 0]
+    assert item.vdata_pos_col["position"][:, 2].tolist() == item.vdata_z.tolist()
+    assert item._z_dirty == (2, 5)
+    assert item.height_max == 3
+    assert item.uniforms["height_max"] == [3]
+    
+    
+def strip_triangles(indices, restart_index=None):
+    # non-degenerate triangles of a triangle strip, as sorted vertex tuples
+    triangles = set()
+    strips = [indices.tolist()]
+    if restart_index != None:
+        strips = [strip.tolist() for strip in np.split(indices, np.flatnonzero(indices == restart_index))]
+        strips = [[i for i in strip if i != restart_index] for strip in strips]
+    for strip in strips:
+        for i in range(len(strip) - 2):
+            triangle = tuple(sorted(strip[i:i + 3]))
+            if len(set(triangle)) == 3:
+                triangles.add(triangle)
+    return triangles
+
+
+def test_indices_serpentine():
+    indices = HeightMap.indices(3, 3)
+    assert indices.dtype == np.uint16
+    assert not indices.flags.writeable
+    assert HeightMap.indices(3, 3) is indices
+    assert indices.tolist() == [0, 3, 1, 4, 2, 5, 5, 8, 4, 7, 3, 6, 6]
+    
+    
+def test_indices_restart():
+    indices = HeightMap.indices(3, 3, True)
+    assert indices.tolist() == [3, 0, 4, 1, 5, 2, 65535, 6, 3, 7, 4, 8, 5]
+    
+    # both strips cover each cell of the grid with 2 triangles
+    for triangles in (strip_triangles(indices, 65535), strip_triangles(HeightMap.indices(3, 3))):
+        cells = [(min(v // 3 for v in triangle), min(v % 3 for v in triangle)) for triangle in triangles]
+        assert sorted(cells) == [(0, 0), (0, 0), (0, 1), (0, 1), (1, 0), (1, 0), (1, 1), (1, 1)]
+    
+    
+def test_indices_type():
+    # 65536 nodes fit into 16 bits, but then there is no restart index left
+    assert HeightMap.indices(256, 256).dtype == np.uint16
+    assert HeightMap.indices(256, 256, True).dtype == np.uint32
+    assert HeightMap.indices(256, 256, True).max() == 0xFFFFFFFF
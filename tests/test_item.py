@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("OpenGL")
+
+from OpenGL.GL import GL_LINES, GL_UNSIGNED_SHORT
+
+from classes.command_queue import CommandQueue
+from classes.items import item as item_module
+from classes.items.item import Item
+from classes.vertex_format import VertexFormat
+
+
+class FakePainter():
+    def __init__(self, *items):
+        self.items = {item.label: item for item in items}
+        
+    def item_get(self, label):
+        return self.items.get(label)
+    
+    
+def test_update_vertices_encodes_structured_floats():
+    item = Item("a", None, vertexcount_max=2, vertex_format=VertexFormat.compact)
+    vertices = np.zeros(2, [("position", np.float32, 3), ("color", np.float32, 4)])
+    vertices["position"] = [(1, 2, 3), (4, 5, 6)]
+    vertices["color"] = [(1, 0.5, 0, 1), (0, 0, 1, 1)]
+    
+    queue = CommandQueue()
+    queue.update_vertices("a", 0, vertices)
+    queue.apply(FakePainter(item))
+    
+    assert item.vertexcount == 2
+    assert item.vdata_pos_col["color"].tolist() == [[255, 128, 0, 255], [0, 0, 255, 255]]
+    assert item.vdata_pos_col["position"].tolist() == [[1, 2, 3], [4, 5, 6]]
+    
+    
+def test_update_vertices_copies_encoded_values():
+    item = Item("a", None, vertexcount_max=1, vertex_format=VertexFormat.compact)
+    item.update_vertices(0, {"color": np.array([(255, 128, 0, 255)], dtype=np.uint8)})
+    assert item.vdata_pos_col["color"].tolist() == [[255, 128, 0, 255]]
+    
+    
+def test_vertex_queries_follow_ancestors():
+    parent = Item("p", None)
+    child = Item("c", None, vertexcount_max=3)
+    child.append_vertices([[(0, 0, 0), (1, 1, 1, 1)], [(1, 0, 0), (1, 1, 1, 1)], [(0, 2, 0), (1, 1, 1, 1)]])
+    child.set_parent(parent)
+    child.set_scale(2)
+    tree = child.kdtree()
+    
+    # local (1, 0, 0) is at world (10, 2, 0) after moving and rotating the parent
+    parent.set_origin((10, 0, 0))
+    parent.set_rotation(90, (0, 0, 1))
+    assert child.kdtree() is tree
+    vertex, distance = child.nearest_vertex((10, 2.5, 0))
+    assert vertex == 1
+    assert distance == pytest.approx(0.5)
+    assert child.vertices_within_radius((10, 0, 0), 2.5).tolist() == [0, 1]
+    assert child.vertices_within_box((5, -1, -1), (9.5, 0.5, 1)).tolist() == [2]
+    
+    
+def polyline_as_lines(points):
+    # each segment with its own 2 vertices, as GL_LINES
+    item = Item("a", None, GL_LINES, vertexcount_max=2 * (len(points) - 1))
+    for a, b in zip(points[:-1], points[1:]):
+        item.append_vertices([[a, (1, 1, 1, 1)], [b, (1, 1, 1, 1)]])
+    return item
+
+
+def test_weld():
+    points = [(0, 0, 0), (1, 0, 0), (2, 0, 0), (3, 0, 0)]
+    item = polyline_as_lines(points)
+    segments = item.segment_index()
+    drawn = segments.positions[np.stack((segments.seg_a, segments.seg_b), axis=1)]
+    
+    assert item.weld() == 2
+    assert item.vertexcount == 4
+    assert item.vdata_indices.tolist() == [0, 1, 1, 2, 2, 3]
+    assert item.vdata_indices.dtype == np.uint16
+    assert item.positions()[0:4].tolist() == [list(point) for point in points]
+    assert item.vertex_order().tolist() == [0, 1, 1, 2, 2, 3]
+    
+    # the same segments in the same order
+    segments = item.segment_index()
+    assert np.array_equal(segments.positions[np.stack((segments.seg_a, segments.seg_b), axis=1)], drawn)
+    
+    
+def test_weld_keeps_different_colors():
+    item = polyline_as_lines([(0, 0, 0), (1, 0, 0), (2, 0, 0)])
+    item.vdata_pos_col["color"][2] = (1, 0, 0, 1)
+    assert item.weld() == 0
+    assert item.vertexcount == 4
+    
+    
+def test_weld_draws_elements(monkeypatch):
+    calls = []
+    monkeypatch.setattr(item_module, "glDrawElements", lambda *args: calls.append(args[0:3]))
+    monkeypatch.setattr(item_module, "glDrawArrays", lambda *args: calls.append(args))
+    
+    item = polyline_as_lines([(0, 0, 0), (1, 0, 0), (2, 0, 0)])
+    item.draw_primitives(None)
+    item.weld()
+    item.draw_primitives(None)
+    assert calls == [(GL_LINES, 0, 4), (GL_LINES, 4, GL_UNSIGNED_SHORT)]
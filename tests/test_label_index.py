@@ -0,0 +1,50 @@
+from classes.label_index import LabelIndex
+
+
+def index_of(*labels):
+    index = LabelIndex()
+    for label in labels:
+        index.add(label, label.upper())
+    return index
+
+
+def test_pop_group():
+    index = index_of("job4", "job42", "job42/contour", "job42/contour/3", "job43")
+    assert index.pop_matching("job42/*") == [("job42", "JOB42"), ("job42/contour", "JOB42/CONTOUR"), ("job42/contour/3", "JOB42/CONTOUR/3")]
+    assert index.labels == ["job4", "job43"]
+    assert "job42" not in index
+    
+    
+def test_literal_prefix_next_to_longer_sibling():
+    index = index_of("a", "ab", "a/b", "b")
+    
+    # "a/" excludes the sibling "ab", "a" includes it
+    assert index.with_prefix("a/") == ["a/b"]
+    assert index.in_group("a") == ["a", "a/b"]
+    assert index.pop_matching("a") == [("a", "A"), ("a/b", "A/B"), ("ab", "AB")]
+    assert index.labels == ["b"]
+    
+    
+def test_regexp_fallback():
+    index = index_of("job1/a", "job2/b", "job10/c", "other")
+    assert not LabelIndex.is_literal("job[12]/")
+    assert index.match("job[12]/") == ["job1/a", "job2/b"]
+    assert index.match("job") == ["job1/a", "job10/c", "job2/b"]
+    assert index.match(".*/c") == ["job10/c"]
+    assert index.pop_matching("job[12]/") == [("job1/a", "JOB1/A"), ("job2/b", "JOB2/B")]
+    assert index.labels == ["job10/c", "other"]
+    
+    
+def test_add_after_pop():
+    index = index_of("a", "a/b")
+    index.pop_matching("a/*")
+    assert len(index) == 0
+    
+    index.add("a/b", 1)
+    index.add("a/b", 2) # replaces
+    assert index.labels == ["a/b"]
+    assert index.get("a/b") == 2
+    assert index.in_group("a") == ["a/b"]
+    assert index.pop("a/b") == 2
+    assert index.pop("a/b") == None
+    assert index.labels == []
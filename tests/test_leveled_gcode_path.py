@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("OpenGL")
+
+from classes.items.item import Item
+from classes.items.height_map import HeightMap
+from classes.items.leveled_gcode_path import LeveledGcodePath
+from classes.vertex_format import VertexFormat
+
+
+class FakeGcodePath(Item):
+    """
+    The vertices of a GcodePath for given G-code lines, their motion
+    modes and target positions, without interpreting the G-code.
+    """
+    def __init__(self, gcode, motion_modes, targets):
+        super(FakeGcodePath, self).__init__("g", None, vertexcount_max=2 * len(gcode) + 1)
+        self.gcode = gcode
+        self.line_motion_modes = np.array(motion_modes, dtype=np.int8)
+        self.vertex_lines = np.zeros(self.vertexcount_max, dtype=np.int32)
+        
+        # 2 segments per line, the first one short, like GcodePath
+        vertices = [(0, 0, 0)]
+        start = np.zeros(3)
+        for line_number, target in enumerate(targets):
+            target = np.array(target, dtype=np.float64)
+            vertices += [start + (target - start) * 0.001, target]
+            self.vertex_lines[2 * line_number + 1:2 * line_number + 3] = line_number
+            start = target
+        self.append_vertices([[vertex, (1, 1, 1, 1)] for vertex in vertices])
+        
+        
+def tilted_heightmap():
+    # 11 x 11 nodes 10 units apart, z = 0.01 x
+    pos_col = VertexFormat.standard.empty(121)
+    xs, ys = np.meshgrid(np.arange(11) * 10, np.arange(11) * 10)
+    pos_col["position"][:, 0] = xs.ravel()
+    pos_col["position"][:, 1] = ys.ravel()
+    pos_col["position"][:, 2] = xs.ravel() * 0.01
+    return HeightMap("h", None, 11, 11, pos_col, True)
+
+
+def test_to_gcode_rewrites_only_straight_moves():
+    gcode = [
+        "G0 X0 Y0 Z1",
+        "M3 S1000",
+        "G1 X20 Z0 F300 (cut)",
+        "G2 X30 Y10 I0 J10",
+        "G38.2 Z-5 F50",
+        "G1 X40",
+        ]
+    motion_modes = [0, 0, 1, 2, 1, 1]
+    targets = [(0, 0, 1), (0, 0, 1), (20, 0, 0), (30, 10, 0), (30, 10, -5), (40, 10, -5)]
+    path = FakeGcodePath(gcode, motion_modes, targets)
+    leveled = LeveledGcodePath("l", None, path, tilted_heightmap())
+    
+    # the cut is split halfway between the end of its short first
+    # segment and its target, and lifted by 0.01 x
+    result = leveled.to_gcode()
+    assert result == [
+        "G53 G0 X0.0000 Y0.0000 Z1.0000",
+        "M3 S1000",
+        "G53 G1 F300 X10.0100 Y0.0000 Z0.5996",
+        "G53 G1 X20.0000 Y0.0000 Z0.2000",
+        "G2 X30 Y10 I0 J10",
+        "G38.2 Z-5 F50",
+        "G53 G1 X40.0000 Y10.0000 Z-4.6000",
+        ]
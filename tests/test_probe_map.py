@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from classes.items.probe_map import ProbeMap
+
+
+class FakeHeightMap():
+    def __init__(self, nodes_x, nodes_y):
+        self.nodes_x = nodes_x
+        self.nodes_y = nodes_y
+        self.vdata_pos_col = np.zeros(nodes_x * nodes_y, [("position", np.float32, 3)])
+        xs, ys = np.meshgrid(np.arange(nodes_x), np.arange(nodes_y))
+        self.vdata_pos_col["position"][:, 0] = xs.ravel()
+        self.vdata_pos_col["position"][:, 1] = ys.ravel()
+        self.z = np.zeros((nodes_y, nodes_x))
+        self.updates = []
+        
+    def update_z(self, z, row0=0, col0=0):
+        rows, cols = z.shape
+        self.z[row0:row0 + rows, col0:col0 + cols] = z
+        self.updates.append((row0, col0, rows, cols))
+        
+        
+def plane(points):
+    points = np.array(points, dtype=np.float64, ndmin=2)
+    return 1 + 0.5 * points[:, 0] - 0.25 * points[:, 1]
+
+
+def test_corners_reproduce_plane():
+    heightmap = FakeHeightMap(5, 4)
+    probes = ProbeMap(heightmap)
+    
+    # 4 points on a circle are triangulated without Qhull's incremental mode
+    corners = [(0, 0), (4, 0), (0, 3), (4, 3)]
+    probes.add(corners, plane(corners))
+    expected = plane(heightmap.vdata_pos_col["position"][:, 0:2]).reshape(4, 5)
+    assert np.allclose(heightmap.z, expected)
+    
+    # incremental from now on
+    probes.add((2, 1.5), 10)
+    assert probes._incremental
+    assert heightmap.z[1, 2] > expected[1, 2]
+    assert heightmap.z[0, 0] == pytest.approx(expected[0, 0])
+    
+    
+def test_outside_of_hull_is_fill_value():
+    heightmap = FakeHeightMap(5, 5)
+    probes = ProbeMap(heightmap, fill_value=-1)
+    
+    probes.add([(0, 0), (2, 0)], [1, 1])
+    assert heightmap.updates == [] # no triangle yet
+    
+    probes.add((0, 2), 1)
+    assert heightmap.z[0, 0] == 1
+    assert heightmap.z[4, 4] == -1
+    
+    
+def test_set_value_updates_surrounding_nodes():
+    heightmap = FakeHeightMap(9, 9)
+    probes = ProbeMap(heightmap)
+    lattice = [(x, y) for y in (0, 4, 8) for x in (0, 4, 8)]
+    probes.add(lattice + [(1, 1)], np.zeros(10))
+    heightmap.updates = []
+    
+    probes.set_value(9, 3)
+    assert heightmap.z[1, 1] == pytest.approx(3)
+    assert heightmap.z[8, 8] == 0
+    
+    # only the block of the triangles around the probe point is written
+    assert heightmap.updates == [(0, 0, 5, 5)]
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("OpenGL")
+
+from OpenGL.GL import GL_LINES, GL_LINE_STRIP, GL_LINE_LOOP, GL_TRIANGLES, GL_TRIANGLE_STRIP
+
+from classes.segment_index import SegmentIndex
+
+
+def pairs(order, primitive_type):
+    a, b = SegmentIndex.segments(np.array(order), primitive_type)
+    return list(zip(a.tolist(), b.tolist()))
+
+
+def test_segments():
+    assert pairs([0, 1, 2, 3, 4], GL_LINES) == [(0, 1), (2, 3)]
+    assert pairs([0, 1, 2], GL_LINE_STRIP) == [(0, 1), (1, 2)]
+    assert pairs([0, 1, 2], GL_LINE_LOOP) == [(0, 1), (1, 2), (2, 0)]
+    assert pairs([0, 1, 2], GL_TRIANGLES) == [(0, 1), (1, 2), (2, 0)]
+    assert pairs([0, 1, 2, 3], GL_TRIANGLE_STRIP) == [(0, 1), (0, 2), (1, 2), (1, 3), (2, 3)]
+    
+    
+def test_restart_index_separates_strips():
+    positions = np.zeros((6, 3))
+    index = SegmentIndex(positions, GL_TRIANGLE_STRIP, [0, 1, 2, 255, 3, 4, 5], restart_index=255)
+    segments = list(zip(index.seg_a.tolist(), index.seg_b.tolist()))
+    assert segments == [(0, 1), (0, 2), (1, 2), (3, 4), (3, 5), (4, 5)]
+    
+    
+def test_query_ray_finds_closest_segment():
+    # two parallel lines along X, at y = 0 and y = 1
+    positions = np.array([(0, 0, 0), (10, 0, 0), (0, 1, 0), (10, 1, 0)], dtype=np.float64)
+    index = SegmentIndex(positions, GL_LINES)
+    assert len(index) == 2
+    
+    direction = np.array([0, 0, -1.0])
+    segment, s, t, tan_angle = index.query_ray(np.array([5, 0.9, 10.0]), direction, 0.02)
+    assert segment == 1
+    assert s == pytest.approx(0.5)
+    assert t == pytest.approx(10)
+    assert tan_angle == pytest.approx(0.01)
+    
+    assert index.query_ray(np.array([5, 0.5, 10.0]), direction, 0.02) == None
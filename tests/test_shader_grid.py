@@ -0,0 +1,40 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("OpenGL")
+
+from classes.items.shader_grid import ShaderGrid
+
+SHADERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shaders")
+
+
+def quad_view_positions(extent, height):
+    # the quad seen from `height` above its center, in view space
+    return np.array([(x, -height, z) for x in (-extent, extent) for z in (-extent, extent)], dtype=np.float64)
+
+
+def test_visible_near_camera_on_large_quad():
+    corners = quad_view_positions(100000, 100)
+    center = corners.mean(axis=0) # linear interpolation of the corners
+    assert ShaderGrid.fade(center, 5000) == 1
+    
+    # interpolating the distances instead would hide the grid
+    distances = np.linalg.norm(corners, axis=1)
+    assert distances.mean() > 5000
+    
+    
+def test_fades_out_with_distance():
+    assert ShaderGrid.fade((0, -100, -2400), 5000) == 1
+    assert 0 < ShaderGrid.fade((0, -100, -3750), 5000) < 1
+    assert ShaderGrid.fade((0, -100, -6000), 5000) == 0
+    
+    
+def test_fragment_shader_computes_distance():
+    vertex = open(os.path.join(SHADERS, "grid-vertex.c")).read()
+    fragment = open(os.path.join(SHADERS, "grid-fragment.c")).read()
+    assert "varying vec3 v_position" in vertex
+    assert "length(" not in vertex
+    assert "length(v_position)" in fragment
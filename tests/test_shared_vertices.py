@@ -0,0 +1,100 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from classes.shared_vertices import SharedVertices, build_shared
+
+DTYPE = np.dtype([("position", np.float32, 3), ("color", np.float32, 4)])
+
+
+def build_grid(allocate, count):
+    vertices = allocate(count, DTYPE)
+    vertices["position"][:, 0] = np.arange(count, dtype=np.float32)
+    vertices["color"] = 1
+    return count
+
+
+def build_failing(allocate, count):
+    allocate(count, DTYPE)
+    raise ValueError("builder failed")
+
+
+def shm_segments():
+    return set(os.listdir("/dev/shm"))
+
+
+def measure(count, adopt):
+    """
+    Runs in a fresh interpreter, so that the peak RSS is not the one of
+    earlier tests. Builds `count` vertices in a worker process and maps
+    them, printing the RSS growth in bytes as JSON.
+    """
+    import resource
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import resource_tracker
+    
+    resource_tracker.ensure_running()
+    with ProcessPoolExecutor(1) as executor:
+        executor.submit(int).result() # start the worker before measuring
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        
+        handle, vertexcount = executor.submit(build_shared, build_grid, count).result()
+        shared = SharedVertices.attach(handle)
+        shared.unlink()
+        if adopt:
+            from classes.items.item import Item
+            item = Item("big", None)
+            item.adopt_vertices(shared.array, vertexcount, shared)
+            assert item.bbox_local[1][0] == count - 1
+        else:
+            assert shared.array["position"][:, 0].max() == count - 1
+            
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"growth": (rss_after - rss_before) * 1024}))
+    
+    
+def run_measure(count, adopt):
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = "import sys; sys.path[0:0] = {!r}; import test_shared_vertices as t; t.measure({}, {})".format(
+        [here, os.path.dirname(here)], count, adopt)
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])["growth"]
+
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="needs /dev/shm")
+@pytest.mark.parametrize("adopt", [False, True])
+def test_peak_rss_one_copy(adopt):
+    if adopt:
+        pytest.importorskip("PyQt5")
+        pytest.importorskip("OpenGL")
+    count = 64 * 2**20 // DTYPE.itemsize
+    size = count * DTYPE.itemsize
+    
+    before = shm_segments()
+    growth = run_measure(count, adopt)
+    assert growth < 1.5 * size
+    assert shm_segments() <= before
+    
+    
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="needs /dev/shm")
+def test_failing_builder_leaves_no_segment():
+    before = shm_segments()
+    with pytest.raises(ValueError):
+        build_shared(build_failing, 1000)
+    assert shm_segments() <= before
+    
+    
+def test_attach_shares_memory():
+    shared = SharedVertices.create(DTYPE, 10)
+    try:
+        shared.array["position"][3] = (1, 2, 3)
+        other = SharedVertices.attach(shared.handle())
+        assert other.array["position"][3].tolist() == [1, 2, 3]
+        other.close()
+    finally:
+        shared.close()
+        shared.unlink()
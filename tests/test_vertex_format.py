@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("OpenGL")
+
+from classes.vertex_format import VertexFormat, VertexArrays
+
+
+def test_sizes():
+    assert VertexFormat.standard.dtype.itemsize == 28
+    assert VertexFormat.compact.dtype.itemsize == 16
+    assert VertexFormat.half.dtype.itemsize == 12
+    
+    
+def test_encode_decode_normalized():
+    fmt = VertexFormat.compact
+    assert fmt.is_normalized("color")
+    assert not fmt.is_normalized("position")
+    
+    encoded = fmt.encode("color", [(1, 0.5, 0, 2)])
+    assert encoded.dtype == np.uint8
+    assert encoded.tolist() == [[255, 128, 0, 255]] # clipped
+    assert np.allclose(fmt.decode("color", encoded), [(1, 128 / 255, 0, 1)])
+    
+    positions = np.array([(1, 2, 3)], dtype=np.float32)
+    assert fmt.decode("position", positions) is positions
+    
+    
+def test_from_dtype():
+    fmt = VertexFormat.from_dtype(VertexFormat.compact.dtype, normalized=["color"])
+    assert fmt.dtype == VertexFormat.compact.dtype
+    assert fmt.is_normalized("color")
+    
+    
+def test_separate_storage():
+    fmt = VertexFormat.compact.separate()
+    assert not fmt.interleaved
+    
+    data = fmt.empty(2)
+    assert isinstance(data, VertexArrays)
+    assert len(data) == 2
+    data["position"] = [(1, 2, 3), (4, 5, 6)]
+    data["color"][1] = fmt.encode("color", (1, 1, 1, 1))
+    assert data["position"].flags.c_contiguous
+    assert data.nbytes == 2 * 16
+    
+    extended = fmt.extend(data, 2)
+    assert len(extended) == 4
+    assert extended["position"][0:2].tolist() == [[1, 2, 3], [4, 5, 6]]
+    assert extended["color"][1].tolist() == [255, 255, 255, 255]
+    assert extended["color"][3].tolist() == [0, 0, 0, 0]
+    
+    
+def test_interleaved_storage():
+    data = VertexFormat.standard.extend(VertexFormat.standard.empty(1), 2)
+    assert data.dtype == VertexFormat.standard.dtype
+    assert len(data) == 3